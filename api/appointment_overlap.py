@@ -0,0 +1,101 @@
+"""
+Database-enforced double-booking prevention.
+
+A doctor's scheduled appointments may not overlap: [date_time, end_time)
+intervals of two scheduled appointments for the same doctor must be
+disjoint. The rule is enforced by the database, so concurrent bookings
+can't race past an application-side check:
+
+- PostgreSQL: an exclusion constraint over tstzrange(date_time, end_time)
+- SQLite: BEFORE INSERT/UPDATE triggers that abort with a constraint error
+
+Both surface as django.db.IntegrityError. Every backend additionally has the
+appointment_doctor_slot_uniq partial unique constraint declared on the model.
+
+Appointments are at most MAX_DURATION long; the SQLite triggers rely on that
+bound to range-scan the (doctor, date_time, status) index. Migrations that
+rebuild the appointments table on SQLite (e.g. AddField with a default) drop
+its triggers and must create them again, from a frozen copy of install_sql()
+(see 0006_appointment_end_time and 0008_updated_at) rather than by importing
+this module.
+"""
+from datetime import timedelta
+
+
+MAX_DURATION = timedelta(minutes=480)
+
+OVERLAP_MESSAGE = "appointment overlaps a scheduled appointment for this doctor"
+
+
+def _sqlite_trigger(name, event, exclude_self):
+    minutes = int(MAX_DURATION.total_seconds() // 60)
+    exclude = " AND id != new.id" if exclude_self else ""
+    return (
+        f"CREATE TRIGGER {name} BEFORE {event} ON appointments\n"
+        "WHEN new.status = 'scheduled'\n"
+        "BEGIN\n"
+        f"SELECT RAISE(ABORT, '{OVERLAP_MESSAGE}') WHERE EXISTS (\n"
+        "SELECT 1 FROM appointments\n"
+        "WHERE doctor_id = new.doctor_id AND status = 'scheduled'\n"
+        f"AND date_time > datetime(new.date_time, '-{minutes} minutes')\n"
+        f"AND date_time < new.end_time AND end_time > new.date_time{exclude}\n"
+        ");\n"
+        "END"
+    )
+
+
+def install_sql(vendor):
+    if vendor == "sqlite":
+        return uninstall_sql(vendor) + [
+            _sqlite_trigger("appointments_no_overlap_ai", "INSERT", exclude_self=False),
+            _sqlite_trigger("appointments_no_overlap_au", "UPDATE", exclude_self=True),
+        ]
+    if vendor == "postgresql":
+        return uninstall_sql(vendor) + [
+            "CREATE EXTENSION IF NOT EXISTS btree_gist",
+            "ALTER TABLE appointments ADD CONSTRAINT appointments_no_overlap "
+            "EXCLUDE USING gist (doctor_id WITH =, tstzrange(date_time, end_time) WITH &&) "
+            "WHERE (status = 'scheduled')",
+        ]
+    return []
+
+
+def uninstall_sql(vendor):
+    if vendor == "sqlite":
+        return [
+            "DROP TRIGGER IF EXISTS appointments_no_overlap_ai",
+            "DROP TRIGGER IF EXISTS appointments_no_overlap_au",
+        ]
+    if vendor == "postgresql":
+        return ["ALTER TABLE appointments DROP CONSTRAINT IF EXISTS appointments_no_overlap"]
+    return []
+
+
+def install(schema_editor):
+    for statement in install_sql(schema_editor.connection.vendor):
+        schema_editor.execute(statement)
+
+
+def uninstall(schema_editor):
+    for statement in uninstall_sql(schema_editor.connection.vendor):
+        schema_editor.execute(statement)
+
+
+def find_overlaps(occurrences, booked):
+    """Occurrences, as (start, end) pairs, that overlap any `booked` interval.
+
+    Both lists must be sorted by start, and the occurrences must not overlap
+    each other (as in an expanded series); one pass over both lists.
+    """
+    overlapping = []
+    index = 0
+    latest_end = None
+    for start, end in occurrences:
+        # Latest end among the bookings that start before this occurrence ends
+        while index < len(booked) and booked[index][0] < end:
+            if latest_end is None or booked[index][1] > latest_end:
+                latest_end = booked[index][1]
+            index += 1
+        if latest_end is not None and latest_end > start:
+            overlapping.append((start, end))
+    return overlapping
@@ -0,0 +1,114 @@
+"""
+Archival of historical appointments and prescriptions.
+
+Completed and canceled appointments older than ARCHIVE_AFTER_DAYS move out
+of the `appointments` table into `appointments_archive`, together with their
+prescriptions (into `prescriptions_archive`, still pointing at their
+appointment). Rows keep their ids. Run `manage.py archive_history`
+regularly, e.g. nightly. The hot tables then hold a rolling window of
+ARCHIVE_AFTER_DAYS plus scheduled appointments, however long the clinic has
+been running, and the list filters and double-booking checks only scan
+that window.
+
+Every row in the archive is dated before archive_cutoff(). An appointment
+with a prescription issued on or after the cutoff waits until the
+prescription is old enough too. So a read can tell from the period it
+covers alone whether the archive may hold part of it:
+
+- billing_report (both the raw and the rollup paths) and the billing export
+  add the archive when the period starts before the cutoff
+- patient reads with ?include=appointments or ?include=prescriptions, a
+  patient's whole history, always include the archive
+
+The appointment and prescription lists, their exports and the booking
+checks read the hot tables only.
+
+Each batch moves in one transaction. An interrupted run loses nothing, and
+the next run picks up where it stopped. The hot rows are deleted with
+QuerySet.delete(), so delete signals fire as usual; the billing rollup
+buckets they touch are refreshed once per batch, after the archive copies
+exist, and come out unchanged since the rollup counts archived rows as well
+(see api/billing_rollup.py).
+Leave ARCHIVE_AFTER_DAYS set once rows have been archived: with it unset,
+reads ignore the archive.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Appointment, Prescription, ArchivedAppointment, ArchivedPrescription
+
+
+ARCHIVED_STATUSES = (Appointment.STATUS_COMPLETED, Appointment.STATUS_CANCELED)
+
+
+def archive_after_days():
+    return getattr(settings, "ARCHIVE_AFTER_DAYS", None)
+
+
+def archive_enabled():
+    return archive_after_days() is not None
+
+
+def archive_cutoff():
+    """The day from which on everything stays in the hot tables, or None when archival is off."""
+    days = archive_after_days()
+    if days is None:
+        return None
+    return timezone.localdate() - timedelta(days=days)
+
+
+def period_needs_archive(start):
+    """Whether a period starting on `start` (a date) may have rows in the archive."""
+    cutoff = archive_cutoff()
+    return cutoff is not None and start < cutoff
+
+
+def year_needs_archive(year, month=None):
+    return period_needs_archive(date(year, month or 1, 1))
+
+
+def eligible_appointments(cutoff):
+    """Ids of the hot appointments due for the archive, oldest first."""
+    cutoff_start = datetime.combine(cutoff, time.min, tzinfo=timezone.get_current_timezone())
+    return (
+        Appointment.objects
+        .filter(status__in=ARCHIVED_STATUSES, date_time__lt=cutoff_start)
+        .exclude(prescription__date_issued__gte=cutoff)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+
+def _columns(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def archive_batch(cutoff, batch_size):
+    """Move one batch of appointments and their prescriptions; returns (appointments, prescriptions) moved."""
+    # billing_rollup imports this module
+    from . import billing_rollup
+
+    with transaction.atomic():
+        ids = list(eligible_appointments(cutoff)[:batch_size])
+        if not ids:
+            return 0, 0
+
+        now = timezone.now()
+        appointments = Appointment.objects.filter(id__in=ids)
+        prescriptions = Prescription.objects.filter(appointment_id__in=ids)
+        ArchivedAppointment.objects.bulk_create([
+            ArchivedAppointment(**row, archived_at=now)
+            for row in appointments.values(*_columns(Appointment))
+        ])
+        moved_prescriptions = ArchivedPrescription.objects.bulk_create([
+            ArchivedPrescription(**row, archived_at=now)
+            for row in prescriptions.values(*_columns(Prescription))
+        ])
+
+        # Deleting the appointments cascades to their prescriptions
+        with billing_rollup.deferred_refresh():
+            appointments.delete()
+    return len(ids), len(moved_prescriptions)
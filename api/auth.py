@@ -0,0 +1,179 @@
+"""
+JWT authentication with a cached principal.
+
+ninja_jwt's JWTAuth loads the User row on every request, and doctor-scoped
+endpoints then load the Doctor row through `user.doctor`. ClinicFlowAuth
+resolves both in a single query the first time a user is seen and caches
+the result as a small Principal (id, role, doctor_id, ...) for
+AUTH_PRINCIPAL_CACHE_TIMEOUT seconds, so role checks and doctor scoping
+run without touching the database.
+
+Saving or deleting a User or Doctor drops that user's cached principal
+(see api/signals.py). With the default per-process cache, other worker
+processes pick the change up when their entry expires; configure a shared
+cache backend in CACHES to invalidate everywhere at once.
+"""
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from ninja_jwt.authentication import JWTAuth
+from ninja_jwt.exceptions import AuthenticationFailed, InvalidToken
+from ninja_jwt.settings import api_settings
+from ninja_extra.security import AsyncHttpBearer
+
+from .metrics import AUTH_SECONDS
+from .models import User
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    role: str
+    doctor_id: int | None
+    is_active: bool
+
+    is_authenticated = True
+    is_anonymous = False
+
+    @property
+    def pk(self):
+        return self.id
+
+
+def principal_cache_key(user_id):
+    return f"clinicflow:principal:{user_id}"
+
+
+def principal_cache_timeout():
+    return getattr(settings, "AUTH_PRINCIPAL_CACHE_TIMEOUT", 60)
+
+
+def _principal_from_row(row):
+    return Principal(
+        id=row["id"],
+        username=row["username"],
+        role=row["role"],
+        doctor_id=row["doctor__id"],
+        is_active=row["is_active"],
+    )
+
+
+def _principal_query(user_id):
+    # One query for the user and, for doctors, their doctor id
+    return (
+        User.objects
+        .filter(**{api_settings.USER_ID_FIELD: user_id})
+        .values("id", "username", "role", "is_active", "doctor__id")
+    )
+
+
+def load_principal(user_id):
+    row = _principal_query(user_id).first()
+    if row is None:
+        return None
+    return _principal_from_row(row)
+
+
+def get_principal(user_id):
+    key = principal_cache_key(user_id)
+    principal = cache.get(key)
+    if principal is None:
+        principal = load_principal(user_id)
+        if principal is not None:
+            cache.set(key, principal, principal_cache_timeout())
+    return principal
+
+
+async def aget_principal(user_id):
+    key = principal_cache_key(user_id)
+    principal = await cache.aget(key)
+    if principal is None:
+        row = await _principal_query(user_id).afirst()
+        if row is None:
+            return None
+        principal = _principal_from_row(row)
+        await cache.aset(key, principal, principal_cache_timeout())
+    return principal
+
+
+def invalidate_principal(user_id):
+    cache.delete(principal_cache_key(user_id))
+
+
+def _user_id(validated_token):
+    try:
+        return validated_token[api_settings.USER_ID_CLAIM]
+    except KeyError as e:
+        raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+
+def _check_principal(principal):
+    if principal is None:
+        raise AuthenticationFailed(_("User not found"))
+
+    if not principal.is_active:
+        raise AuthenticationFailed(_("User is inactive"))
+
+    return principal
+
+
+class ClinicFlowAuth(JWTAuth):
+    def authenticate(self, request, token):
+        started = time.perf_counter()
+        try:
+            return super().authenticate(request, token)
+        finally:
+            AUTH_SECONDS.observe(time.perf_counter() - started)
+
+    def get_user(self, validated_token):
+        return _check_principal(get_principal(_user_id(validated_token)))
+
+
+class AsyncClinicFlowAuth(ClinicFlowAuth, AsyncHttpBearer):
+    # For async operations: token validation is CPU-only and the principal
+    # comes from the cache or the async ORM, so nothing blocks the event loop.
+
+    async def authenticate(self, request, token):
+        started = time.perf_counter()
+        try:
+            request.user = AnonymousUser()
+            validated_token = self.get_validated_token(token)
+            principal = _check_principal(await aget_principal(_user_id(validated_token)))
+            request.user = principal
+            return principal
+        finally:
+            AUTH_SECONDS.observe(time.perf_counter() - started)
+
+
+def _bearer_token(request):
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return token if scheme.lower() == "bearer" and token else None
+
+
+def bearer_principal(request):
+    """The principal of the request's bearer token, or None if it has no valid one.
+
+    For middleware, which runs before an operation authenticates the request.
+    """
+    token = _bearer_token(request)
+    if token is None:
+        return None
+    try:
+        return _check_principal(get_principal(_user_id(ClinicFlowAuth().get_validated_token(token))))
+    except (AuthenticationFailed, InvalidToken):
+        return None
+
+
+async def abearer_principal(request):
+    token = _bearer_token(request)
+    if token is None:
+        return None
+    try:
+        return _check_principal(await aget_principal(_user_id(ClinicFlowAuth().get_validated_token(token))))
+    except (AuthenticationFailed, InvalidToken):
+        return None
@@ -0,0 +1,241 @@
+"""
+Incremental maintenance of the BillingRollup table.
+
+Each row holds the completed appointment and prescription totals of one
+patient for one calendar month. Rows are refreshed from the raw tables
+whenever an appointment or prescription that affects them is saved or
+deleted (see api/signals.py), so billing_report can read a year from at
+most 12 rows per patient.
+
+Saves that bypass model signals (QuerySet.update, bulk_create, raw SQL)
+are not tracked; run `manage.py rebuild_billing_rollup` after those.
+
+Archived appointments and prescriptions (see api/archive.py) count towards
+the rollup like the rows still in the hot tables.
+
+Rows also keep the lowest appointment and prescription id of their bucket,
+which billing_report lists patients by (see first_seen in
+api/endpoints/billing.py).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from .archive import period_needs_archive
+from .models import Appointment, Prescription, ArchivedAppointment, ArchivedPrescription, BillingRollup
+
+
+# (appointments, prescriptions) models the totals are computed from
+SOURCES = ((Appointment, Prescription), (ArchivedAppointment, ArchivedPrescription))
+
+# Keys collected by deferred_refresh(), or None outside of it
+_deferred_keys = ContextVar("billing_rollup_deferred_keys", default=None)
+
+
+def rollup_enabled():
+    return getattr(settings, "BILLING_ROLLUP_ENABLED", False)
+
+
+def month_of(value):
+    # Match the date_time__year / date_time__month lookups used by billing_report
+    if isinstance(value, datetime):
+        value = timezone.localtime(value)
+    return value.year, value.month
+
+
+def _month_bounds(year, month):
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def _empty_bucket():
+    return {
+        "appointment_count": 0,
+        "appointment_total": Decimal("0.00"),
+        "prescription_count": 0,
+        "prescription_total": Decimal("0.00"),
+        "first_appointment_id": None,
+        "first_prescription_id": None,
+    }
+
+
+def lowest(*ids):
+    ids = [pk for pk in ids if pk is not None]
+    return min(ids) if ids else None
+
+
+def _sources(narrow=None, archived=True):
+    # (appointments, prescriptions) querysets of every source, narrowed by
+    # narrow(appointments, prescriptions) when given
+    sources = []
+    for appointment_model, prescription_model in (SOURCES if archived else SOURCES[:1]):
+        appointments, prescriptions = appointment_model.objects.all(), prescription_model.objects.all()
+        if narrow is not None:
+            appointments, prescriptions = narrow(appointments, prescriptions)
+        sources.append((appointments, prescriptions))
+    return sources
+
+
+def compute_buckets(sources=None):
+    """Group raw rows into {(year, month, patient_id): totals}.
+
+    `sources` are (appointments, prescriptions) queryset pairs, the hot and
+    archive tables by default; completed status is always applied to
+    appointments.
+    """
+    if sources is None:
+        sources = _sources()
+
+    buckets = {}
+    for appointments, prescriptions in sources:
+        _add_rows(buckets, appointments, prescriptions)
+    return buckets
+
+
+def _add_rows(buckets, appointments, prescriptions):
+    appointment_rows = (
+        appointments
+        .filter(status=Appointment.STATUS_COMPLETED)
+        .values(
+            year=ExtractYear("date_time"),
+            month=ExtractMonth("date_time"),
+            patient_pk=F("patient_id"),
+        )
+        .annotate(count=Count("id"), total=Sum("appointment_cost"), first_id=Min("id"))
+        .order_by()
+    )
+    for row in appointment_rows:
+        bucket = buckets.setdefault((row["year"], row["month"], row["patient_pk"]), _empty_bucket())
+        bucket["appointment_count"] += row["count"]
+        bucket["appointment_total"] += row["total"] or Decimal("0.00")
+        bucket["first_appointment_id"] = lowest(bucket["first_appointment_id"], row["first_id"])
+
+    prescription_rows = (
+        prescriptions
+        .values(
+            year=ExtractYear("date_issued"),
+            month=ExtractMonth("date_issued"),
+            patient_pk=F("appointment__patient_id"),
+        )
+        .annotate(count=Count("id"), total=Sum("prescription_cost"), first_id=Min("id"))
+        .order_by()
+    )
+    for row in prescription_rows:
+        bucket = buckets.setdefault((row["year"], row["month"], row["patient_pk"]), _empty_bucket())
+        bucket["prescription_count"] += row["count"]
+        bucket["prescription_total"] += row["total"] or Decimal("0.00")
+        bucket["first_prescription_id"] = lowest(bucket["first_prescription_id"], row["first_id"])
+
+
+@contextmanager
+def deferred_refresh():
+    """Collect the keys refreshed inside the block and refresh them once on leaving it."""
+    keys = set()
+    token = _deferred_keys.set(keys)
+    try:
+        yield
+    finally:
+        _deferred_keys.reset(token)
+    if keys:
+        refresh(keys)
+
+
+def refresh(keys):
+    """Recompute the rollup rows for a set of (year, month, patient_id) keys."""
+    pending = _deferred_keys.get()
+    if pending is not None:
+        pending.update(keys)
+        return
+
+    by_month = {}
+    for year, month, patient_id in keys:
+        by_month.setdefault((year, month), set()).add(patient_id)
+
+    tz = timezone.get_current_timezone()
+
+    for (year, month), patient_ids in by_month.items():
+        start, end = _month_bounds(year, month)
+
+        def narrow(appointments, prescriptions):
+            return (
+                appointments.filter(
+                    patient_id__in=patient_ids,
+                    date_time__gte=datetime.combine(start, time.min, tzinfo=tz),
+                    date_time__lt=datetime.combine(end, time.min, tzinfo=tz),
+                ),
+                prescriptions.filter(
+                    appointment__patient_id__in=patient_ids,
+                    date_issued__gte=start,
+                    date_issued__lt=end,
+                ),
+            )
+
+        buckets = compute_buckets(_sources(narrow, archived=period_needs_archive(start)))
+
+        for patient_id in patient_ids:
+            totals = buckets.get((year, month, patient_id))
+            if totals is None:
+                BillingRollup.objects.filter(year=year, month=month, patient_id=patient_id).delete()
+            else:
+                BillingRollup.objects.update_or_create(
+                    year=year, month=month, patient_id=patient_id, defaults=totals
+                )
+
+
+def _year_filter(year):
+    if not year:
+        return None
+    return lambda appointments, prescriptions: (
+        appointments.filter(date_time__year=year),
+        prescriptions.filter(date_issued__year=year),
+    )
+
+
+def rebuild(year=None, batch_size=1000):
+    """Replace the rollup rows (optionally for a single year) from the raw tables."""
+    rollups = BillingRollup.objects.all()
+    if year:
+        rollups = rollups.filter(year=year)
+
+    buckets = compute_buckets(_sources(_year_filter(year)))
+
+    rollups.delete()
+    BillingRollup.objects.bulk_create(
+        [
+            BillingRollup(year=y, month=m, patient_id=patient_id, **totals)
+            for (y, m, patient_id), totals in buckets.items()
+        ],
+        batch_size=batch_size,
+    )
+    return len(buckets)
+
+
+def differences(year=None):
+    """Compare the rollup with the raw tables; returns {key: (stored, expected)}."""
+    rollups = BillingRollup.objects.all()
+    if year:
+        rollups = rollups.filter(year=year)
+
+    expected = compute_buckets(_sources(_year_filter(year)))
+    stored = {
+        (row.pop("year"), row.pop("month"), row.pop("patient_id")): row
+        for row in rollups.values(
+            "year", "month", "patient_id",
+            "appointment_count", "appointment_total",
+            "prescription_count", "prescription_total",
+            "first_appointment_id", "first_prescription_id",
+        )
+    }
+
+    mismatches = {}
+    for key in stored.keys() | expected.keys():
+        if stored.get(key) != expected.get(key):
+            mismatches[key] = (stored.get(key), expected.get(key))
+    return mismatches
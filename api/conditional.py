@@ -0,0 +1,140 @@
+"""
+Conditional GET support: weak ETags and Last-Modified from `updated_at`.
+
+GET operations opt in with @conditional, placed under the router decorator
+like @replica_reads. It checks the validators after the view has produced its
+result but before the response schema serializes it, so a matching
+If-None-Match or If-Modified-Since costs no serialization:
+
+    @patient_router.get("/{patient_id}/", response=PatientReadSchema)
+    @conditional
+    @query_budget(6)
+    def get_patient(request, patient_id: int, ...):
+
+- detail endpoints returning a model instance with `updated_at` are
+  validated by the instance's primary key and updated_at; those rendering a
+  Shape (see api/embeds.py) remember the row's validators themselves
+- paginated list endpoints are validated by CursorPagination: max(updated_at)
+  plus count of the filtered rows in limit/offset mode (read in the same
+  query as the page count), or the primary keys and updated_at of the
+  fetched page in keyset mode, which keeps keyset pages free of a COUNT(*)
+
+ETags also cover the request path, query string and user, since the same
+rows render differently per query (and per doctor scope). If-Modified-Since
+alone can't see rows deleted from a list; clients should prefer the ETag.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.db.models import Count, Max, Model
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from ninja.decorators import decorate_view
+
+
+VALIDATORS_ATTR = "_conditional_validators"
+
+
+def has_updated_at(model):
+    return any(field.name == "updated_at" for field in model._meta.concrete_fields)
+
+
+def _etag(request, *state):
+    user = getattr(request.auth, "pk", None) if hasattr(request, "auth") else None
+    digest = hashlib.sha1(repr((request.get_full_path(), user, state)).encode()).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+def instance_validators(request, instance):
+    return _etag(request, instance._meta.label, instance.pk, instance.updated_at), instance.updated_at
+
+
+def rows_validators(request, model, rows):
+    # Keyset pages: the exact rows fetched, including the look-ahead row
+    state = [
+        (row["pk"] if "pk" in row else row["id"], row["updated_at"]) if isinstance(row, dict)
+        else (row.pk, row.updated_at)
+        for row in rows
+    ]
+    last_modified = max((updated_at for _, updated_at in state), default=None)
+    return _etag(request, model._meta.label, state), last_modified
+
+
+def list_state_query(queryset):
+    return queryset.order_by().aggregate(count=Count("pk"), last_modified=Max("updated_at"))
+
+
+async def alist_state_query(queryset):
+    return await queryset.order_by().aaggregate(count=Count("pk"), last_modified=Max("updated_at"))
+
+
+def list_validators(request, model, state):
+    return _etag(request, model._meta.label, state["count"], state["last_modified"]), state["last_modified"]
+
+
+def remember(request, validators):
+    setattr(request, VALIDATORS_ATTR, validators)
+
+
+def conditional_response(request, validators):
+    # A 304 (or 412 for a failed If-Match) when the preconditions say so, else None
+    etag, last_modified = validators
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    return _set_headers(response, validators) if response is not None else None
+
+
+def _set_headers(response, validators):
+    etag, last_modified = validators
+    response.headers["ETag"] = etag
+    if last_modified:
+        response.headers["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
+
+
+def _not_modified(request, result):
+    # Runs on the view's result: a 304 replaces it before it is serialized
+    validators = getattr(request, VALIDATORS_ATTR, None)
+    if validators is None and isinstance(result, Model) and has_updated_at(type(result)):
+        validators = instance_validators(request, result)
+        remember(request, validators)
+    if validators is None:
+        return result
+    response = conditional_response(request, validators)
+    return response if response is not None else result
+
+
+def _with_validators(run):
+    # Runs on the operation: sends the validators with the serialized 200
+    def set_headers(request, response):
+        validators = getattr(request, VALIDATORS_ATTR, None)
+        if validators is not None and response.status_code == 200:
+            _set_headers(response, validators)
+        return response
+
+    if iscoroutinefunction(run):
+        @wraps(run)
+        async def arun(request, *args, **kwargs):
+            return set_headers(request, await run(request, *args, **kwargs))
+        return arun
+
+    @wraps(run)
+    def conditional_run(request, *args, **kwargs):
+        return set_headers(request, run(request, *args, **kwargs))
+    return conditional_run
+
+
+def conditional(view):
+    """Answer conditional GETs on this operation with 304s, and send ETag / Last-Modified."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def aconditional_view(request, *args, **kwargs):
+            return _not_modified(request, await view(request, *args, **kwargs))
+        wrapper = aconditional_view
+    else:
+        @wraps(view)
+        def conditional_view(request, *args, **kwargs):
+            return _not_modified(request, view(request, *args, **kwargs))
+        wrapper = conditional_view
+    return decorate_view(_with_validators)(wrapper)
@@ -0,0 +1,213 @@
+"""
+Sparse fieldsets and embedded relations for the read endpoints.
+
+`?fields=first_name,last_name` trims each item to those columns (id is
+always kept) and `?include=patient,doctor` embeds related objects, so clients
+don't have to fetch them row by row. Embeds are resolved per page, never per
+row:
+
+- to-one relations are joined into the page query itself, by reading their
+  columns through `.values()` lookups (the select_related of a projection)
+- to-many relations are fetched with one query for every row on the page,
+  scoped like the endpoints that list them: a doctor only gets their own
+  appointments and prescriptions. A patient's appointments and
+  prescriptions take a second query for the archived ones (see
+  api/archive.py) when archival is on
+
+Views build a Shape with shape_for(), which CursorPagination picks up for
+lists; detail views fetch their row with Shape.values() and return
+Shape.render(). Responses use the read schemas with exclude_unset=True.
+Embedded objects change without touching the row they hang off, so
+responses with `include` carry no ETag.
+"""
+from itertools import chain
+from operator import itemgetter
+
+from ninja.errors import HttpError
+
+from . import conditional
+from .archive import archive_enabled
+from .models import Appointment, Prescription, ArchivedAppointment, ArchivedPrescription
+from .schema import AppointmentOutSchema, DoctorOutSchema, PatientOutSchema, PrescriptionOutSchema
+
+
+SHAPE_ATTR = "_response_shape"
+
+
+def _split(value):
+    return list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip())) if value else []
+
+
+class One:
+    """A to-one relation, read through `path__column` lookups on the page query."""
+
+    def __init__(self, path, schema, **columns):
+        self.path = path
+        self.schema = schema
+        # Schema fields that live on a further relation, e.g. a doctor's email
+        self.columns = columns
+
+    def lookups(self):
+        return [f"{self.path}__{self.columns.get(name, name)}" for name in self.schema.model_fields]
+
+    def value(self, row):
+        if row[f"{self.path}__id"] is None:
+            return None
+        return {
+            name: row[lookup]
+            for name, lookup in zip(self.schema.model_fields, self.lookups())
+        }
+
+
+class Many:
+    """A to-many relation, fetched with one query for the whole page."""
+
+    def __init__(self, model, key, schema, ordering, scope=None, archive=None):
+        self.model = model
+        self.key = key
+        self.schema = schema
+        self.ordering = ordering
+        # Lookup restricting doctors to their own rows
+        self.scope = scope
+        # Model holding the archived rows of the relation, same columns
+        self.archive = archive
+
+    def querysets(self, request, ids):
+        models = [self.model]
+        if self.archive is not None and archive_enabled():
+            models.insert(0, self.archive)
+
+        querysets = []
+        for model in models:
+            queryset = model.objects.filter(**{f"{self.key}__in": ids})
+            user = request.auth
+            if self.scope and user.role == "doctor":
+                queryset = queryset.filter(**{self.scope: user.doctor_id})
+            querysets.append(
+                queryset.order_by(*self.ordering).values(*dict.fromkeys([*self.schema.model_fields, self.key]))
+            )
+        return querysets
+
+    def group(self, sources):
+        # One list of rows per queryset, each in order
+        rows = sources[0] if len(sources) == 1 else sorted(chain(*sources), key=itemgetter(*self.ordering))
+        grouped = {}
+        for row in rows:
+            # The key stays on the row when the schema shows it, e.g. appointment_id
+            key = row[self.key] if self.key in self.schema.model_fields else row.pop(self.key)
+            grouped.setdefault(key, []).append(row)
+        return grouped
+
+
+RESOURCES = {
+    "appointment": (AppointmentOutSchema, {
+        "patient": One("patient", PatientOutSchema),
+        "doctor": One("doctor", DoctorOutSchema, email="user__email"),
+        # The appointments themselves are already scoped to the doctor
+        "prescriptions": Many(Prescription, "appointment_id", PrescriptionOutSchema, ("date_issued", "id")),
+    }),
+    "prescription": (PrescriptionOutSchema, {
+        "appointment": One("appointment", AppointmentOutSchema),
+        "patient": One("appointment__patient", PatientOutSchema),
+        "doctor": One("appointment__doctor", DoctorOutSchema, email="user__email"),
+    }),
+    "patient": (PatientOutSchema, {
+        "appointments": Many(
+            Appointment, "patient_id", AppointmentOutSchema, ("date_time", "id"),
+            scope="doctor_id", archive=ArchivedAppointment,
+        ),
+        "prescriptions": Many(
+            Prescription, "appointment__patient_id", PrescriptionOutSchema, ("date_issued", "id"),
+            scope="appointment__doctor_id", archive=ArchivedPrescription,
+        ),
+    }),
+}
+
+
+class Shape:
+    """The columns and embeds one read request asked for."""
+
+    def __init__(self, request, resource, fields=None, include=None):
+        schema, embeds = RESOURCES[resource]
+        self.request = request
+
+        requested = _split(fields)
+        unknown = [name for name in requested if name not in schema.model_fields]
+        if unknown:
+            raise HttpError(
+                400, f"Invalid fields: {', '.join(unknown)}. Valid options are: {', '.join(schema.model_fields)}"
+            )
+        self.fields = [name for name in schema.model_fields if not requested or name in requested or name == "id"]
+
+        self.include = _split(include)
+        unknown = [name for name in self.include if name not in embeds]
+        if unknown:
+            raise HttpError(
+                400, f"Invalid include: {', '.join(unknown)}. Valid options are: {', '.join(embeds)}"
+            )
+        self.one = {name: embeds[name] for name in self.include if isinstance(embeds[name], One)}
+        self.many = {name: embeds[name] for name in self.include if isinstance(embeds[name], Many)}
+
+    def values(self, queryset, *extra):
+        lookups = list(self.fields)
+        for embed in self.one.values():
+            lookups += embed.lookups()
+        return queryset.values(*dict.fromkeys(lookups + ["id", *extra]))
+
+    def _fetch_many(self, rows):
+        ids = [row["id"] for row in rows]
+        if not ids:
+            return {name: {} for name in self.many}
+        return {
+            name: embed.group([list(queryset) for queryset in embed.querysets(self.request, ids)])
+            for name, embed in self.many.items()
+        }
+
+    async def _afetch_many(self, rows):
+        ids = [row["id"] for row in rows]
+        if not ids:
+            return {name: {} for name in self.many}
+        return {
+            name: embed.group([[row async for row in queryset] for queryset in embed.querysets(self.request, ids)])
+            for name, embed in self.many.items()
+        }
+
+    def _render(self, row, many):
+        item = {name: row[name] for name in self.fields}
+        for name, embed in self.one.items():
+            item[name] = embed.value(row)
+        for name in self.many:
+            item[name] = many[name].get(row["id"], [])
+        return item
+
+    def rows(self, rows):
+        """Rows from values() as the nested dicts the read schemas validate."""
+        many = self._fetch_many(rows)
+        return [self._render(row, many) for row in rows]
+
+    async def arows(self, rows):
+        many = await self._afetch_many(rows)
+        return [self._render(row, many) for row in rows]
+
+    def _remember(self, model, row):
+        # Detail views: validated by the row itself unless something is embedded
+        if not self.include:
+            conditional.remember(self.request, conditional.rows_validators(self.request, model, [row]))
+
+    def render(self, model, row):
+        self._remember(model, row)
+        return self.rows([row])[0]
+
+    async def arender(self, model, row):
+        self._remember(model, row)
+        return (await self.arows([row]))[0]
+
+
+def shape_for(request, resource, fields=None, include=None):
+    shape = Shape(request, resource, fields, include)
+    setattr(request, SHAPE_ATTR, shape)
+    return shape
+
+
+def current_shape(request):
+    return getattr(request, SHAPE_ATTR, None) if request is not None else None
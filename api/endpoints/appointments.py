@@ -1,19 +1,29 @@
 from ninja import Router, Query
 
 from ninja.errors import HttpError
-from ninja_jwt.authentication import JWTAuth
+from ..auth import AsyncClinicFlowAuth, ClinicFlowAuth
+from ..conditional import conditional
+from ..instrumentation import query_budget
+from ..replica import replica_reads
 from ..schema import MessageSchema
 from ..schema import AppointmentOutSchema, AppointmentCreateSchema, AppointmentUpdateSchema
+from ..schema import AppointmentReadSchema
+from ..schema import AppointmentSeriesCreateSchema, AppointmentSeriesOutSchema
 from ..models import Doctor, Patient, Appointment
-from django.db import transaction
-from django.shortcuts import get_object_or_404
+from ..exports import stream_export, schema_fields
+from ..embeds import shape_for
+from ..scheduling import appointment_duration, expand_series
+from ..appointment_overlap import MAX_DURATION, find_overlaps
+from django.db import IntegrityError, transaction
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from django.utils import timezone
 
 from ninja.pagination import paginate
+from ..pagination import CursorPagination
 from typing import List
 
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, time, timedelta
 
 
 def is_admin_or_doctor(request):
@@ -23,7 +33,21 @@ def is_admin_or_doctor(request):
 
 # Appointment endpoints (admin and doctor access)
 
-appointment_router = Router(auth=JWTAuth(), tags=['Appointments'])
+appointment_router = Router(auth=ClinicFlowAuth(), tags=['Appointments'])
+
+# Page order of the list endpoints (unique, ending in the primary key)
+APPOINTMENT_ORDERING = ("date_time", "id")
+
+
+def appointment_length(duration_minutes):
+    # Validated duration, or the default one
+    if duration_minutes is None:
+        return appointment_duration()
+    duration = timedelta(minutes=duration_minutes)
+    if not timedelta(0) < duration <= MAX_DURATION:
+        raise HttpError(400, f"Duration must be between 1 and {int(MAX_DURATION.total_seconds() // 60)} minutes.")
+    return duration
+
 
 @appointment_router.post("/", response=AppointmentOutSchema)
 def create_appointment(request, payload: AppointmentCreateSchema):
@@ -37,7 +61,7 @@ def create_appointment(request, payload: AppointmentCreateSchema):
     doctor = get_object_or_404(Doctor, id=payload.doctor_id)
 
     # Ensure doctors only create appointments for themselves
-    if user.role == "doctor" and doctor.id != user.doctor.id:
+    if user.role == "doctor" and doctor.id != user.doctor_id:
         raise HttpError(403, "Doctors can only create appointments for themselves.")
     
     # Validate date_time and appointment_cost
@@ -48,63 +72,125 @@ def create_appointment(request, payload: AppointmentCreateSchema):
     if payload.date_time <= timezone.now():
         raise HttpError(400, "Appointment date and time must be in the future.")    
     
-    # Check if doctor already has an appointment at the same time
-    if Appointment.objects.filter(
-        doctor=doctor, 
-        date_time=payload.date_time, 
-        status=Appointment.STATUS_SCHEDULED
-        ).exists():
+    end_time = payload.date_time + appointment_length(payload.duration_minutes)
+
+    # The database rejects overlapping scheduled appointments for a doctor
+    try:
+        with transaction.atomic():
+            appointment = Appointment.objects.create(
+                patient=patient,
+                doctor=doctor,
+                date_time=payload.date_time,
+                end_time=end_time,
+                reason=payload.reason,
+                appointment_cost=payload.appointment_cost,
+                status=Appointment.STATUS_SCHEDULED
+                )
+    except IntegrityError:
         raise HttpError(400, "Doctor is already booked at this time")
+    return appointment
     
 
-    with transaction.atomic():
-        appointment = Appointment.objects.create(
-            patient=patient,
-            doctor=doctor,
-            date_time=payload.date_time,
-            reason=payload.reason,
-            appointment_cost=payload.appointment_cost,
-            status=Appointment.STATUS_SCHEDULED
-            )
-        return appointment
-    
-
-@appointment_router.get("/", response=List[AppointmentOutSchema])
-@paginate
-def list_appointments(request, 
-                      date: str | None = None,
-                      patient_id: int | None = None,
-                      doctor_id: int | None = None,
-                      status: str | None = None):
+@appointment_router.post("/series/", response=AppointmentSeriesOutSchema)
+def create_appointment_series(request, payload: AppointmentSeriesCreateSchema):
     is_admin_or_doctor(request)
+
     user = request.auth
 
-    #Base Queryset
-    queryset = Appointment.objects.select_related("patient", "doctor").all()
+    # Ensure doctors only create appointments for themselves
+    if user.role == "doctor" and payload.doctor_id != user.doctor_id:
+        raise HttpError(403, "Doctors can only create appointments for themselves.")
+
+    if payload.appointment_cost <= Decimal("0"):
+        raise HttpError(400, "Appointment cost must be greater than zero.")
+
+    if payload.date_time <= timezone.now():
+        raise HttpError(400, "Appointment date and time must be in the future.")
+
+    duration = appointment_length(payload.duration_minutes)
+    try:
+        occurrences = [
+            (date_time, date_time + duration)
+            for date_time in expand_series(
+                payload.date_time, payload.frequency, payload.interval, payload.count, payload.until
+            )
+        ]
+    except ValueError as e:
+        raise HttpError(400, str(e))
+
+    # Validate patient and doctor exist
+    get_object_or_404(Patient, id=payload.patient_id)
+    get_object_or_404(Doctor, id=payload.doctor_id)
+
+    # One range query for the doctor's bookings across the whole series
+    booked = list(
+        Appointment.objects.filter(
+            doctor_id=payload.doctor_id,
+            status=Appointment.STATUS_SCHEDULED,
+            date_time__gt=occurrences[0][0] - MAX_DURATION,
+            date_time__lt=occurrences[-1][1]
+        ).order_by("date_time").values_list("date_time", "end_time")
+    )
+    conflicts = set(find_overlaps(occurrences, booked))
+
+    try:
+        with transaction.atomic():
+            created = Appointment.objects.bulk_create([
+                Appointment(
+                    patient_id=payload.patient_id,
+                    doctor_id=payload.doctor_id,
+                    date_time=date_time,
+                    end_time=end_time,
+                    reason=payload.reason,
+                    appointment_cost=payload.appointment_cost,
+                    status=Appointment.STATUS_SCHEDULED
+                )
+                for date_time, end_time in occurrences if (date_time, end_time) not in conflicts
+            ])
+    except IntegrityError:
+        # Another booking landed on one of the free occurrences meanwhile
+        raise HttpError(400, "Doctor was booked during one of these times meanwhile. Please retry.")
+
+    return {
+        "created": created,
+        "conflicts": [date_time for date_time, end_time in occurrences if (date_time, end_time) in conflicts],
+    }
+
+
+def appointment_filters(request, queryset, date=None, patient_id=None, doctor_id=None, status=None):
+    # Builds the filtered queryset without touching the database. Returns it
+    # with the (model, id) pairs that must exist, checked by the callers below.
+    user = request.auth
+    must_exist = []
 
     #Restrict doctors to their own appointments
     if user.role == "doctor":
-        queryset = queryset.filter(doctor_id=user.doctor.id)
+        queryset = queryset.filter(doctor_id=user.doctor_id)
 
         if doctor_id is not None:
             raise HttpError(403, "Doctors can only view their own appointments")
     
     #filter by patient_id
     if patient_id:
-        get_object_or_404(Patient, id=patient_id)
+        must_exist.append((Patient, patient_id))
         queryset = queryset.filter(patient_id=patient_id)
 
     #filter by date
     if date:
         try:
             appointment_date = datetime.strptime(date, "%Y-%m-%d").date()
-            queryset = queryset.filter(date_time__date=appointment_date)
         except ValueError:
             raise HttpError(400, "Invalid date format. Use YYYY-MM-DD.")
+        # Range filter instead of date_time__date so the date_time indexes are used
+        day_start = datetime.combine(appointment_date, time.min, tzinfo=timezone.get_current_timezone())
+        queryset = queryset.filter(
+            date_time__gte=day_start,
+            date_time__lt=day_start + timedelta(days=1)
+        )
     
     #Filter by doctor_id (admin only)   
     if doctor_id and user.role == "admin":
-        get_object_or_404(Doctor, id=doctor_id)
+        must_exist.append((Doctor, doctor_id))
         queryset = queryset.filter(doctor_id=doctor_id)
 
     #Filter by status
@@ -117,28 +203,85 @@ def list_appointments(request,
         if status not in valid_statuses:
             raise HttpError(400, f"Invalid status. Valid options are: {', '.join(valid_statuses)}")
         queryset = queryset.filter(status=status)
-    
-    
-    return queryset    
 
+    return queryset, must_exist
+
+
+def filter_appointments(request, queryset, date=None, patient_id=None, doctor_id=None, status=None):
+    # Shared by list_appointments and export_appointments
+    queryset, must_exist = appointment_filters(request, queryset, date, patient_id, doctor_id, status)
+    for model, pk in must_exist:
+        get_object_or_404(model, id=pk)
+    return queryset
+
+
+async def afilter_appointments(request, queryset, date=None, patient_id=None, doctor_id=None, status=None):
+    # Async counterpart of filter_appointments
+    queryset, must_exist = appointment_filters(request, queryset, date, patient_id, doctor_id, status)
+    for model, pk in must_exist:
+        await aget_object_or_404(model, id=pk)
+    return queryset
+
+
+@appointment_router.get("/", response=List[AppointmentReadSchema], exclude_unset=True)
+@conditional
+@replica_reads
+@query_budget(6)
+@paginate(CursorPagination, ordering=APPOINTMENT_ORDERING, schema=AppointmentOutSchema)
+def list_appointments(request, 
+                      date: str | None = None,
+                      patient_id: int | None = None,
+                      doctor_id: int | None = None,
+                      status: str | None = None,
+                      fields: str | None = None,
+                      include: str | None = None):
+    is_admin_or_doctor(request)
+    shape_for(request, "appointment", fields, include)
 
+    #Base Queryset
+    queryset = Appointment.objects.all()
+
+    return filter_appointments(request, queryset, date, patient_id, doctor_id, status)
 
 
-@appointment_router.get("/{appointment_id}/", response=AppointmentOutSchema)
-def get_appointment(request, appointment_id: int):
+@appointment_router.get("/export/")
+@replica_reads
+def export_appointments(request,
+                        format: str = "csv",
+                        date: str | None = None,
+                        patient_id: int | None = None,
+                        doctor_id: int | None = None,
+                        status: str | None = None):
+    is_admin_or_doctor(request)
+
+    queryset = filter_appointments(request, Appointment.objects.all(), date, patient_id, doctor_id, status)
+
+    return stream_export(
+        queryset.order_by("date_time", "id"),
+        schema_fields(AppointmentOutSchema),
+        format,
+        "appointments"
+    )
+
+
+@appointment_router.get("/{appointment_id}/", response=AppointmentReadSchema, exclude_unset=True)
+@conditional
+@query_budget(3)
+def get_appointment(request, appointment_id: int, fields: str | None = None, include: str | None = None):
     is_admin_or_doctor(request)
     user = request.auth
+    shape = shape_for(request, "appointment", fields, include)
 
-    # Get the appointment
+    # Get the appointment, with its embeds joined in
     appointment = get_object_or_404(
-         Appointment.objects.select_related("patient", "doctor"), 
+         shape.values(Appointment.objects.all(), "doctor_id", "updated_at"), 
          id=appointment_id)
 
     # Ensure doctors only access their own appointments
-    if user.role == "doctor" and appointment.doctor_id != user.doctor.id:
+    if user.role == "doctor" and appointment["doctor_id"] != user.doctor_id:
         raise HttpError(403, "You are not authorized to view this appointment.")
     
-    return appointment
+    return shape.render(Appointment, appointment)
 
 
 @appointment_router.put("/{appointment_id}/", response=AppointmentOutSchema)
@@ -152,7 +295,7 @@ def update_appointment(request, appointment_id: int, payload: AppointmentUpdateS
         id=appointment_id)
 
     # Ensure doctors only update their own appointments
-    if user.role == "doctor" and appointment.doctor_id != user.doctor.id:
+    if user.role == "doctor" and appointment.doctor_id != user.doctor_id:
         raise HttpError(403, "You are not authorized to update this appointment.")
     
     # Only admin can update patient_id and doctor_id
@@ -177,16 +320,15 @@ def update_appointment(request, appointment_id: int, payload: AppointmentUpdateS
     if payload.date_time:
         if payload.date_time <= timezone.now():
             raise HttpError(400, "Appointment date and time must be in the future.")
-    
-        # Prevent double booking
-        if Appointment.objects.filter(
-            doctor=appointment.doctor,
-            date_time=payload.date_time,
-            status=Appointment.STATUS_SCHEDULED
-        ).exclude(id=appointment.id).exists():
-            raise HttpError(400, "Doctor already has an appointment at this time.")
-        
-        appointment.date_time = payload.date_time
+
+    # Moving the appointment keeps its duration unless a new one is given
+    if payload.date_time or payload.duration_minutes is not None:
+        if payload.duration_minutes is not None:
+            duration = appointment_length(payload.duration_minutes)
+        else:
+            duration = appointment.end_time - appointment.date_time
+        appointment.date_time = payload.date_time or appointment.date_time
+        appointment.end_time = appointment.date_time + duration
 
     # Update other fields if available
     if payload.reason is not None:
@@ -206,12 +348,15 @@ def update_appointment(request, appointment_id: int, payload: AppointmentUpdateS
         appointment.appointment_cost = payload.appointment_cost
 
 
-    appointment.save()
+    # The database rejects overlapping scheduled appointments for a doctor
+    try:
+        with transaction.atomic():
+            appointment.save()
+    except IntegrityError:
+        raise HttpError(400, "Doctor already has an appointment at this time.")
     return appointment
 
 
-
-
 @appointment_router.delete("/{appointment_id}/", response=MessageSchema)
 def cancel_appointment(request, appointment_id: int):
     is_admin_or_doctor(request)
@@ -223,7 +368,7 @@ def cancel_appointment(request, appointment_id: int):
         id=appointment_id)
     
     # Ensure doctors only cancel their own appointments
-    if user.role == "doctor" and appointment.doctor_id != user.doctor.id:
+    if user.role == "doctor" and appointment.doctor_id != user.doctor_id:
         raise HttpError(403, "You are not authorized to cancel this appointment.")
     
     # Check if appointment is already canceled
@@ -233,4 +378,45 @@ def cancel_appointment(request, appointment_id: int):
     with transaction.atomic():
         appointment.status = Appointment.STATUS_CANCELED
         appointment.save()
-        return MessageSchema(message="Appointment canceled successfully")
\ No newline at end of file
+        return MessageSchema(message="Appointment canceled successfully")
+
+
+# Async read endpoints (mounted under /async/ for ASGI deployments)
+
+appointment_async_router = Router(auth=AsyncClinicFlowAuth(), tags=['Appointments (async)'])
+
+@appointment_async_router.get("/", response=List[AppointmentReadSchema], exclude_unset=True)
+@conditional
+@replica_reads
+@query_budget(6)
+@paginate(CursorPagination, ordering=APPOINTMENT_ORDERING, schema=AppointmentOutSchema)
+async def alist_appointments(request, 
+                             date: str | None = None,
+                             patient_id: int | None = None,
+                             doctor_id: int | None = None,
+                             status: str | None = None,
+                             fields: str | None = None,
+                             include: str | None = None):
+    is_admin_or_doctor(request)
+    shape_for(request, "appointment", fields, include)
+
+    return await afilter_appointments(request, Appointment.objects.all(), date, patient_id, doctor_id, status)
+
+
+@appointment_async_router.get("/{appointment_id}/", response=AppointmentReadSchema, exclude_unset=True)
+@conditional
+@query_budget(3)
+async def aget_appointment(request, appointment_id: int, fields: str | None = None, include: str | None = None):
+    is_admin_or_doctor(request)
+    user = request.auth
+    shape = shape_for(request, "appointment", fields, include)
+
+    appointment = await aget_object_or_404(
+        shape.values(Appointment.objects.all(), "doctor_id", "updated_at"),
+        id=appointment_id)
+
+    # Ensure doctors only access their own appointments
+    if user.role == "doctor" and appointment["doctor_id"] != user.doctor_id:
+        raise HttpError(403, "You are not authorized to view this appointment.")
+    
+    return await shape.arender(Appointment, appointment)
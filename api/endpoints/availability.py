@@ -0,0 +1,96 @@
+from ninja import Router
+
+from ninja.errors import HttpError
+from ..auth import ClinicFlowAuth
+from ..instrumentation import query_budget
+from ..schema import DoctorAvailabilitySchema
+from ..models import Doctor, DoctorWorkingHours, Appointment
+from ..scheduling import default_working_hours, free_slots, merge_intervals, working_windows
+from ..appointment_overlap import MAX_DURATION
+from django.utils import timezone
+from typing import List
+
+from datetime import date, datetime, time, timedelta
+
+
+
+
+# Availability endpoints (admin and doctor access)
+
+availability_router = Router(auth=ClinicFlowAuth(), tags=['Availability'])
+
+AVAILABILITY_MAX_DAYS = 31
+
+
+def is_admin_or_doctor(request):
+    role = request.auth.role
+    if role not in ["admin", "doctor"]:
+        raise HttpError(403, "Admin or Doctor access required")
+
+
+@availability_router.get("/", response=List[DoctorAvailabilitySchema])
+@query_budget(4)
+def doctor_availability(request,
+                        start_date: date,
+                        end_date: date,
+                        specialty: str | None = None,
+                        doctor_id: int | None = None,
+                        slot_minutes: int = 30):
+    is_admin_or_doctor(request)
+
+    if end_date < start_date:
+        raise HttpError(400, "end_date must not be before start_date.")
+    if (end_date - start_date).days >= AVAILABILITY_MAX_DAYS:
+        raise HttpError(400, f"The date range can span at most {AVAILABILITY_MAX_DAYS} days.")
+    if not 5 <= slot_minutes <= 480:
+        raise HttpError(400, "slot_minutes must be between 5 and 480.")
+
+    doctors = Doctor.objects.all()
+    if specialty:
+        doctors = doctors.filter(specialty__icontains=specialty)
+    if doctor_id is not None:
+        doctors = doctors.filter(id=doctor_id)
+    doctors = list(doctors.order_by("id").values("id", "first_name", "last_name", "specialty"))
+    if not doctors:
+        return []
+    doctor_ids = [doctor["id"] for doctor in doctors]
+
+    # Configured working hours for every candidate doctor in one query
+    hours = {}
+    for row in DoctorWorkingHours.objects.filter(doctor_id__in=doctor_ids).values_list(
+        "doctor_id", "weekday", "start_time", "end_time"
+    ):
+        hours.setdefault(row[0], {}).setdefault(row[1], []).append((row[2], row[3]))
+
+    # Every scheduled appointment that can overlap the range, in one query
+    tz = timezone.get_current_timezone()
+    range_start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    range_end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+    busy = {}
+    for booked_doctor_id, date_time, end_time in Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        status=Appointment.STATUS_SCHEDULED,
+        date_time__gt=range_start - MAX_DURATION,
+        date_time__lt=range_end
+    ).values_list("doctor_id", "date_time", "end_time"):
+        busy.setdefault(booked_doctor_id, []).append((date_time, end_time))
+
+    defaults = default_working_hours()
+    slot_length = timedelta(minutes=slot_minutes)
+    now = timezone.now()
+
+    availability = []
+    for doctor in doctors:
+        windows = working_windows(hours.get(doctor["id"], defaults), start_date, end_date)
+        slots = free_slots(windows, merge_intervals(busy.get(doctor["id"], [])), slot_length, not_before=now)
+        availability.append({
+            "doctor_id": doctor["id"],
+            "first_name": doctor["first_name"],
+            "last_name": doctor["last_name"],
+            "specialty": doctor["specialty"],
+            "slot_minutes": slot_minutes,
+            # Start times only; every slot lasts slot_minutes
+            "slots": [start for start, _ in slots],
+        })
+
+    return availability
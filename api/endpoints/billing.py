@@ -1,10 +1,16 @@
 from ninja import Router
 
 from ninja.errors import HttpError
-from ninja_jwt.authentication import JWTAuth
+from ..auth import AsyncClinicFlowAuth, ClinicFlowAuth
+from ..instrumentation import query_budget
+from ..replica import replica_reads
 from ..schema import BillingReportSchema, PatientBreakdownSchema
-from ..models import Appointment, Prescription
-from django.db.models import Sum
+from ..models import Appointment, Prescription, ArchivedAppointment, ArchivedPrescription, BillingRollup
+from ..billing_rollup import lowest, rollup_enabled
+from ..archive import year_needs_archive
+from ..exports import stream_exports
+from django.db.models import CharField, Count, F, Min, Sum, Value
+from django.db.models.functions import Concat, TruncDate
 from decimal import Decimal
 
 
@@ -15,63 +21,183 @@ def is_admin(request):
 
 # Billing Report Endpoints (Admin Only)
 
-billing_router = Router(auth=JWTAuth(), tags=['Billing Reports'])
+billing_router = Router(auth=ClinicFlowAuth(), tags=['Billing Reports'])
 
-@billing_router.get("/", response=BillingReportSchema)
-def billing_report(
-    request, 
-    year: int = None, 
-    month: int | None = None
-):
-    is_admin(request)
+CENT = Decimal("0.01")
 
-    if not year:
-        raise HttpError(400, "Year is required.")
-    
-    appointments = Appointment.objects.select_related("patient").filter(status="completed", date_time__year=year)
-    prescriptions = Prescription.objects.select_related("appointment__patient").filter(date_issued__year=year)
+
+def _empty_patient_row(patient_id, full_name):
+    return {
+        "patient_id": patient_id,
+        "full_name": full_name,
+        "appointment_count": 0,
+        "appointment_total": Decimal("0.00"),
+        "prescription_count": 0,
+        "prescription_total": Decimal("0.00"),
+        "first_appointment_id": None,
+        "first_prescription_id": None,
+    }
+
+
+def _money(total):
+    # SQLite hands back sums with 15 significant digits ("220.490000000000")
+    return (total or Decimal("0.00")).quantize(CENT)
+
+
+def first_seen(data):
+    # Patients in the order the report has always listed them: by their first
+    # completed appointment of the period, then those with only prescriptions
+    if data["first_appointment_id"] is not None:
+        return 0, data["first_appointment_id"]
+    return 1, data["first_prescription_id"]
+
+
+def period_querysets(year, month=None, appointment_model=Appointment, prescription_model=Prescription):
+    # Completed appointments and prescriptions of the period
+    appointments = appointment_model.objects.filter(status="completed", date_time__year=year)
+    prescriptions = prescription_model.objects.filter(date_issued__year=year)
 
     if month:
         appointments = appointments.filter(date_time__month=month)
         prescriptions = prescriptions.filter(date_issued__month=month)
+    return appointments, prescriptions
+
+
+def period_sources(year, month=None):
+    # The hot tables, plus the archive when the period reaches back into it
+    sources = [period_querysets(year, month)]
+    if year_needs_archive(year, month):
+        sources.append(period_querysets(year, month, ArchivedAppointment, ArchivedPrescription))
+    return sources
 
-    total_appointments = appointments.count()
-    total_prescriptions = prescriptions.count()
-    total_appointment_cost = appointments.aggregate(total=Sum("appointment_cost"))["total"] or Decimal("0.00")
-    total_prescription_cost = prescriptions.aggregate(total=Sum("prescription_cost"))["total"] or Decimal("0.00")
-    total_income = total_appointment_cost + total_prescription_cost
 
-    #Breakdown by patient
+def raw_patient_querysets(appointments, prescriptions):
+    # Per-patient totals grouped from the raw appointment and prescription tables
+    appointment_rows = (
+        appointments
+        .values("patient_id")
+        .annotate(
+            full_name=Concat("patient__first_name", Value(" "), "patient__last_name", output_field=CharField()),
+            count=Count("id"),
+            total=Sum("appointment_cost"),
+            first_id=Min("id"),
+        )
+        .order_by()
+    )
+    prescription_rows = (
+        prescriptions
+        .values(patient_id=F("appointment__patient_id"))
+        .annotate(
+            full_name=Concat(
+                "appointment__patient__first_name", Value(" "), "appointment__patient__last_name",
+                output_field=CharField()
+            ),
+            count=Count("id"),
+            total=Sum("prescription_cost"),
+            first_id=Min("id"),
+        )
+        .order_by()
+    )
+    return appointment_rows, prescription_rows
 
+
+def merge_raw_rows(appointment_rows, prescription_rows):
     patients = {}
-    for appt in appointments:
-        patient = appt.patient
-        if patient.id not in patients:
-            patients[patient.id] = {
-                "patient_id": patient.id,
-                "full_name": f"{patient.first_name} {patient.last_name}",
-                "appointment_total": Decimal("0.00"),
-                "prescription_total": Decimal("0.00"),
-            }
-        patients[patient.id]["appointment_total"] += appt.appointment_cost or Decimal("0.00")
-
-    for pres in prescriptions:
-        patient = pres.appointment.patient
-        if patient.id not in patients:
-            patients[patient.id] = {
-                "patient_id": patient.id,
-                "full_name": f"{patient.first_name} {patient.last_name}",
-                "appointment_total": Decimal("0.00"),
-                "prescription_total": Decimal("0.00"),
-            }
-        patients[patient.id]["prescription_total"] += pres.prescription_cost or Decimal("0.00")
-
-    # Compute total amount for each patient
+    for row in appointment_rows:
+        data = patients.setdefault(row["patient_id"], _empty_patient_row(row["patient_id"], row["full_name"]))
+        data["appointment_count"] += row["count"]
+        data["appointment_total"] += _money(row["total"])
+        data["first_appointment_id"] = lowest(data["first_appointment_id"], row["first_id"])
+
+    for row in prescription_rows:
+        data = patients.setdefault(row["patient_id"], _empty_patient_row(row["patient_id"], row["full_name"]))
+        data["prescription_count"] += row["count"]
+        data["prescription_total"] += _money(row["total"])
+        data["first_prescription_id"] = lowest(data["first_prescription_id"], row["first_id"])
+
+    return sorted(patients.values(), key=first_seen)
+
+
+def raw_patient_rows(year, month=None):
+    appointment_rows, prescription_rows = [], []
+    for appointments, prescriptions in period_sources(year, month):
+        appointment_queryset, prescription_queryset = raw_patient_querysets(appointments, prescriptions)
+        appointment_rows += appointment_queryset
+        prescription_rows += prescription_queryset
+    return merge_raw_rows(appointment_rows, prescription_rows)
+
+
+async def araw_patient_rows(year, month=None):
+    appointment_rows, prescription_rows = [], []
+    for appointments, prescriptions in period_sources(year, month):
+        appointment_queryset, prescription_queryset = raw_patient_querysets(appointments, prescriptions)
+        appointment_rows += [row async for row in appointment_queryset]
+        prescription_rows += [row async for row in prescription_queryset]
+    return merge_raw_rows(appointment_rows, prescription_rows)
+
+
+def rollup_patient_queryset(year, month=None):
+    # Per-patient totals read from the monthly BillingRollup table
+    rollups = BillingRollup.objects.filter(year=year)
+    if month:
+        rollups = rollups.filter(month=month)
+
+    return (
+        rollups
+        .values("patient_id")
+        .annotate(
+            full_name=Concat("patient__first_name", Value(" "), "patient__last_name", output_field=CharField()),
+            appointment_count_sum=Sum("appointment_count"),
+            appointment_total_sum=Sum("appointment_total"),
+            prescription_count_sum=Sum("prescription_count"),
+            prescription_total_sum=Sum("prescription_total"),
+            first_appointment_id_min=Min("first_appointment_id"),
+            first_prescription_id_min=Min("first_prescription_id"),
+        )
+        .order_by()
+    )
+
+
+def rollup_rows_to_patients(rows):
+    patients = []
+    for row in rows:
+        data = _empty_patient_row(row["patient_id"], row["full_name"])
+        data["appointment_count"] = row["appointment_count_sum"] or 0
+        data["appointment_total"] = _money(row["appointment_total_sum"])
+        data["prescription_count"] = row["prescription_count_sum"] or 0
+        data["prescription_total"] = _money(row["prescription_total_sum"])
+        data["first_appointment_id"] = row["first_appointment_id_min"]
+        data["first_prescription_id"] = row["first_prescription_id_min"]
+        patients.append(data)
+    return sorted(patients, key=first_seen)
+
+
+def rollup_patient_rows(year, month=None):
+    return rollup_rows_to_patients(rollup_patient_queryset(year, month))
+
+
+async def arollup_patient_rows(year, month=None):
+    return rollup_rows_to_patients([row async for row in rollup_patient_queryset(year, month)])
+
+
+def build_report(year, month, patients):
+    total_appointments = 0
+    total_prescriptions = 0
+    total_income = Decimal("0.00")
 
     breakdown = []
-    for data in patients.values():
-        data["total_amount"] = data["appointment_total"] + data["prescription_total"]
-        breakdown.append(PatientBreakdownSchema(**data))
+    for data in patients:
+        total_appointments += data["appointment_count"]
+        total_prescriptions += data["prescription_count"]
+        total_income += data["appointment_total"] + data["prescription_total"]
+
+        breakdown.append(PatientBreakdownSchema(
+            patient_id=data["patient_id"],
+            full_name=data["full_name"],
+            appointment_total=data["appointment_total"],
+            prescription_total=data["prescription_total"],
+            total_amount=data["appointment_total"] + data["prescription_total"],
+        ))
 
     return {
         "year": year,
@@ -81,3 +207,109 @@ def billing_report(
         "total_income": total_income,
         "breakdown_by_patient": breakdown
     }
+
+
+@billing_router.get("/", response=BillingReportSchema)
+@replica_reads
+@query_budget(5)
+def billing_report(
+    request, 
+    year: int = None, 
+    month: int | None = None
+):
+    is_admin(request)
+
+    if not year:
+        raise HttpError(400, "Year is required.")
+
+    #Breakdown by patient, grouped in the database
+
+    if rollup_enabled():
+        patients = rollup_patient_rows(year, month)
+    else:
+        patients = raw_patient_rows(year, month)
+
+    return build_report(year, month, patients)
+
+
+BILLING_EXPORT_FIELDS = ["line_type", "line_id", "appointment_id", "patient_id", "full_name", "date", "amount"]
+
+
+def billing_lines(appointments, prescriptions):
+    # One line per completed appointment and per prescription, same columns for both
+    appointment_lines = (
+        appointments
+        .order_by("date_time", "id")
+        .values(
+            "patient_id",
+            line_type=Value("appointment", output_field=CharField()),
+            line_id=F("id"),
+            appointment_id=F("id"),
+            full_name=Concat("patient__first_name", Value(" "), "patient__last_name", output_field=CharField()),
+            date=TruncDate("date_time"),
+            amount=F("appointment_cost"),
+        )
+    )
+    prescription_lines = (
+        prescriptions
+        .order_by("date_issued", "id")
+        .values(
+            "appointment_id",
+            line_type=Value("prescription", output_field=CharField()),
+            line_id=F("id"),
+            patient_id=F("appointment__patient_id"),
+            full_name=Concat(
+                "appointment__patient__first_name", Value(" "), "appointment__patient__last_name",
+                output_field=CharField()
+            ),
+            date=F("date_issued"),
+            amount=F("prescription_cost"),
+        )
+    )
+    return appointment_lines, prescription_lines
+
+
+@billing_router.get("/export/")
+@replica_reads
+def export_billing_lines(
+    request,
+    year: int = None,
+    month: int | None = None,
+    format: str = "csv"
+):
+    is_admin(request)
+
+    if not year:
+        raise HttpError(400, "Year is required.")
+
+    # Archived lines first, being the older ones
+    lines = [billing_lines(*source) for source in reversed(period_sources(year, month))]
+    querysets = [appointments for appointments, _ in lines] + [prescriptions for _, prescriptions in lines]
+
+    filename = f"billing-{year}" + (f"-{month:02d}" if month else "")
+    return stream_exports(querysets, BILLING_EXPORT_FIELDS, format, filename)
+
+
+# Async read endpoints (mounted under /async/ for ASGI deployments)
+
+billing_async_router = Router(auth=AsyncClinicFlowAuth(), tags=['Billing Reports (async)'])
+
+@billing_async_router.get("/", response=BillingReportSchema)
+@replica_reads
+@query_budget(5)
+async def abilling_report(
+    request, 
+    year: int = None, 
+    month: int | None = None
+):
+    is_admin(request)
+
+    if not year:
+        raise HttpError(400, "Year is required.")
+
+    if rollup_enabled():
+        patients = await arollup_patient_rows(year, month)
+    else:
+        patients = await araw_patient_rows(year, month)
+
+    return build_report(year, month, patients)
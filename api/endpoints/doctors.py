@@ -1,16 +1,22 @@
 from ninja import Router, Query
 
 from ninja.errors import HttpError
-from ninja_jwt.authentication import JWTAuth
+from ..auth import AsyncClinicFlowAuth, ClinicFlowAuth
+from ..conditional import conditional
+from ..instrumentation import query_budget
+from ..replica import replica_reads
 from ..schema import DoctorCreateSchema, DoctorOutSchema, DoctorCreateResponseSchema
-from ..models import User, Doctor
+from ..schema import WorkingHoursSchema
+from ..models import User, Doctor, DoctorWorkingHours
+from ..scheduling import default_working_hours
+from .. import outbox
 from django.contrib.auth.hashers import make_password
 from django.db import transaction
-from django.db.models import Q
-from django.core.mail import send_mail
+from django.db.models import F, Q
 
 
 from ninja.pagination import paginate
+from ..pagination import CursorPagination
 from typing import List
 
 import secrets
@@ -22,7 +28,10 @@ import string
 # Doctor endpoints (admin-only)
 
 
-doctor_router = Router(auth=JWTAuth(), tags=['Doctors'])
+doctor_router = Router(auth=ClinicFlowAuth(), tags=['Doctors'])
+
+# Page order of the list endpoints (unique, ending in the primary key)
+DOCTOR_ORDERING = ("id",)
 
 
 def is_admin(request):
@@ -68,8 +77,8 @@ def create_doctor(request, payload: DoctorCreateSchema):
             )
 
             
-            # Send email with credentials
-            send_mail(
+            # Queue email with credentials; sent after commit by send_outbox_emails
+            outbox.enqueue(
                 subject="Your Doctor Account Credentials",
                 message=f"Hello Dr. {doctor.last_name},\n\n"
                         f"Your account has been created.\n"
@@ -77,8 +86,7 @@ def create_doctor(request, payload: DoctorCreateSchema):
                         f"Password: {password}\n\n"
                         "Please log in and change your password as soon as possible.",
                 from_email="no-reply@clinicflow.com",
-                recipient_list=[user.email],
-                fail_silently=False
+                recipient_list=[user.email]
             )
 
             return DoctorCreateResponseSchema(
@@ -92,11 +100,16 @@ def create_doctor(request, payload: DoctorCreateSchema):
 
 
 
-@doctor_router.get("/", response=List[DoctorOutSchema])
-@paginate   
-def list_doctors(request, specialty: str = Query(None), name: str = Query(None)):
-    is_admin(request)
-    queryset = Doctor.objects.select_related("user").all()
+def doctor_queryset():
+    # Lean read path shared by list_doctors and get_doctor: user_id is a local
+    # column and email comes from the joined user row, so DoctorOutSchema can
+    # read both straight off the annotated Doctor rows.
+    return Doctor.objects.annotate(email=F("user__email"))
+
+
+def filter_doctors(specialty=None, name=None):
+    # Shared by list_doctors and alist_doctors
+    queryset = doctor_queryset()
     if specialty:
         queryset = queryset.filter(specialty__icontains=specialty)
     if name:
@@ -104,35 +117,103 @@ def list_doctors(request, specialty: str = Query(None), name: str = Query(None))
             Q(first_name__icontains=name) | Q(last_name__icontains=name)
         )    
 
-    return [
-    DoctorOutSchema(
-        id=doctor.id,
-        user_id=doctor.user.id,
-        first_name=doctor.first_name,
-        last_name=doctor.last_name,
-        specialty=doctor.specialty,
-        email=doctor.user.email,
-        phone=doctor.phone,
-        created_at=doctor.created_at
-    )
-    for doctor in queryset
-    ]
+    return queryset
+
+
+@doctor_router.get("/", response=List[DoctorOutSchema])
+@conditional
+@replica_reads
+@query_budget(3)
+@paginate(CursorPagination, ordering=DOCTOR_ORDERING, schema=DoctorOutSchema)
+def list_doctors(request, specialty: str = Query(None), name: str = Query(None)):
+    is_admin(request)
+    return filter_doctors(specialty, name)
 
 
 @doctor_router.get("/{doctor_id}/", response=DoctorOutSchema)
+@conditional
+@query_budget(2)
 def get_doctor(request, doctor_id: int):
     is_admin(request)
     try:
-        doctor = Doctor.objects.select_related("user").get(id=doctor_id)
-        return DoctorOutSchema(
-            id=doctor.id,
-            user_id=doctor.user.id,
-            first_name=doctor.first_name,
-            last_name=doctor.last_name,
-            specialty=doctor.specialty,
-            email=doctor.user.email,
-            phone=doctor.phone,
-            created_at=doctor.created_at
-        )
+        return doctor_queryset().get(id=doctor_id)
+    except Doctor.DoesNotExist:
+        raise HttpError(404, "Doctor not found")
+
+
+
+def effective_working_hours(doctor_id):
+    # The doctor's configured hours, or settings.DEFAULT_WORKING_HOURS if none
+    rows = list(
+        DoctorWorkingHours.objects
+        .filter(doctor_id=doctor_id)
+        .order_by("weekday", "start_time")
+        .values("weekday", "start_time", "end_time")
+    )
+    if rows:
+        return rows
+    return [
+        {"weekday": weekday, "start_time": start, "end_time": end}
+        for weekday, windows in sorted(default_working_hours().items())
+        for start, end in windows
+    ]
+
+
+@doctor_router.get("/{doctor_id}/working-hours/", response=List[WorkingHoursSchema])
+@query_budget(3)
+def get_working_hours(request, doctor_id: int):
+    is_admin(request)
+    if not Doctor.objects.filter(id=doctor_id).exists():
+        raise HttpError(404, "Doctor not found")
+    return effective_working_hours(doctor_id)
+
+
+@doctor_router.put("/{doctor_id}/working-hours/", response=List[WorkingHoursSchema])
+def set_working_hours(request, doctor_id: int, payload: List[WorkingHoursSchema]):
+    # Replaces the doctor's working hours; an empty list restores the defaults
+    is_admin(request)
+    if not Doctor.objects.filter(id=doctor_id).exists():
+        raise HttpError(404, "Doctor not found")
+
+    windows = sorted(payload, key=lambda window: (window.weekday, window.start_time))
+    for index, window in enumerate(windows):
+        if window.weekday not in dict(DoctorWorkingHours.WEEKDAY_CHOICES):
+            raise HttpError(400, "Invalid weekday. Use 0 (Monday) to 6 (Sunday).")
+        if window.start_time >= window.end_time:
+            raise HttpError(400, "Working hours must start before they end.")
+        previous = windows[index - 1] if index else None
+        if previous and previous.weekday == window.weekday and window.start_time < previous.end_time:
+            raise HttpError(400, "Working hours on the same weekday must not overlap.")
+
+    with transaction.atomic():
+        DoctorWorkingHours.objects.filter(doctor_id=doctor_id).delete()
+        DoctorWorkingHours.objects.bulk_create([
+            DoctorWorkingHours(doctor_id=doctor_id, **window.dict()) for window in windows
+        ])
+
+    return effective_working_hours(doctor_id)
+
+
+# Async read endpoints (mounted under /async/ for ASGI deployments)
+
+doctor_async_router = Router(auth=AsyncClinicFlowAuth(), tags=['Doctors (async)'])
+
+@doctor_async_router.get("/", response=List[DoctorOutSchema])
+@conditional
+@replica_reads
+@query_budget(3)
+@paginate(CursorPagination, ordering=DOCTOR_ORDERING, schema=DoctorOutSchema)
+async def alist_doctors(request, specialty: str = Query(None), name: str = Query(None)):
+    is_admin(request)
+    return filter_doctors(specialty, name)
+
+
+@doctor_async_router.get("/{doctor_id}/", response=DoctorOutSchema)
+@conditional
+@query_budget(2)
+async def aget_doctor(request, doctor_id: int):
+    is_admin(request)
+    try:
+        return await doctor_queryset().aget(id=doctor_id)
     except Doctor.DoesNotExist:
-        raise HttpError(404, "Doctor not found")
\ No newline at end of file
+        raise HttpError(404, "Doctor not found")
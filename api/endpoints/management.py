@@ -2,14 +2,16 @@ from ninja import Router
 from ninja.errors import HttpError
 from django.contrib.auth.hashers import make_password
 from ..models import User
-from ninja_jwt.authentication import JWTAuth
+from ..auth import ClinicFlowAuth
 from ninja.responses import Response
-from django.core.mail import send_mail
+from .. import outbox, profiling
 from django.db import transaction
+from django.http import FileResponse
+from typing import List
 
-from ..schema import AdminCreateSchema, MessageSchema
+from ..schema import AdminCreateSchema, MessageSchema, OutboxStatsSchema, ProfileSchema
 
-management_router = Router(auth=JWTAuth(), tags=['Admin Management'])
+management_router = Router(auth=ClinicFlowAuth(), tags=['Admin Management'])
 
 def is_admin(request):
     if not request.auth or request.auth.role != "admin":
@@ -44,9 +46,9 @@ def create_admin(request, payload: AdminCreateSchema):
                 password=make_password(payload.password) # Ensure password is hashed in the model
             )
 
-            # Send email with credentials
+            # Queue email with credentials; sent after commit by send_outbox_emails
 
-            send_mail(
+            outbox.enqueue(
                 subject="Your Admin Acoount for ClinicFlow",
                 message=(
                     f"Hello {user.username},\n\n"
@@ -56,11 +58,31 @@ def create_admin(request, payload: AdminCreateSchema):
                     "Please log in and change your password immediately."
                 ),
                 from_email="noreply@clinicflow.com",
-                recipient_list=[user.email],
-                fail_silently=False
+                recipient_list=[user.email]
             )
 
     except Exception as e:
         raise HttpError(400, f"Error creating doctor account: {str(e)}")
     
-    return MessageSchema(message=f"Admin {user.username} created successfully.")
\ No newline at end of file
+    return MessageSchema(message=f"Admin {user.username} created successfully.")
+
+
+@management_router.get("/outbox/", response=OutboxStatsSchema)
+def outbox_stats(request):
+    is_admin(request)
+    return {**outbox.queue_stats(), "sender": outbox.metrics.snapshot()}
+
+
+@management_router.get("/profiles/", response=List[ProfileSchema])
+def list_profiles(request):
+    is_admin(request)
+    return profiling.stored_profiles()
+
+
+@management_router.get("/profiles/{name}/")
+def download_profile(request, name: str):
+    is_admin(request)
+    path = profiling.profile_path(name)
+    if path is None:
+        raise HttpError(404, "Profile not found")
+    return FileResponse(path.open("rb"), as_attachment=True, filename=path.name, content_type="application/octet-stream")
@@ -1,23 +1,32 @@
 from ninja import Router
 
 from ninja.errors import HttpError
-from ninja_jwt.authentication import JWTAuth
-from ..schema import PatientCreateSchema, PatientOutSchema, PatientUpdateSchema
+from ..auth import AsyncClinicFlowAuth, ClinicFlowAuth
+from ..conditional import conditional
+from ..instrumentation import query_budget
+from ..replica import replica_reads
+from ..schema import PatientCreateSchema, PatientOutSchema, PatientUpdateSchema, PatientReadSchema
+from ..schema import PatientBulkResultSchema
 from ..schema import MessageSchema
 from ..models import Patient
+from ..patient_search import search_patients
+from ..embeds import shape_for
+from django.core.exceptions import ValidationError
+from pydantic import ValidationError as SchemaError
+from django.db import transaction
 from django.db.models import Q
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from ninja.pagination import paginate
-from typing import List
-
-
-
-
+from ..pagination import CursorPagination
+from typing import Any, Dict, List
 
 
 # Patient endpoints (admin and doctor access)
 
-patient_router = Router(auth=JWTAuth(), tags=['Patients'])
+patient_router = Router(auth=ClinicFlowAuth(), tags=['Patients'])
+
+# Page order of the list endpoints (unique, ending in the primary key)
+PATIENT_ORDERING = ("id",)
 
 def is_admin_or_doctor(request):
     role = request.auth.role
@@ -34,22 +43,95 @@ def create_patient(request, payload: PatientCreateSchema):
     patient = Patient.objects.create(**payload.dict())
     return patient
 
-@patient_router.get("/", response=List[PatientOutSchema])
-@paginate
-def list_patients(request, name: str = None):
-    is_admin_or_doctor(request)
+def filter_patients(name=None, search=None):
+    # Shared by list_patients and alist_patients
     queryset = Patient.objects.all()
     if name:
         queryset = queryset.filter(
             Q(first_name__icontains=name) | Q(last_name__icontains=name)
         )
-    return queryset 
+    # Ranked prefix / fuzzy match on name, phone, email and insurance_id
+    if search:
+        queryset = search_patients(queryset, search).order_by("search_rank", "id")
+    return queryset
 
-@patient_router.get("/{patient_id}/", response=PatientOutSchema)
-def get_patient(request, patient_id: int):
+
+BULK_MODES = ("all_or_nothing", "best_effort")
+BULK_MAX_ROWS = 10000
+BULK_BATCH_SIZE = 500
+
+
+@patient_router.post("/bulk/", response={200: PatientBulkResultSchema, 400: PatientBulkResultSchema})
+def bulk_create_patients(request, payload: List[Dict[str, Any]], mode: str = "all_or_nothing"):
+    # Rows are PatientCreateSchema objects, validated one by one so that a bad
+    # row is reported at its index instead of failing the whole request
     is_admin_or_doctor(request)
-    patient = get_object_or_404(Patient, id=patient_id)
-    return patient
+
+    if mode not in BULK_MODES:
+        raise HttpError(400, f"Invalid mode. Valid options are: {', '.join(BULK_MODES)}")
+    if not payload:
+        raise HttpError(400, "At least one patient is required.")
+    if len(payload) > BULK_MAX_ROWS:
+        raise HttpError(400, f"At most {BULK_MAX_ROWS} patients can be registered per request.")
+
+    # Validate every row before touching the database
+    results = []
+    valid = []
+    for index, data in enumerate(payload):
+        try:
+            row = PatientCreateSchema.model_validate(data)
+        except SchemaError as e:
+            errors = [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()]
+            results.append({"index": index, "id": None, "errors": errors})
+            continue
+
+        errors = []
+        if row.gender not in dict(Patient.GENDER_CHOICES):
+            errors.append("Invalid gender choice")
+
+        patient = Patient(**row.dict())
+        try:
+            patient.full_clean(exclude=["gender"], validate_unique=False, validate_constraints=False)
+        except ValidationError as e:
+            errors.extend(f"{field}: {message}" for field, messages in e.message_dict.items() for message in messages)
+
+        results.append({"index": index, "id": None, "errors": errors})
+        if not errors:
+            valid.append((index, patient))
+
+    failed = len(payload) - len(valid)
+
+    if mode == "all_or_nothing" and failed:
+        return 400, {"mode": mode, "created": 0, "failed": failed, "results": results}
+
+    # Insert in chunks; ids are returned by the database
+    with transaction.atomic():
+        created = Patient.objects.bulk_create([patient for _, patient in valid], batch_size=BULK_BATCH_SIZE)
+
+    for (index, _), patient in zip(valid, created):
+        results[index]["id"] = patient.id
+
+    return 200, {"mode": mode, "created": len(created), "failed": failed, "results": results}
+
+
+@patient_router.get("/", response=List[PatientReadSchema], exclude_unset=True)
+@conditional
+@replica_reads
+@query_budget(7)
+@paginate(CursorPagination, ordering=PATIENT_ORDERING, schema=PatientOutSchema)
+def list_patients(request, name: str = None, search: str = None, fields: str = None, include: str = None):
+    is_admin_or_doctor(request)
+    shape_for(request, "patient", fields, include)
+    return filter_patients(name, search)
+
+@patient_router.get("/{patient_id}/", response=PatientReadSchema, exclude_unset=True)
+@conditional
+@query_budget(6)
+def get_patient(request, patient_id: int, fields: str = None, include: str = None):
+    is_admin_or_doctor(request)
+    shape = shape_for(request, "patient", fields, include)
+    patient = get_object_or_404(shape.values(Patient.objects.all(), "updated_at"), id=patient_id)
+    return shape.render(Patient, patient)
 
 @patient_router.put("/{patient_id}/", response=PatientOutSchema)
 def update_patient(request, patient_id: int, payload: PatientUpdateSchema):
@@ -73,4 +155,28 @@ def delete_patient(request, patient_id: int):
     is_admin_or_doctor(request)
     patient = get_object_or_404(Patient, id=patient_id)
     patient.delete()
-    return MessageSchema(message="Patient deleted successfully")
\ No newline at end of file
+    return MessageSchema(message="Patient deleted successfully")
+
+
+# Async read endpoints (mounted under /async/ for ASGI deployments)
+
+patient_async_router = Router(auth=AsyncClinicFlowAuth(), tags=['Patients (async)'])
+
+@patient_async_router.get("/", response=List[PatientReadSchema], exclude_unset=True)
+@conditional
+@replica_reads
+@query_budget(7)
+@paginate(CursorPagination, ordering=PATIENT_ORDERING, schema=PatientOutSchema)
+async def alist_patients(request, name: str = None, search: str = None, fields: str = None, include: str = None):
+    is_admin_or_doctor(request)
+    shape_for(request, "patient", fields, include)
+    return filter_patients(name, search)
+
+@patient_async_router.get("/{patient_id}/", response=PatientReadSchema, exclude_unset=True)
+@conditional
+@query_budget(6)
+async def aget_patient(request, patient_id: int, fields: str = None, include: str = None):
+    is_admin_or_doctor(request)
+    shape = shape_for(request, "patient", fields, include)
+    patient = await aget_object_or_404(shape.values(Patient.objects.all(), "updated_at"), id=patient_id)
+    return await shape.arender(Patient, patient)
@@ -1,12 +1,18 @@
 from ninja import Router
 
 from ninja.errors import HttpError
-from ninja_jwt.authentication import JWTAuth
-from ..schema import PrescriptionCreateSchema, PrescriptionOutSchema
+from ..auth import AsyncClinicFlowAuth, ClinicFlowAuth
+from ..conditional import conditional
+from ..instrumentation import query_budget
+from ..replica import replica_reads
+from ..schema import PrescriptionCreateSchema, PrescriptionOutSchema, PrescriptionReadSchema
 from ..models import Appointment, Prescription
+from ..exports import stream_export, schema_fields
+from ..embeds import shape_for
 from django.db import transaction
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from ninja.pagination import paginate
+from ..pagination import CursorPagination
 from typing import List
 from decimal import Decimal
 
@@ -20,7 +26,10 @@ def is_admin_or_doctor(request):
 
 # Prescription Enpoints (Admin and Doctor)
 
-prescription_router = Router(auth=JWTAuth(), tags=['Prescriptions'])
+prescription_router = Router(auth=ClinicFlowAuth(), tags=['Prescriptions'])
+
+# Page order of the list endpoints (unique, ending in the primary key)
+PRESCRIPTION_ORDERING = ("-date_issued", "-id")
 
 @prescription_router.post("/", response=PrescriptionOutSchema)
 def create_prescription(request, payload: PrescriptionCreateSchema):
@@ -37,7 +46,7 @@ def create_prescription(request, payload: PrescriptionCreateSchema):
         id=payload.appointment_id
     )
 
-    if appointment.doctor_id != user.doctor.id:
+    if appointment.doctor_id != user.doctor_id:
         raise HttpError(403, "You are not the assigned doctor for this appointment.")
     
     # Ensure appointment is completed
@@ -66,25 +75,15 @@ def create_prescription(request, payload: PrescriptionCreateSchema):
         return prescription
     
 
-@prescription_router.get("/", response=List[PrescriptionOutSchema])
-@paginate
-def list_prescriptions(
-    request,
-    patient_id: int | None = None,
-    appointment_id: int | None = None,
-    doctor_id: int | None = None
-):
-
-    is_admin_or_doctor(request)
+def filter_prescriptions(request, prescriptions, patient_id=None, appointment_id=None, doctor_id=None):
+    # Shared by list_prescriptions and export_prescriptions
     user = request.auth
 
-    prescriptions = Prescription.objects.select_related("appointment", "appointment__patient", "appointment__doctor")
-
     # Restrict to doctor's prescriptions if user is a doctor
     if user.role == "doctor":
-        if doctor_id and doctor_id != user.doctor.id:
+        if doctor_id and doctor_id != user.doctor_id:
             raise HttpError(403, "Doctors can only view their own prescriptions.")
-        prescriptions = prescriptions.filter(appointment__doctor_id=user.doctor.id)
+        prescriptions = prescriptions.filter(appointment__doctor_id=user.doctor_id)
 
     # Filter by patient_id and appointment_id if provided
     if patient_id:
@@ -94,22 +93,115 @@ def list_prescriptions(
     if appointment_id:
         prescriptions = prescriptions.filter(appointment_id=appointment_id)
 
-    return prescriptions.order_by("-date_issued")
+    return prescriptions
+
+
+@prescription_router.get("/", response=List[PrescriptionReadSchema], exclude_unset=True)
+@conditional
+@replica_reads
+@query_budget(3)
+@paginate(CursorPagination, ordering=PRESCRIPTION_ORDERING, schema=PrescriptionOutSchema)
+def list_prescriptions(
+    request,
+    patient_id: int | None = None,
+    appointment_id: int | None = None,
+    doctor_id: int | None = None,
+    fields: str | None = None,
+    include: str | None = None
+):
+
+    is_admin_or_doctor(request)
+    shape_for(request, "prescription", fields, include)
+
+    prescriptions = Prescription.objects.all()
+    prescriptions = filter_prescriptions(request, prescriptions, patient_id, appointment_id, doctor_id)
+
+    return prescriptions
+
+
+@prescription_router.get("/export/")
+@replica_reads
+def export_prescriptions(
+    request,
+    format: str = "csv",
+    patient_id: int | None = None,
+    appointment_id: int | None = None,
+    doctor_id: int | None = None
+):
+
+    is_admin_or_doctor(request)
+
+    prescriptions = filter_prescriptions(request, Prescription.objects.all(), patient_id, appointment_id, doctor_id)
 
+    return stream_export(
+        prescriptions.order_by("date_issued", "id"),
+        schema_fields(PrescriptionOutSchema),
+        format,
+        "prescriptions"
+    )
 
-@prescription_router.get("/{prescription_id}/", response=PrescriptionOutSchema)
-def get_prescription(request, prescription_id: int):
+
+@prescription_router.get("/{prescription_id}/", response=PrescriptionReadSchema, exclude_unset=True)
+@conditional
+@query_budget(2)
+def get_prescription(request, prescription_id: int, fields: str | None = None, include: str | None = None):
     is_admin_or_doctor(request)
     user = request.auth
+    shape = shape_for(request, "prescription", fields, include)
 
-    # Fetch the prescription
+    # Fetch the prescription, with its embeds joined in
     prescription = get_object_or_404(
-        Prescription.objects.select_related("appointment__doctor"),
+        shape.values(Prescription.objects.all(), "appointment__doctor_id", "updated_at"),
+        id=prescription_id
+    )
+
+    # Ensure doctors only access their own prescriptions
+    if user.role == "doctor" and prescription["appointment__doctor_id"] != user.doctor_id:
+        raise HttpError(403, "You are not authorized to view this prescription.")
+    
+    return shape.render(Prescription, prescription)
+
+
+
+# Async read endpoints (mounted under /async/ for ASGI deployments)
+
+prescription_async_router = Router(auth=AsyncClinicFlowAuth(), tags=['Prescriptions (async)'])
+
+@prescription_async_router.get("/", response=List[PrescriptionReadSchema], exclude_unset=True)
+@conditional
+@replica_reads
+@query_budget(3)
+@paginate(CursorPagination, ordering=PRESCRIPTION_ORDERING, schema=PrescriptionOutSchema)
+async def alist_prescriptions(
+    request,
+    patient_id: int | None = None,
+    appointment_id: int | None = None,
+    doctor_id: int | None = None,
+    fields: str | None = None,
+    include: str | None = None
+):
+
+    is_admin_or_doctor(request)
+    shape_for(request, "prescription", fields, include)
+
+    return filter_prescriptions(request, Prescription.objects.all(), patient_id, appointment_id, doctor_id)
+
+
+@prescription_async_router.get("/{prescription_id}/", response=PrescriptionReadSchema, exclude_unset=True)
+@conditional
+@query_budget(2)
+async def aget_prescription(request, prescription_id: int, fields: str | None = None, include: str | None = None):
+    is_admin_or_doctor(request)
+    user = request.auth
+    shape = shape_for(request, "prescription", fields, include)
+
+    prescription = await aget_object_or_404(
+        shape.values(Prescription.objects.all(), "appointment__doctor_id", "updated_at"),
         id=prescription_id
     )
 
     # Ensure doctors only access their own prescriptions
-    if user.role == "doctor" and prescription.appointment.doctor_id != user.doctor.id:
+    if user.role == "doctor" and prescription["appointment__doctor_id"] != user.doctor_id:
         raise HttpError(403, "You are not authorized to view this prescription.")
     
-    return prescription
\ No newline at end of file
+    return await shape.arender(Prescription, prescription)
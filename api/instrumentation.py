@@ -0,0 +1,214 @@
+"""
+Per-request SQL instrumentation and query budgets.
+
+SQLInstrumentationMiddleware wraps every database connection with
+`connection.execute_wrapper` for the duration of a request and records the
+number of queries, total database time and the slowest statements. Each
+response gets a Server-Timing header (`db` and `total`), and the numbers are
+logged as one JSON line on the `api.instrumentation` logger.
+
+Endpoints declare how many queries a request may take with @query_budget,
+placed under the router decorator so it also covers pagination:
+
+    @appointment_router.get("/", response=...)
+    @query_budget(4)
+    @paginate(CursorPagination, ...)
+    def list_appointments(request, ...):
+
+The budget counts every query of the request, authentication included. An
+overrun is logged as a warning, or raised as QueryBudgetExceeded when
+QUERY_BUDGET_RAISE is set (as the API tests do), so an N+1 fails the test
+that triggers it.
+
+Streaming responses (the exports) run most of their queries while the body
+is being sent, after the view has returned. Recording continues around
+every chunk until the body is exhausted or closed; the log line, marked
+"streamed", and the budget cover the whole body. The Server-Timing header
+goes out before the body and only covers the queries run until then.
+"""
+import heapq
+import json
+import logging
+import time
+from contextlib import ExitStack
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+BUDGET_ATTR = "_query_budget"
+RECORDER_ATTR = "_sql_recorder"
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def slow_statement_count():
+    return getattr(settings, "SQL_SLOW_STATEMENTS", 3)
+
+
+def budget_raises():
+    return getattr(settings, "QUERY_BUDGET_RAISE", False)
+
+
+class QueryRecorder:
+    """execute_wrapper that counts and times every statement it sees."""
+
+    def __init__(self, keep=3):
+        self.count = 0
+        self.duration = 0.0
+        self.keep = keep
+        # Min-heap of (duration, sequence, sql), the slowest `keep` statements
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if self.keep:
+                entry = (duration, self.count, sql)
+                if len(self.slowest) < self.keep:
+                    heapq.heappush(self.slowest, entry)
+                else:
+                    heapq.heappushpop(self.slowest, entry)
+
+    def slowest_statements(self):
+        return [
+            {"ms": round(duration * 1000, 2), "sql": sql[:500]}
+            for duration, _, sql in sorted(self.slowest, reverse=True)
+        ]
+
+
+def query_budget(limit):
+    """Declare the most queries a request to the decorated view may run."""
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                setattr(request, BUDGET_ATTR, (view.__name__, limit))
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            setattr(request, BUDGET_ATTR, (view.__name__, limit))
+            return view(request, *args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class SQLInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder(slow_statement_count())
+        setattr(request, RECORDER_ATTR, recorder)
+        started = time.perf_counter()
+        with self.recording(recorder):
+            response = self.get_response(request)
+        return self.finish(request, response, recorder, started)
+
+    def recorded_stream(self, request, response, recorder, started, chunks):
+        chunks = iter(chunks)
+        complete = False
+        try:
+            while True:
+                with self.recording(recorder):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+            complete = True
+        finally:
+            self.report(request, response, recorder, started, raise_over_budget=complete)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder(slow_statement_count())
+        setattr(request, RECORDER_ATTR, recorder)
+        started = time.perf_counter()
+        # The async ORM runs queries in the request's sync thread, on that
+        # thread's connections
+        stack = await sync_to_async(self.recording)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, recorder, started)
+
+    async def arecorded_stream(self, request, response, recorder, started, chunks):
+        stack = await sync_to_async(self.recording)(recorder)
+        complete = False
+        try:
+            async for chunk in chunks:
+                yield chunk
+            complete = True
+        finally:
+            await sync_to_async(stack.close)()
+            self.report(request, response, recorder, started, raise_over_budget=complete)
+
+    def recording(self, recorder):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    def finish(self, request, response, recorder, started):
+        total = time.perf_counter() - started
+        response.headers["Server-Timing"] = (
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", '
+            f"total;dur={total * 1000:.1f}"
+        )
+
+        if response.streaming:
+            # Reported once the body is sent
+            wrap = self.arecorded_stream if response.is_async else self.recorded_stream
+            response.streaming_content = wrap(request, response, recorder, started, response.streaming_content)
+            return response
+
+        self.report(request, response, recorder, started)
+        return response
+
+    def report(self, request, response, recorder, started, raise_over_budget=True):
+        total = time.perf_counter() - started
+        name, limit = getattr(request, BUDGET_ATTR, (None, None))
+        over_budget = limit is not None and recorder.count > limit
+        logger.log(
+            logging.WARNING if over_budget else logging.INFO,
+            json.dumps({
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "view": name,
+                "queries": recorder.count,
+                "query_budget": limit,
+                "db_ms": round(recorder.duration * 1000, 2),
+                "total_ms": round(total * 1000, 2),
+                "slowest": recorder.slowest_statements(),
+                **({"streamed": True} if response.streaming else {}),
+            }),
+        )
+
+        if over_budget and raise_over_budget and budget_raises():
+            raise QueryBudgetExceeded(
+                f"{name} ran {recorder.count} queries, over its budget of {limit}: "
+                + "; ".join(statement["sql"] for statement in recorder.slowest_statements())
+            )
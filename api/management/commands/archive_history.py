@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves completed and canceled appointments older than ARCHIVE_AFTER_DAYS, with their prescriptions, "
+        "into the archive tables, one batch per transaction. Safe to interrupt and rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=getattr(settings, "ARCHIVE_BATCH_SIZE", 1000),
+            help="Appointments moved per transaction.",
+        )
+        parser.add_argument("--max-batches", type=int, help="Stop after this many batches.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the appointments due.")
+
+    def handle(self, *args, **options):
+        cutoff = archive.archive_cutoff()
+        if cutoff is None:
+            raise CommandError("Archival is off; set ARCHIVE_AFTER_DAYS.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        if options["dry_run"]:
+            due = archive.eligible_appointments(cutoff).count()
+            self.stdout.write(f"{due} appointment(s) dated before {cutoff} are due for the archive.")
+            return
+
+        batches = appointments = prescriptions = 0
+        while options["max_batches"] is None or batches < options["max_batches"]:
+            moved, moved_prescriptions = archive.archive_batch(cutoff, options["batch_size"])
+            if not moved:
+                break
+            batches += 1
+            appointments += moved
+            prescriptions += moved_prescriptions
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Batch {batches}: {moved} appointment(s), {moved_prescriptions} prescription(s).")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {appointments} appointment(s) and {prescriptions} prescription(s) "
+            f"dated before {cutoff} in {batches} batch(es)."
+        ))
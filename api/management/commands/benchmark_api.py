@@ -0,0 +1,295 @@
+import json
+import platform
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from ninja_jwt.tokens import AccessToken
+
+from ...models import User, Doctor, Patient, Appointment, Prescription
+
+
+# (label, method, path) per endpoint, requested at /api/<path>. Placeholders are
+# filled from the seeded data, see Command.placeholders(). POST bodies are JSON.
+SCENARIOS = [
+    ("token_pair", "POST", "token/pair"),
+    ("list_appointments", "GET", "appointments/"),
+    ("list_appointments_by_date", "GET", "appointments/?date={date}"),
+    ("list_appointments_cursor", "GET", "appointments/?cursor="),
+    ("list_appointments_embedded", "GET", "appointments/?include=patient,doctor&fields=date_time,status"),
+    ("get_appointment", "GET", "appointments/{appointment_id}/"),
+    ("list_patients", "GET", "patients/"),
+    ("search_patients", "GET", "patients/?search={patient_name}"),
+    ("get_patient", "GET", "patients/{patient_id}/"),
+    ("list_prescriptions", "GET", "prescriptions/"),
+    ("get_prescription", "GET", "prescriptions/{prescription_id}/"),
+    ("list_doctors", "GET", "doctors/"),
+    ("get_doctor", "GET", "doctors/{doctor_id}/"),
+    ("availability", "GET", "availability/?start_date={date}&end_date={date}"),
+    ("billing_report", "GET", "billing/?year={year}"),
+    ("billing_report_month", "GET", "billing/?year={year}&month={month}"),
+]
+
+# Relative increase of a latency percentile over the baseline that counts as a regression
+REGRESSION_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class ClientDriver:
+    """Runs requests in-process through the Django test client, counting queries."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def request(self, method, path, token, body):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = Client()
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+
+        with CaptureQueriesContext(connection) as queries:
+            if method == "POST":
+                response = client.post(path, json.dumps(body), content_type="application/json", **headers)
+            else:
+                response = client.get(path, **headers)
+        return response.status_code, len(queries.captured_queries)
+
+    def close(self):
+        # Each worker thread opened its own database connection
+        connections.close_all()
+
+
+class HTTPDriver:
+    """Runs requests against a running server; query counts aren't visible from here."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, token, body):
+        request = urllib.request.Request(self.base_url + path, method=method)
+        if token:
+            request.add_header("Authorization", f"Bearer {token}")
+        data = None
+        if method == "POST":
+            request.add_header("Content-Type", "application/json")
+            data = json.dumps(body).encode()
+        try:
+            with urllib.request.urlopen(request, data=data) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, None
+
+    def close(self):
+        pass
+
+
+def run_load(driver, method, path, token, body, requests, concurrency):
+    latencies = []
+    queries = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def worker():
+        nonlocal errors
+        try:
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                started = time.perf_counter()
+                status, count = driver.request(method, path, token, body)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if count is not None:
+                        queries.append(count)
+                    if status >= 400:
+                        errors += 1
+        finally:
+            driver.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(min(concurrency, requests))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "queries": max(queries) if queries else None,
+    }
+
+
+def compare(results, baseline, threshold):
+    """(label, metric, baseline, current) for every percentile that got worse than threshold allows."""
+    regressions = []
+    for label, result in results.items():
+        before = baseline.get(label)
+        if before is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            if before.get(metric) and result[metric] > before[metric] * (1 + threshold):
+                regressions.append((label, metric, before[metric], result[metric]))
+        if before.get("queries") is not None and result["queries"] is not None and result["queries"] > before["queries"]:
+            regressions.append((label, "queries", before["queries"], result["queries"]))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks every router (auth, appointments, patients, prescriptions, doctors, availability, billing) "
+        "at a configurable concurrency and reports p50/p95/p99 latency, throughput and query counts per "
+        "endpoint. Run it against a database seeded with `manage.py seed_clinic`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", default="bench_admin", help="Admin user the requests authenticate as.")
+        parser.add_argument("--password", default="bench-password", help="Password of --username, for token_pair.")
+        parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint.")
+        parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per endpoint beforehand.")
+        parser.add_argument("--concurrency", type=int, default=1, help="Requests in flight at once.")
+        parser.add_argument(
+            "--url",
+            help="Base URL of a running server, e.g. http://127.0.0.1:8000. "
+                 "Defaults to the in-process test client, which also counts queries.",
+        )
+        parser.add_argument("--only", help="Comma separated endpoint labels to run.")
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+        parser.add_argument("--baseline", help="JSON file of an earlier run to compare against.")
+        parser.add_argument(
+            "--threshold", type=float, default=0.2,
+            help="Relative latency increase over --baseline reported as a regression.",
+        )
+
+    def placeholders(self):
+        appointment = Appointment.objects.filter(status=Appointment.STATUS_COMPLETED).order_by("date_time", "id").last()
+        prescription = Prescription.objects.order_by("id").first()
+        patient = Patient.objects.order_by("id").first()
+        doctor = Doctor.objects.order_by("id").first()
+        if not (appointment and prescription and patient and doctor):
+            raise CommandError("The database has no clinic data. Run `manage.py seed_clinic` first.")
+
+        day = appointment.date_time.date()
+        return {
+            "appointment_id": appointment.id,
+            "prescription_id": prescription.id,
+            "patient_id": patient.id,
+            "patient_name": patient.last_name[:4],
+            "doctor_id": doctor.id,
+            "date": day.isoformat(),
+            "year": day.year,
+            "month": day.month,
+        }
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist.")
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--requests and --concurrency must be at least 1.")
+
+        scenarios = SCENARIOS
+        if options["only"]:
+            labels = set(options["only"].split(","))
+            unknown = labels - {label for label, _, _ in SCENARIOS}
+            if unknown:
+                raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+            scenarios = [scenario for scenario in SCENARIOS if scenario[0] in labels]
+
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)["results"]
+
+        token = str(AccessToken.for_user(user))
+        credentials = {"username": options["username"], "password": options["password"]}
+        values = self.placeholders()
+
+        self.stdout.write(
+            f"{options['requests']} requests per endpoint, concurrency {options['concurrency']}, "
+            f"{'server ' + options['url'] if options['url'] else 'in-process test client'}"
+        )
+        self.stdout.write(
+            f"{'endpoint':<28}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}"
+        )
+
+        if options["url"]:
+            results = self.run(HTTPDriver(options["url"]), scenarios, values, token, credentials, options)
+        else:
+            # The test client sends Host: testserver
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                results = self.run(ClientDriver(), scenarios, values, token, credentials, options)
+
+        if options["output"]:
+            run = {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "database": connection.vendor,
+                "rows": {
+                    "doctors": Doctor.objects.count(),
+                    "patients": Patient.objects.count(),
+                    "appointments": Appointment.objects.count(),
+                    "prescriptions": Prescription.objects.count(),
+                },
+                "options": {
+                    name: options[name]
+                    for name in ("requests", "warmup", "concurrency", "url")
+                },
+                "results": results,
+            }
+            with open(options["output"], "w") as f:
+                json.dump(run, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options["threshold"])
+            for label, metric, before, after in regressions:
+                self.stdout.write(self.style.WARNING(f"{label}: {metric} {before:.1f} -> {after:.1f}"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}.")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}."))
+
+    def run(self, driver, scenarios, values, token, credentials, options):
+        results = {}
+        for label, method, path in scenarios:
+            path = "/api/" + path.format(**values)
+            request_token, body = (None, credentials) if method == "POST" else (token, None)
+            if options["warmup"]:
+                run_load(driver, method, path, request_token, body, options["warmup"], options["concurrency"])
+            result = run_load(
+                driver, method, path, request_token, body, options["requests"], options["concurrency"]
+            )
+            results[label] = {"method": method, "path": path, **result}
+            queries = "-" if result["queries"] is None else result["queries"]
+            self.stdout.write(
+                f"{label:<28}{result['throughput']:>9.1f}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}"
+                f"{result['p99_ms']:>9.1f}{queries:>9}{result['errors']:>8}"
+            )
+        return results
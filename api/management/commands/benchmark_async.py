@@ -0,0 +1,140 @@
+import asyncio
+import statistics
+import time
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from ninja_jwt.tokens import AccessToken
+
+from ...models import User
+
+
+# (label, path) pairs; each is requested at /api/<path> and /api/async/<path>
+DEFAULT_PATHS = [
+    ("list_appointments", "appointments/"),
+    ("list_patients", "patients/"),
+    ("list_prescriptions", "prescriptions/"),
+    ("list_doctors", "doctors/"),
+    ("billing_report", "billing/?year={year}"),
+]
+
+
+async def asgi_get(app, path, token, client_delay):
+    """Run one GET through the ASGI application; returns the status code.
+
+    `client_delay` sleeps on every message sent to the client, standing in
+    for a slow link that is slow to take the response.
+    """
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"authorization", f"Bearer {token}".encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+    request_sent = False
+    disconnected = asyncio.Event()
+    status = None
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if client_delay:
+            await asyncio.sleep(client_delay)
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    return status
+
+
+async def run_load(app, path, token, requests, concurrency, client_delay):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            status = await asgi_get(app, path, token, client_delay)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "throughput": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares sync and async read endpoints by driving the ASGI application in-process "
+        "at a fixed concurrency. Run it against a seeded database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", required=True, help="Admin user the requests authenticate as.")
+        parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint and mode.")
+        parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight at once.")
+        parser.add_argument(
+            "--client-delay", type=float, default=0.0,
+            help="Seconds each simulated client takes to receive every response message.",
+        )
+        parser.add_argument("--year", type=int, default=time.localtime().tm_year, help="Year for billing_report.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist.")
+
+        token = str(AccessToken.for_user(user))
+        app = get_asgi_application()
+
+        self.stdout.write(
+            f"{options['requests']} requests per endpoint, concurrency {options['concurrency']}, "
+            f"client delay {options['client_delay']}s"
+        )
+        self.stdout.write(f"{'endpoint':<22}{'mode':<7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+
+        for label, path in DEFAULT_PATHS:
+            path = path.format(year=options["year"])
+            for mode, prefix in (("sync", "/api/"), ("async", "/api/async/")):
+                result = asyncio.run(run_load(
+                    app, prefix + path, token,
+                    options["requests"], options["concurrency"], options["client_delay"],
+                ))
+                self.stdout.write(
+                    f"{label:<22}{mode:<7}{result['throughput']:>9.1f}"
+                    f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['errors']:>8}"
+                )
@@ -0,0 +1,112 @@
+import json
+import timeit
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import List
+
+from django.core.management.base import BaseCommand
+from ninja import Schema
+from ninja.renderers import JSONRenderer
+
+from ...renderers import DUMPS, json_backend, orjson
+from ...schema import AppointmentOutSchema, BillingReportSchema, DoctorAvailabilitySchema
+
+
+class AppointmentPageSchema(Schema):
+    items: List[AppointmentOutSchema]
+    count: int | None = None
+    next: str | None = None
+    previous: str | None = None
+
+
+def appointment_page(rows):
+    start = datetime(2026, 3, 10, 9, 0, 12, 345678, tzinfo=timezone.utc)
+    return AppointmentPageSchema(items=[
+        {
+            "id": i,
+            "patient_id": i % 500,
+            "doctor_id": i % 40,
+            "date_time": start + timedelta(minutes=30 * i),
+            "end_time": start + timedelta(minutes=30 * i + 30),
+            "reason": "Follow-up consultation" if i % 3 else None,
+            "status": "scheduled",
+            "appointment_cost": Decimal("120.50") + i % 7,
+            "created_at": start,
+        }
+        for i in range(rows)
+    ], count=rows, next="eyJ2IjpbXX0=").model_dump()
+
+
+def billing_report(rows):
+    return BillingReportSchema(
+        year=2026,
+        month=None,
+        total_appointments=rows * 3,
+        total_prescriptions=rows * 2,
+        total_income=Decimal("123456.75"),
+        breakdown_by_patient=[
+            {
+                "patient_id": i,
+                "full_name": f"Patient Number{i}",
+                "appointment_total": Decimal("250.00") + i % 11,
+                "prescription_total": Decimal("42.25"),
+                "total_amount": Decimal("292.25") + i % 11,
+            }
+            for i in range(rows)
+        ],
+    ).model_dump()
+
+
+def availability(rows):
+    start = datetime(2026, 3, 9, 9, 0, tzinfo=timezone.utc)
+    return [
+        DoctorAvailabilitySchema(
+            doctor_id=doctor,
+            first_name="Ada",
+            last_name="Okafor",
+            specialty="Cardiology",
+            slot_minutes=30,
+            slots=[start + timedelta(minutes=30 * i) for i in range(rows // 20)],
+        ).model_dump()
+        for doctor in range(20)
+    ]
+
+
+PAYLOADS = [
+    ("list_appointments page", appointment_page),
+    ("billing_report", billing_report),
+    ("availability", availability),
+]
+
+
+class Command(BaseCommand):
+    help = "Compares ninja's default JSON renderer with the orjson and stdlib backends of FastJSONRenderer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000, help="Rows per payload.")
+        parser.add_argument("--number", type=int, default=20, help="Renders per timing run.")
+
+    def handle(self, *args, **options):
+        default = JSONRenderer()
+        backends = [("default", lambda data: default.render(None, data, response_status=200))]
+        backends += [(name, DUMPS[name]) for name in ("orjson", "stdlib") if name != "orjson" or orjson]
+
+        self.stdout.write(f"API_JSON_BACKEND resolves to {json_backend()}; {options['rows']} rows per payload")
+        self.stdout.write(f"{'payload':<24}{'backend':<9}{'ms':>9}{'bytes':>10}  output")
+
+        for label, build in PAYLOADS:
+            data = build(options["rows"])
+            reference = default.render(None, data, response_status=200)
+            for name, dumps in backends:
+                seconds = min(timeit.repeat(lambda: dumps(data), number=options["number"], repeat=5))
+                output = dumps(data)
+                text = output.decode() if isinstance(output, bytes) else output
+                if text == reference:
+                    match = "identical"
+                elif json.loads(text) == json.loads(reference):
+                    match = "same values"
+                else:
+                    match = "DIFFERENT"
+                self.stdout.write(
+                    f"{label:<24}{name:<9}{seconds / options['number'] * 1000:>9.2f}{len(output):>10}  {match}"
+                )
@@ -0,0 +1,187 @@
+import multiprocessing
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connections, transaction
+
+from ...models import Doctor, Patient, Appointment
+
+
+# Django's own SQLite configuration, what the app ran with before the production profile
+DEFAULT_PROFILE = {
+    "DATABASE": {"CONN_MAX_AGE": 0, "CONN_HEALTH_CHECKS": False, "OPTIONS": {}},
+    "PRAGMAS": {},
+}
+
+# Benchmark bookings go far past any seeded appointment
+BOOKING_START = datetime(2100, 1, 1, tzinfo=timezone.utc)
+
+
+def use_database(name, profile):
+    """Point the default connection at `name`, configured as `profile`."""
+    connection = connections["default"]
+    connection.close()
+    connection.settings_dict.update(
+        NAME=str(name),
+        CONN_MAX_AGE=profile["DATABASE"].get("CONN_MAX_AGE", 0),
+        CONN_HEALTH_CHECKS=profile["DATABASE"].get("CONN_HEALTH_CHECKS", False),
+        OPTIONS=dict(profile["DATABASE"].get("OPTIONS", {})),
+    )
+    settings.SQLITE_PRAGMAS = profile["PRAGMAS"]
+
+
+def is_lock_error(error):
+    return "locked" in str(error) or "busy" in str(error)
+
+
+def book(index, workers, sequence, doctor_id, patient_id):
+    """One booking the way create_appointment makes it: overlap check, then insert."""
+    starts = BOOKING_START + timedelta(hours=sequence * workers + index)
+    ends = starts + timedelta(minutes=30)
+    with transaction.atomic():
+        taken = Appointment.objects.filter(
+            doctor_id=doctor_id, status=Appointment.STATUS_SCHEDULED, date_time__lt=ends, end_time__gt=starts,
+        ).exists()
+        if not taken:
+            Appointment.objects.create(
+                doctor_id=doctor_id, patient_id=patient_id, date_time=starts, end_time=ends,
+                reason="benchmark", appointment_cost=100,
+            )
+
+
+def read(doctor_id):
+    """One page of a doctor's appointment list."""
+    return len(
+        Appointment.objects.select_related("patient", "doctor")
+        .filter(doctor_id=doctor_id).order_by("-date_time")[:50]
+    )
+
+
+def worker(kind, name, profile, index, workers, doctor_ids, patient_id, deadline, results):
+    # Forked from the benchmark process, whose connections are already closed
+    use_database(name, profile)
+    done = errors = 0
+    try:
+        while time.monotonic() < deadline:
+            doctor_id = doctor_ids[(index + done + errors) % len(doctor_ids)]
+            try:
+                if kind == "write":
+                    book(index, workers, done + errors, doctor_id, patient_id)
+                else:
+                    read(doctor_id)
+                done += 1
+            except OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+                errors += 1
+            finally:
+                # What the request_finished signal does after every request
+                close_old_connections()
+    finally:
+        connections.close_all()
+        results.put((kind, done, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the default SQLite configuration with the production profile (SQLITE_PRODUCTION_PROFILE) "
+        "under concurrent worker processes: bookings per second and lock errors with writers only, and "
+        "reads per second with readers alongside one writer. Runs against a seeded copy in a temporary "
+        "directory, never the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", default="1,2,4,8", help="Comma separated worker process counts.")
+        parser.add_argument("--seconds", type=float, default=3.0, help="Duration of every measurement.")
+        parser.add_argument("--doctors", type=int, default=10, help="Doctors in the seeded database.")
+        parser.add_argument("--patients", type=int, default=500, help="Patients in the seeded database.")
+        parser.add_argument("--directory", help="Where to build the databases; a temporary directory by default.")
+
+    def handle(self, *args, **options):
+        if connections["default"].vendor != "sqlite":
+            raise CommandError("The default database isn't SQLite.")
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise CommandError("Worker processes are forked, which this platform doesn't support.")
+        try:
+            counts = [int(count) for count in options["workers"].split(",")]
+        except ValueError:
+            raise CommandError("--workers must be comma separated integers.")
+        if not counts or min(counts) < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        profiles = {"default": DEFAULT_PROFILE, "production": settings.SQLITE_PRODUCTION_PROFILE}
+        original = dict(connections["default"].settings_dict)
+        original_pragmas = settings.SQLITE_PRAGMAS
+        directory = Path(options["directory"] or tempfile.mkdtemp(prefix="clinicflow-sqlite-"))
+        directory.mkdir(parents=True, exist_ok=True)
+        try:
+            template = directory / "template.sqlite3"
+            self.stdout.write(f"Seeding {template}")
+            doctor_ids, patient_id = self.build_template(template, options)
+
+            self.stdout.write(
+                f"{'profile':<12}{'workers':>8}{'bookings/s':>12}{'lock errors':>13}{'reads/s':>10}{'read errors':>13}"
+            )
+            for label, profile in profiles.items():
+                for count in counts:
+                    write = self.measure(directory, template, profile, count, 0, doctor_ids, patient_id, options)
+                    reads = self.measure(directory, template, profile, 1, count, doctor_ids, patient_id, options)
+                    self.stdout.write(
+                        f"{label:<12}{count:>8}{write['write'][0] / options['seconds']:>12.1f}"
+                        f"{write['write'][1]:>13}{reads['read'][0] / options['seconds']:>10.1f}{reads['read'][1]:>13}"
+                    )
+        finally:
+            connections["default"].close()
+            connections["default"].settings_dict.update(original)
+            settings.SQLITE_PRAGMAS = original_pragmas
+            if not options["directory"]:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def build_template(self, template, options):
+        use_database(template, DEFAULT_PROFILE)
+        call_command("migrate", verbosity=0)
+        call_command(
+            "seed_clinic", doctors=options["doctors"], patients=options["patients"], years=1, verbosity=0,
+        )
+        doctor_ids = list(Doctor.objects.order_by("id").values_list("id", flat=True))
+        patient_id = Patient.objects.order_by("id").values_list("id", flat=True).first()
+        connections.close_all()
+        return doctor_ids, patient_id
+
+    def measure(self, directory, template, profile, writers, readers, doctor_ids, patient_id, options):
+        """Run writers and readers on a fresh copy of the template; (done, errors) per kind."""
+        name = directory / "run.sqlite3"
+        for suffix in ("-wal", "-shm"):
+            Path(f"{name}{suffix}").unlink(missing_ok=True)
+        shutil.copyfile(template, name)
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        deadline = time.monotonic() + options["seconds"]
+        processes = [
+            context.Process(
+                target=worker,
+                args=(kind, name, profile, index, count, doctor_ids, patient_id, deadline, results),
+            )
+            for kind, count in (("write", writers), ("read", readers))
+            for index in range(count)
+        ]
+        for process in processes:
+            process.start()
+
+        totals = {"write": [0, 0], "read": [0, 0]}
+        for _ in processes:
+            kind, done, errors = results.get()
+            totals[kind][0] += done
+            totals[kind][1] += errors
+        for process in processes:
+            process.join()
+            if process.exitcode:
+                raise CommandError("A benchmark worker failed, see its traceback above.")
+        return totals
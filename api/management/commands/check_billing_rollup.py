@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ... import billing_rollup
+
+
+class Command(BaseCommand):
+    help = "Compares the BillingRollup table with the raw appointment and prescription totals."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, help="Only check the rows of this year.")
+        parser.add_argument("--fix", action="store_true", help="Refresh the rows that do not match.")
+
+    def handle(self, *args, **options):
+        mismatches = billing_rollup.differences(year=options["year"])
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("Billing rollup is consistent."))
+            return
+
+        for (year, month, patient_id), (stored, expected) in sorted(mismatches.items()):
+            self.stdout.write(
+                self.style.ERROR(f"{year}-{month:02d} patient {patient_id}: stored={stored} expected={expected}")
+            )
+
+        if options["fix"]:
+            with transaction.atomic():
+                billing_rollup.refresh(mismatches.keys())
+            self.stdout.write(self.style.SUCCESS(f"Refreshed {len(mismatches)} billing rollup row(s)."))
+            return
+
+        raise CommandError(f"{len(mismatches)} billing rollup row(s) do not match the raw tables.")
@@ -0,0 +1,217 @@
+import re
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import DateField, DateTimeField
+from django.utils import timezone
+
+from ...archive import archive_cutoff
+from ...auth import Principal
+from ...embeds import RESOURCES
+from ...endpoints.appointments import APPOINTMENT_ORDERING, appointment_filters
+from ...endpoints.billing import billing_lines, period_sources, raw_patient_querysets, rollup_patient_queryset
+from ...endpoints.doctors import DOCTOR_ORDERING, filter_doctors
+from ...endpoints.patients import PATIENT_ORDERING, filter_patients
+from ...endpoints.prescriptions import PRESCRIPTION_ORDERING, filter_prescriptions
+from ...models import User, Doctor, Patient, Appointment, Prescription
+from ...pagination import CursorPagination
+from ...schema import AppointmentOutSchema, DoctorOutSchema, PatientOutSchema, PrescriptionOutSchema
+
+
+# Plan lines that mean a table is read row by row instead of through an index.
+# SQLite reports "SCAN <table>" (without "USING ... INDEX"; FTS5 tables report
+# "SCAN <table> VIRTUAL TABLE INDEX"), PostgreSQL "Seq Scan on <table>".
+FULL_SCAN_PATTERNS = [
+    re.compile(r"\bSCAN (?!.*\bUSING\b.*\bINDEX\b)(?!\w+ VIRTUAL TABLE INDEX)(?P<table>\w+)"),
+    re.compile(r"\bSeq Scan on (?P<table>\w+)"),
+]
+
+
+def _request(role, doctor_id=None):
+    # The endpoint filters only read request.auth
+    return SimpleNamespace(
+        auth=Principal(id=1, username="explain", role=role, doctor_id=doctor_id, is_active=True)
+    )
+
+
+def _placeholder(model, name):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        # An annotation, e.g. search_rank
+        return 0.0
+    if isinstance(field, DateTimeField):
+        return timezone.now()
+    if isinstance(field, DateField):
+        return timezone.localdate()
+    return 1
+
+
+def pages(label, queryset, ordering, schema):
+    """The first and a following keyset page of a list endpoint, as its paginator fetches them."""
+    paginator = CursorPagination(ordering=ordering, schema=schema)
+    # The same ordering prepare() pages by
+    ordering = tuple(queryset.query.order_by) or paginator.ordering
+    fields = [name.lstrip("-") for name in ordering]
+    cursor = paginator.encode_cursor(ordering, {name: _placeholder(queryset.model, name) for name in fields})
+    return {
+        f"{label}: first page": paginator.prepare(queryset, CursorPagination.Input(cursor=""))["rows"],
+        f"{label}: next page": paginator.prepare(queryset, CursorPagination.Input(cursor=cursor))["rows"],
+    }
+
+
+def hot_querysets():
+    """The querysets the endpoints run, built by the endpoints' own filters and paginator.
+
+    Parameter values are placeholders: the plan depends on the shape of the
+    query, not on the ids or dates it is run with.
+    """
+    now = timezone.now()
+    today = timezone.localdate()
+    admin, doctor = _request("admin"), _request("doctor", doctor_id=1)
+
+    def appointments(request, **filters):
+        return appointment_filters(request, Appointment.objects.all(), **filters)[0]
+
+    def prescriptions(request, **filters):
+        return filter_prescriptions(request, Prescription.objects.all(), **filters)
+
+    querysets = {
+        # doctors / management
+        "create_doctor: email lookup": User.objects.filter(email="doctor@example.com"),
+        "create_doctor: username lookup": User.objects.filter(username="jane.doe.0000"),
+        "create_admin: email lookup": User.objects.filter(email="admin@example.com"),
+        "get_doctor": Doctor.objects.select_related("user").filter(id=1),
+
+        # patients
+        "get_patient": Patient.objects.filter(id=1),
+
+        # appointments
+        "create_appointment_series: booked range": Appointment.objects.filter(
+            doctor_id=1, status=Appointment.STATUS_SCHEDULED,
+            date_time__gt=now - timedelta(hours=8), date_time__lt=now + timedelta(days=365)
+        ),
+        "doctor_availability: booked range": Appointment.objects.filter(
+            doctor_id__in=[1, 2], status=Appointment.STATUS_SCHEDULED,
+            date_time__gt=now - timedelta(hours=8), date_time__lt=now + timedelta(days=31)
+        ),
+        "get_appointment": Appointment.objects.select_related("patient", "doctor").filter(id=1),
+        "export_appointments": appointments(admin).order_by(*APPOINTMENT_ORDERING),
+
+        # prescriptions
+        "get_prescription": Prescription.objects.select_related("appointment__doctor").filter(id=1),
+        "export_prescriptions": prescriptions(admin).order_by("date_issued", "id"),
+    }
+
+    lists = [
+        ("list_appointments", appointments(admin), APPOINTMENT_ORDERING, AppointmentOutSchema),
+        ("list_appointments: date", appointments(admin, date=today.isoformat()), APPOINTMENT_ORDERING,
+         AppointmentOutSchema),
+        ("list_appointments: patient_id", appointments(admin, patient_id=1), APPOINTMENT_ORDERING,
+         AppointmentOutSchema),
+        ("list_appointments: doctor_id", appointments(admin, doctor_id=1), APPOINTMENT_ORDERING,
+         AppointmentOutSchema),
+        ("list_appointments: status + date",
+         appointments(admin, date=today.isoformat(), status=Appointment.STATUS_SCHEDULED),
+         APPOINTMENT_ORDERING, AppointmentOutSchema),
+        ("list_appointments: as doctor", appointments(doctor), APPOINTMENT_ORDERING, AppointmentOutSchema),
+        ("list_appointments: as doctor + status", appointments(doctor, status=Appointment.STATUS_SCHEDULED),
+         APPOINTMENT_ORDERING, AppointmentOutSchema),
+        ("list_prescriptions", prescriptions(admin), PRESCRIPTION_ORDERING, PrescriptionOutSchema),
+        ("list_prescriptions: patient_id", prescriptions(admin, patient_id=1), PRESCRIPTION_ORDERING,
+         PrescriptionOutSchema),
+        ("list_prescriptions: appointment_id", prescriptions(admin, appointment_id=1), PRESCRIPTION_ORDERING,
+         PrescriptionOutSchema),
+        ("list_prescriptions: as doctor", prescriptions(doctor), PRESCRIPTION_ORDERING, PrescriptionOutSchema),
+        ("list_patients", filter_patients(), PATIENT_ORDERING, PatientOutSchema),
+        ("list_patients: search", filter_patients(search="smith"), PATIENT_ORDERING, PatientOutSchema),
+        ("list_doctors", filter_doctors(), DOCTOR_ORDERING, DoctorOutSchema),
+    ]
+    for label, queryset, ordering, schema in lists:
+        querysets.update(pages(label, queryset, ordering, schema))
+
+    # Patient history embeds, archive tables included when archival is on
+    for name in ("appointments", "prescriptions"):
+        for queryset in RESOURCES["patient"][1][name].querysets(doctor, [1, 2]):
+            querysets[f"get_patient: include={name} ({queryset.model._meta.db_table})"] = queryset
+
+    # billing, for this year and, when archival is on, a year in the archive
+    years = [today.year]
+    cutoff = archive_cutoff()
+    if cutoff is not None:
+        years.append(cutoff.year - 1)
+    for year in years:
+        for month in (None, 1):
+            period = f"{year}" + (f"-{month:02d}" if month else "")
+            querysets[f"billing_report {period}: rollup"] = rollup_patient_queryset(year, month)
+            for source in period_sources(year, month):
+                table = source[0].model._meta.db_table
+                appointment_rows, prescription_rows = raw_patient_querysets(*source)
+                appointment_lines, prescription_lines = billing_lines(*source)
+                querysets[f"billing_report {period} ({table}): appointment totals"] = appointment_rows
+                querysets[f"billing_report {period} ({table}): prescription totals"] = prescription_rows
+                querysets[f"export_billing_lines {period} ({table}): appointments"] = appointment_lines
+                querysets[f"export_billing_lines {period} ({table}): prescriptions"] = prescription_lines
+
+    return querysets
+
+
+def reads_one_page(queryset, plan):
+    """Whether an unfiltered, sliced queryset is read in index order, stopping after the slice.
+
+    The first page of an unfiltered list scans the table in primary key
+    order and stops after `limit` rows, which is as cheap as a lookup.
+    """
+    return not queryset.query.where and queryset.query.high_mark is not None and "TEMP B-TREE" not in plan
+
+
+def full_scans(plan, queryset=None):
+    """Return the tables that a query plan reads with a full table scan."""
+    if queryset is not None and reads_one_page(queryset, plan):
+        return []
+    tables = []
+    for line in plan.splitlines():
+        for pattern in FULL_SCAN_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                tables.append(match.group("table"))
+    return tables
+
+
+class Command(BaseCommand):
+    help = "Runs EXPLAIN (QUERY PLAN) on the endpoint querysets and fails if any falls back to a full table scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Print the full query plan for every queryset.",
+        )
+
+    def handle(self, *args, **options):
+        failures = []
+
+        for label, queryset in hot_querysets().items():
+            plan = queryset.explain()
+            scanned = full_scans(plan, queryset)
+
+            if scanned:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f"SCAN  {label} ({', '.join(scanned)})"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"OK    {label}"))
+
+            if options["verbose_plans"] or scanned:
+                for line in plan.splitlines():
+                    self.stdout.write(f"        {line}")
+
+        if failures:
+            raise CommandError(
+                f"{len(failures)} queryset(s) fall back to a full table scan on {connection.vendor}: "
+                + ", ".join(failures)
+            )
+
+        self.stdout.write(self.style.SUCCESS("All endpoint querysets use an index."))
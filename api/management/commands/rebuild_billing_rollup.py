@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ... import billing_rollup
+
+
+class Command(BaseCommand):
+    help = "Backfills or rebuilds the monthly BillingRollup table from appointments and prescriptions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, help="Only rebuild the rows of this year.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per INSERT.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = billing_rollup.rebuild(year=options["year"], batch_size=options["batch_size"])
+
+        scope = f"year {options['year']}" if options["year"] else "all years"
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} billing rollup row(s) for {scope}."))
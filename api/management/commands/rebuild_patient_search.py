@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ... import patient_search
+
+
+class Command(BaseCommand):
+    help = "Recreates the patient search index and its sync triggers, then re-indexes every patient."
+
+    def handle(self, *args, **options):
+        if not patient_search.search_supported():
+            raise CommandError(f"Indexed patient search is not available on {connection.vendor}.")
+
+        with connection.schema_editor() as schema_editor:
+            patient_search.install(schema_editor)
+
+        self.stdout.write(self.style.SUCCESS("Patient search index rebuilt."))
@@ -0,0 +1,190 @@
+import random
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ... import billing_rollup
+from ...models import User, Doctor, Patient, Appointment, Prescription
+
+
+FIRST_NAMES = [
+    "Ada", "Bola", "Chidi", "Dami", "Emeka", "Funke", "Gbenga", "Halima", "Ife", "Jide",
+    "Kemi", "Lola", "Musa", "Ngozi", "Ola", "Peju", "Rotimi", "Sade", "Tunde", "Uche",
+    "Wale", "Yemi", "Zainab", "Amaka", "Bayo", "Chioma", "Dayo", "Efe", "Femi", "Gozie",
+]
+LAST_NAMES = [
+    "Adeyemi", "Bello", "Chukwu", "Danjuma", "Eze", "Fashola", "Garba", "Hassan", "Ibrahim", "Johnson",
+    "Kalu", "Lawal", "Mohammed", "Nwosu", "Obi", "Okafor", "Olawale", "Salami", "Taiwo", "Umar",
+]
+SPECIALTIES = ["General Practice", "Cardiology", "Dermatology", "Pediatrics", "Orthopedics", "Neurology"]
+REASONS = ["Routine check-up", "Follow-up consultation", "Fever", "Back pain", "Blood pressure review", None]
+MEDICATIONS = [
+    ("Amoxicillin", "500mg"), ("Paracetamol", "1g"), ("Ibuprofen", "400mg"),
+    ("Lisinopril", "10mg"), ("Metformin", "850mg"), ("Cetirizine", "10mg"),
+]
+
+# Appointments start on the half hour between 09:00 and 17:00
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 16
+
+SEED_DOMAIN = "seed.clinicflow.example.com"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a deterministic synthetic clinic (doctors, patients, appointments and prescriptions) "
+        "with bulk inserts, for load tests and benchmarks. The same options always produce the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctors", type=int, default=20, help="Number of doctors.")
+        parser.add_argument("--patients", type=int, default=2000, help="Number of patients.")
+        parser.add_argument("--years", type=int, default=2, help="Years of appointment history, ending at --end.")
+        parser.add_argument(
+            "--end", type=date.fromisoformat, default=date(2026, 1, 1),
+            help="Day the history ends (YYYY-MM-DD); appointments from then on are scheduled.",
+        )
+        parser.add_argument("--future-days", type=int, default=30, help="Days of scheduled appointments after --end.")
+        parser.add_argument("--appointments-per-day", type=int, default=8, help="Appointments per doctor per weekday.")
+        parser.add_argument(
+            "--prescription-rate", type=float, default=0.6,
+            help="Share of completed appointments with a prescription.",
+        )
+        parser.add_argument("--seed", type=int, default=1, help="Random seed.")
+        parser.add_argument("--admin-username", default="bench_admin", help="Admin user created for the benchmarks.")
+        parser.add_argument("--password", default="bench-password", help="Password of every seeded user.")
+        parser.add_argument("--batch-size", type=int, default=2000, help="Rows per INSERT.")
+        parser.add_argument("--flush", action="store_true", help="Delete previously seeded data first.")
+
+    def handle(self, *args, **options):
+        if not 0 < options["appointments_per_day"] <= SLOTS_PER_DAY:
+            raise CommandError(f"--appointments-per-day must be between 1 and {SLOTS_PER_DAY}.")
+        if options["doctors"] < 1 or options["patients"] < 1:
+            raise CommandError("--doctors and --patients must be at least 1.")
+
+        seeded = User.objects.filter(email__endswith=f"@{SEED_DOMAIN}")
+        if seeded.exists():
+            if not options["flush"]:
+                raise CommandError("The database already holds seeded data. Pass --flush to replace it.")
+            self.flush(seeded)
+
+        rng = random.Random(options["seed"])
+        batch_size = options["batch_size"]
+        # Hashing is slow; every seeded user shares one hash
+        password = make_password(options["password"])
+
+        with transaction.atomic():
+            User.objects.create(
+                username=options["admin_username"],
+                email=f"{options['admin_username']}@{SEED_DOMAIN}",
+                role="admin",
+                password=password,
+            )
+            doctors = self.create_doctors(rng, options["doctors"], password, batch_size)
+            patients = self.create_patients(rng, options["patients"], batch_size)
+            appointments = self.create_appointments(rng, doctors, patients, options, batch_size)
+            prescriptions = self.create_prescriptions(rng, appointments, options["prescription_rate"], batch_size)
+
+            # bulk_create skips the signals that maintain the rollup
+            if billing_rollup.rollup_enabled():
+                billing_rollup.rebuild(batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(doctors)} doctor(s), {len(patients)} patient(s), {len(appointments)} appointment(s) "
+            f"and {prescriptions} prescription(s). Admin user: {options['admin_username']}."
+        ))
+
+    def flush(self, seeded):
+        # Appointments and prescriptions go with their doctors and patients
+        Patient.objects.filter(email__endswith=f"@{SEED_DOMAIN}").delete()
+        seeded.delete()
+
+    def create_doctors(self, rng, count, password, batch_size):
+        users = User.objects.bulk_create([
+            User(
+                username=f"bench.doctor.{i}",
+                email=f"doctor{i}@{SEED_DOMAIN}",
+                role="doctor",
+                password=password,
+            )
+            for i in range(count)
+        ], batch_size=batch_size)
+        return Doctor.objects.bulk_create([
+            Doctor(
+                user=user,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                specialty=SPECIALTIES[i % len(SPECIALTIES)],
+                phone=f"080{rng.randrange(10 ** 8):08d}",
+            )
+            for i, user in enumerate(users)
+        ], batch_size=batch_size)
+
+    def create_patients(self, rng, count, batch_size):
+        return Patient.objects.bulk_create([
+            Patient(
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                dob=date(1940, 1, 1) + timedelta(days=rng.randrange(365 * 80)),
+                gender=rng.choice(Patient.GENDER_CHOICES)[0],
+                phone=f"081{rng.randrange(10 ** 8):08d}",
+                # Always set, so --flush can tell seeded patients apart
+                email=f"patient{i}@{SEED_DOMAIN}",
+                address=f"{rng.randrange(1, 200)} {rng.choice(LAST_NAMES)} Street",
+                insurance_id=f"INS-{i:07d}" if rng.random() < 0.6 else None,
+            )
+            for i in range(count)
+        ], batch_size=batch_size)
+
+    def create_appointments(self, rng, doctors, patients, options, batch_size):
+        tz = timezone.get_current_timezone()
+        end = options["end"]
+        day = end.replace(year=end.year - options["years"])
+        last_day = end + timedelta(days=options["future_days"])
+        duration = timedelta(minutes=SLOT_MINUTES)
+
+        appointments = []
+        while day < last_day:
+            if day.weekday() < 5:
+                opening = datetime.combine(day, time(9), tzinfo=tz)
+                for doctor in doctors:
+                    # Distinct slots, so no doctor is double-booked
+                    for slot in sorted(rng.sample(range(SLOTS_PER_DAY), options["appointments_per_day"])):
+                        date_time = opening + slot * duration
+                        if day >= end:
+                            status = Appointment.STATUS_SCHEDULED
+                        else:
+                            status = Appointment.STATUS_CANCELED if rng.random() < 0.1 else Appointment.STATUS_COMPLETED
+                        appointments.append(Appointment(
+                            patient=rng.choice(patients),
+                            doctor=doctor,
+                            date_time=date_time,
+                            end_time=date_time + duration,
+                            reason=rng.choice(REASONS),
+                            status=status,
+                            appointment_cost=Decimal(rng.randrange(5000, 50000, 500)) / 100,
+                        ))
+            day += timedelta(days=1)
+
+        return Appointment.objects.bulk_create(appointments, batch_size=batch_size)
+
+    def create_prescriptions(self, rng, appointments, rate, batch_size):
+        prescriptions = []
+        for appointment in appointments:
+            if appointment.status != Appointment.STATUS_COMPLETED or rng.random() >= rate:
+                continue
+            medication, dosage = rng.choice(MEDICATIONS)
+            prescriptions.append(Prescription(
+                appointment=appointment,
+                medication=medication,
+                dosage=dosage,
+                instructions="Take twice daily after meals",
+                date_issued=timezone.localtime(appointment.date_time).date(),
+                prescription_cost=Decimal(rng.randrange(500, 10000, 250)) / 100 if rng.random() < 0.9 else None,
+            ))
+        Prescription.objects.bulk_create(prescriptions, batch_size=batch_size)
+        return len(prescriptions)
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends the queued emails in the email outbox over one reused connection, "
+        "retrying failures with backoff. Runs once, or continuously with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new emails.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between polls with --loop.")
+        parser.add_argument("--batch-size", type=int, help="Emails per batch (default EMAIL_OUTBOX_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        while True:
+            sent = outbox.drain(options["batch_size"])
+            if sent or not options["loop"]:
+                stats = outbox.metrics.snapshot()
+                self.stdout.write(
+                    f"Sent {sent} email(s). Totals: {stats['sent']} sent, {stats['retried']} retried, "
+                    f"{stats['failed']} failed, {stats['connection_errors']} connection error(s)."
+                )
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
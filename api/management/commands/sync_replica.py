@@ -0,0 +1,41 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from ...replica import replica_alias
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the primary SQLite database onto the replica file (CLINICFLOW_REPLICA_DB), once or every "
+        "--interval seconds, standing in for replication when testing the replica router locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, help="Keep copying, this many seconds apart.")
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError("No replica database is configured; set CLINICFLOW_REPLICA_DB.")
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if primary.vendor != "sqlite" or replica.vendor != "sqlite":
+            raise CommandError("sync_replica only copies SQLite databases.")
+        name = str(replica.settings_dict["NAME"])
+        if "mode=ro" in name:
+            raise CommandError(f"The replica {name} already reads the primary's file.")
+
+        while True:
+            started = time.perf_counter()
+            primary.ensure_connection()
+            target = sqlite3.connect(name)
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f"Copied the primary to {name} in {(time.perf_counter() - started) * 1000:.0f} ms.")
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,186 @@
+"""
+Prometheus metrics, served at /metrics in the text exposition format.
+
+Per route, labelled by router and operation (`appointment_router`,
+`list_appointments`) rather than by path to keep cardinality low:
+
+- clinicflow_http_requests_total, by method and status
+- clinicflow_http_request_duration_seconds, a latency histogram
+- clinicflow_db_queries_total and clinicflow_db_query_seconds_total, from
+  the recorder of SQLInstrumentationMiddleware (see api/instrumentation.py)
+
+plus clinicflow_auth_seconds for JWT authentication and
+clinicflow_email_send_seconds / clinicflow_email_delivery_delay_seconds for
+the outbox sender. Requests that match no operation (404s, admin, metrics
+itself) are counted under router="other".
+
+InstrumentedNinjaAPI labels the operations of every router added to it,
+through ninja's decorate_view; the router label is the name the router is
+bound to in its module.
+
+Multiprocess mode: with several worker processes (gunicorn), point the
+PROMETHEUS_MULTIPROC_DIR environment variable at an empty directory before
+the workers start. Each process then writes its samples to mmap files there
+and /metrics aggregates all of them. Clear the directory on deploy, and call
+mark_process_dead(worker.pid) from gunicorn's child_exit hook.
+
+Access: scrapers send `Authorization: Bearer <METRICS_TOKEN>`. With no token
+configured, /metrics answers 403 unless DEBUG is on.
+"""
+import os
+import sys
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from ninja import NinjaAPI
+from ninja.decorators import decorate_view
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+from .instrumentation import RECORDER_ATTR
+
+
+ROUTE_ATTR = "_metrics_route"
+UNMATCHED = ("other", "other")
+
+REQUESTS = Counter(
+    "clinicflow_http_requests", "Requests handled, by route and status.",
+    ["router", "operation", "method", "status"],
+)
+REQUEST_SECONDS = Histogram(
+    "clinicflow_http_request_duration_seconds", "Request latency, by route.",
+    ["router", "operation", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Counter(
+    "clinicflow_db_queries", "SQL queries run by requests, by route.",
+    ["router", "operation"],
+)
+DB_SECONDS = Counter(
+    "clinicflow_db_query_seconds", "Time requests spent in SQL queries, by route.",
+    ["router", "operation"],
+)
+AUTH_SECONDS = Histogram(
+    "clinicflow_auth_seconds", "JWT authentication time.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+EMAIL_SEND_SECONDS = Histogram(
+    "clinicflow_email_send_seconds", "Time to hand one outbox email to the mail backend.",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+EMAIL_DELIVERY_DELAY_SECONDS = Histogram(
+    "clinicflow_email_delivery_delay_seconds", "Seconds from queueing an outbox email to sending it.",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 900, 3600),
+)
+
+
+def multiprocess_mode():
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def _router_name(router, module):
+    # The name the router is bound to in the module that defines its operations
+    for name, value in vars(sys.modules[module]).items():
+        if value is router:
+            return name
+    return None
+
+
+def _labelled(labels):
+    def decorator(run):
+        if iscoroutinefunction(run):
+            @wraps(run)
+            async def arun(request, *args, **kwargs):
+                setattr(request, ROUTE_ATTR, labels)
+                return await run(request, *args, **kwargs)
+            return arun
+
+        @wraps(run)
+        def labelled_run(request, *args, **kwargs):
+            setattr(request, ROUTE_ATTR, labels)
+            return run(request, *args, **kwargs)
+        return labelled_run
+    return decorator
+
+
+def instrument(router, prefix=""):
+    """Label requests with the router and operation that handle them."""
+    for path_view in router.path_operations.values():
+        for operation in path_view.operations:
+            view = operation.view_func
+            router_name = _router_name(router, view.__module__) or prefix.strip("/") or "root"
+            decorate_view(_labelled((router_name, view.__name__)))(view)
+
+
+class InstrumentedNinjaAPI(NinjaAPI):
+    """NinjaAPI that labels the operations of its routers for the metrics."""
+
+    def add_router(self, prefix, router, **kwargs):
+        if isinstance(router, str):
+            router = import_string(router)
+        instrument(router, prefix)
+        super().add_router(prefix, router, **kwargs)
+
+
+def metrics_token():
+    return getattr(settings, "METRICS_TOKEN", None)
+
+
+def metrics_view(request):
+    """
+    /metrics; requires `Authorization: Bearer <METRICS_TOKEN>`. Without a
+    token it is only served with DEBUG on, for local development.
+    """
+    token = metrics_token()
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponse("Forbidden: set METRICS_TOKEN to serve metrics", status=403, content_type="text/plain")
+    elif request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse("Unauthorized", status=401, content_type="text/plain")
+
+    if multiprocess_mode():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    """Records every request against its route; sits outside SQLInstrumentationMiddleware."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, duration):
+        router, operation = getattr(request, ROUTE_ATTR, UNMATCHED)
+        REQUESTS.labels(router, operation, request.method, str(response.status_code)).inc()
+        REQUEST_SECONDS.labels(router, operation, request.method).observe(duration)
+
+        recorder = getattr(request, RECORDER_ATTR, None)
+        if recorder is not None:
+            DB_QUERIES.labels(router, operation).inc(recorder.count)
+            DB_SECONDS.labels(router, operation).inc(recorder.duration)
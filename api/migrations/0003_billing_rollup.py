@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('appointment_count', models.PositiveIntegerField(default=0)),
+                ('appointment_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('prescription_count', models.PositiveIntegerField(default=0)),
+                ('prescription_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.patient')),
+            ],
+            options={
+                'db_table': 'billing_rollups',
+                'constraints': [models.UniqueConstraint(fields=('year', 'month', 'patient'), name='billing_rollup_period_patient_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+from django.db import migrations
+
+
+# The DDL api/patient_search.py installed when this migration was written,
+# frozen here so later changes to that module don't rewrite history
+TABLES_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS patients_search USING fts5("
+    "first_name, last_name, phone, email, insurance_id, content='patients', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS patients_search_trigram USING fts5("
+    "first_name, last_name, phone, email, insurance_id, content='patients', content_rowid='id', "
+    "tokenize='trigram')",
+    # The distinct words of patients_search, read by the typo-tolerant search
+    "CREATE VIRTUAL TABLE IF NOT EXISTS patients_search_vocab USING fts5vocab(patients_search, 'row')",
+]
+
+TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS patients_search_ai",
+    "DROP TRIGGER IF EXISTS patients_search_ad",
+    "DROP TRIGGER IF EXISTS patients_search_au",
+    """CREATE TRIGGER patients_search_ai AFTER INSERT ON patients BEGIN
+INSERT INTO patients_search(rowid, first_name, last_name, phone, email, insurance_id) VALUES (new.id, new.first_name, new.last_name, new.phone, new.email, new.insurance_id);
+INSERT INTO patients_search_trigram(rowid, first_name, last_name, phone, email, insurance_id) VALUES (new.id, new.first_name, new.last_name, new.phone, new.email, new.insurance_id);
+END""",
+    """CREATE TRIGGER patients_search_ad AFTER DELETE ON patients BEGIN
+INSERT INTO patients_search(patients_search, rowid, first_name, last_name, phone, email, insurance_id) VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.email, old.insurance_id);
+INSERT INTO patients_search_trigram(patients_search_trigram, rowid, first_name, last_name, phone, email, insurance_id) VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.email, old.insurance_id);
+END""",
+    """CREATE TRIGGER patients_search_au AFTER UPDATE ON patients BEGIN
+INSERT INTO patients_search(patients_search, rowid, first_name, last_name, phone, email, insurance_id) VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.email, old.insurance_id);
+INSERT INTO patients_search_trigram(patients_search_trigram, rowid, first_name, last_name, phone, email, insurance_id) VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.email, old.insurance_id);
+INSERT INTO patients_search(rowid, first_name, last_name, phone, email, insurance_id) VALUES (new.id, new.first_name, new.last_name, new.phone, new.email, new.insurance_id);
+INSERT INTO patients_search_trigram(rowid, first_name, last_name, phone, email, insurance_id) VALUES (new.id, new.first_name, new.last_name, new.phone, new.email, new.insurance_id);
+END""",
+]
+
+# Indexes the rows already in the patients table
+REBUILD_SQL = [
+    "INSERT INTO patients_search(patients_search) VALUES ('rebuild')",
+    "INSERT INTO patients_search_trigram(patients_search_trigram) VALUES ('rebuild')",
+]
+
+UNINSTALL_SQL = [
+    "DROP TRIGGER IF EXISTS patients_search_ai",
+    "DROP TRIGGER IF EXISTS patients_search_ad",
+    "DROP TRIGGER IF EXISTS patients_search_au",
+    "DROP TABLE IF EXISTS patients_search_vocab",
+    "DROP TABLE IF EXISTS patients_search",
+    "DROP TABLE IF EXISTS patients_search_trigram",
+]
+
+
+def install(apps, schema_editor):
+    # FTS5 search is SQLite only
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in TABLES_SQL + TRIGGERS_SQL + REBUILD_SQL:
+        schema_editor.execute(statement)
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in UNINSTALL_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_billing_rollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
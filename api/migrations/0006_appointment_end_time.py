@@ -0,0 +1,123 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, migrations, models
+
+
+# The overlap checks api/appointment_overlap.py installed when this migration
+# was written, frozen here so later changes to that module don't rewrite history
+OVERLAP_TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS appointments_no_overlap_ai",
+    "DROP TRIGGER IF EXISTS appointments_no_overlap_au",
+    """CREATE TRIGGER appointments_no_overlap_ai BEFORE INSERT ON appointments
+WHEN new.status = 'scheduled'
+BEGIN
+SELECT RAISE(ABORT, 'appointment overlaps a scheduled appointment for this doctor') WHERE EXISTS (
+SELECT 1 FROM appointments
+WHERE doctor_id = new.doctor_id AND status = 'scheduled'
+AND date_time > datetime(new.date_time, '-480 minutes')
+AND date_time < new.end_time AND end_time > new.date_time
+);
+END""",
+    """CREATE TRIGGER appointments_no_overlap_au BEFORE UPDATE ON appointments
+WHEN new.status = 'scheduled'
+BEGIN
+SELECT RAISE(ABORT, 'appointment overlaps a scheduled appointment for this doctor') WHERE EXISTS (
+SELECT 1 FROM appointments
+WHERE doctor_id = new.doctor_id AND status = 'scheduled'
+AND date_time > datetime(new.date_time, '-480 minutes')
+AND date_time < new.end_time AND end_time > new.date_time AND id != new.id
+);
+END""",
+]
+
+OVERLAP_CONSTRAINT_SQL = [
+    "ALTER TABLE appointments DROP CONSTRAINT IF EXISTS appointments_no_overlap",
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    "ALTER TABLE appointments ADD CONSTRAINT appointments_no_overlap "
+    "EXCLUDE USING gist (doctor_id WITH =, tstzrange(date_time, end_time) WITH &&) "
+    "WHERE (status = 'scheduled')",
+]
+
+INSTALL_SQL = {"sqlite": OVERLAP_TRIGGERS_SQL, "postgresql": OVERLAP_CONSTRAINT_SQL}
+
+UNINSTALL_SQL = {
+    "sqlite": OVERLAP_TRIGGERS_SQL[:2],
+    "postgresql": OVERLAP_CONSTRAINT_SQL[:1],
+}
+
+
+def fill_end_time(apps, schema_editor):
+    # Existing appointments get the default duration
+    Appointment = apps.get_model("api", "Appointment")
+    Appointment.objects.update(end_time=models.F("date_time") + timedelta(minutes=30))
+
+
+def check_conflicts(apps, schema_editor):
+    # Scheduled appointments booked before the overlap checks existed may
+    # overlap, or even share a start time, which the unique constraint and
+    # the triggers below would reject. List them rather than pick one to cancel.
+    Appointment = apps.get_model("api", "Appointment")
+    rows = (
+        Appointment.objects
+        .filter(status="scheduled")
+        .order_by("doctor_id", "date_time", "id")
+        .values_list("id", "doctor_id", "date_time", "end_time")
+    )
+    conflicts = []
+    doctor, running = None, []  # (end_time, id) of the doctor's bookings still running
+    for appointment_id, doctor_id, date_time, end_time in rows.iterator():
+        if doctor_id != doctor:
+            doctor, running = doctor_id, []
+        running = [(end, other) for end, other in running if end > date_time]
+        conflicts.extend((other, appointment_id) for _, other in running)
+        running.append((end_time, appointment_id))
+
+    if conflicts:
+        pairs = ", ".join(f"{first} and {second}" for first, second in conflicts[:50])
+        more = f" and {len(conflicts) - 50} more" if len(conflicts) > 50 else ""
+        raise IntegrityError(
+            f"{len(conflicts)} pair(s) of scheduled appointments overlap for the same doctor: "
+            f"appointments {pairs}{more}. Cancel or move one appointment of each pair, then migrate again."
+        )
+
+
+def install_overlap_checks(apps, schema_editor):
+    for statement in INSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def uninstall_overlap_checks(apps, schema_editor):
+    for statement in UNINSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_doctor_working_hours'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='end_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(fill_end_time, migrations.RunPython.noop),
+        migrations.RunPython(check_conflicts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appointment',
+            name='end_time',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'scheduled')), fields=('doctor', 'date_time'), name='appointment_doctor_slot_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.CheckConstraint(condition=models.Q(('end_time__gt', models.F('date_time'))), name='appointment_ends_after_start'),
+        ),
+        # After the table rebuilds above, which would drop the SQLite triggers
+        migrations.RunPython(install_overlap_checks, uninstall_overlap_checks),
+    ]
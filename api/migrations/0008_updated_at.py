@@ -0,0 +1,111 @@
+# Generated by Django 5.2.4 on 2026-10-16 21:12
+
+from django.db import migrations, models
+
+
+# The triggers and constraint of migrations 0004 and 0006 as they stood when
+# this migration was written
+SEARCH_TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS patients_search_ai",
+    "DROP TRIGGER IF EXISTS patients_search_ad",
+    "DROP TRIGGER IF EXISTS patients_search_au",
+    """CREATE TRIGGER patients_search_ai AFTER INSERT ON patients BEGIN
+INSERT INTO patients_search(rowid, first_name, last_name, phone, email, insurance_id) VALUES (new.id, new.first_name, new.last_name, new.phone, new.email, new.insurance_id);
+INSERT INTO patients_search_trigram(rowid, first_name, last_name, phone, email, insurance_id) VALUES (new.id, new.first_name, new.last_name, new.phone, new.email, new.insurance_id);
+END""",
+    """CREATE TRIGGER patients_search_ad AFTER DELETE ON patients BEGIN
+INSERT INTO patients_search(patients_search, rowid, first_name, last_name, phone, email, insurance_id) VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.email, old.insurance_id);
+INSERT INTO patients_search_trigram(patients_search_trigram, rowid, first_name, last_name, phone, email, insurance_id) VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.email, old.insurance_id);
+END""",
+    """CREATE TRIGGER patients_search_au AFTER UPDATE ON patients BEGIN
+INSERT INTO patients_search(patients_search, rowid, first_name, last_name, phone, email, insurance_id) VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.email, old.insurance_id);
+INSERT INTO patients_search_trigram(patients_search_trigram, rowid, first_name, last_name, phone, email, insurance_id) VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.email, old.insurance_id);
+INSERT INTO patients_search(rowid, first_name, last_name, phone, email, insurance_id) VALUES (new.id, new.first_name, new.last_name, new.phone, new.email, new.insurance_id);
+INSERT INTO patients_search_trigram(rowid, first_name, last_name, phone, email, insurance_id) VALUES (new.id, new.first_name, new.last_name, new.phone, new.email, new.insurance_id);
+END""",
+]
+
+OVERLAP_TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS appointments_no_overlap_ai",
+    "DROP TRIGGER IF EXISTS appointments_no_overlap_au",
+    """CREATE TRIGGER appointments_no_overlap_ai BEFORE INSERT ON appointments
+WHEN new.status = 'scheduled'
+BEGIN
+SELECT RAISE(ABORT, 'appointment overlaps a scheduled appointment for this doctor') WHERE EXISTS (
+SELECT 1 FROM appointments
+WHERE doctor_id = new.doctor_id AND status = 'scheduled'
+AND date_time > datetime(new.date_time, '-480 minutes')
+AND date_time < new.end_time AND end_time > new.date_time
+);
+END""",
+    """CREATE TRIGGER appointments_no_overlap_au BEFORE UPDATE ON appointments
+WHEN new.status = 'scheduled'
+BEGIN
+SELECT RAISE(ABORT, 'appointment overlaps a scheduled appointment for this doctor') WHERE EXISTS (
+SELECT 1 FROM appointments
+WHERE doctor_id = new.doctor_id AND status = 'scheduled'
+AND date_time > datetime(new.date_time, '-480 minutes')
+AND date_time < new.end_time AND end_time > new.date_time AND id != new.id
+);
+END""",
+]
+
+OVERLAP_CONSTRAINT_SQL = [
+    "ALTER TABLE appointments DROP CONSTRAINT IF EXISTS appointments_no_overlap",
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    "ALTER TABLE appointments ADD CONSTRAINT appointments_no_overlap "
+    "EXCLUDE USING gist (doctor_id WITH =, tstzrange(date_time, end_time) WITH &&) "
+    "WHERE (status = 'scheduled')",
+]
+
+
+def reinstall_triggers(apps, schema_editor):
+    # Adding or removing the fields rebuilds the patients and appointments
+    # tables on SQLite, which drops their triggers
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        statements = SEARCH_TRIGGERS_SQL + OVERLAP_TRIGGERS_SQL
+    elif vendor == "postgresql":
+        statements = OVERLAP_CONSTRAINT_SQL
+    else:
+        statements = []
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_email_outbox'),
+    ]
+
+    operations = [
+        # Runs last when unapplying, after the RemoveFields
+        migrations.RunPython(migrations.RunPython.noop, reinstall_triggers),
+        migrations.AddField(
+            model_name='appointment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='prescription',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(reinstall_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAppointment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('date_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('reason', models.TextField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('completed', 'Completed'), ('canceled', 'Canceled')], max_length=20)),
+                ('appointment_cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField()),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_appointments', to='api.doctor')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_appointments', to='api.patient')),
+            ],
+            options={
+                'db_table': 'appointments_archive',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedPrescription',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('medication', models.CharField(max_length=100)),
+                ('dosage', models.CharField(max_length=100)),
+                ('instructions', models.TextField()),
+                ('date_issued', models.DateField()),
+                ('prescription_cost', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField()),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prescriptions', to='api.archivedappointment')),
+            ],
+            options={
+                'db_table': 'prescriptions_archive',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedappointment',
+            index=models.Index(fields=['patient', 'date_time'], name='appt_archive_patient_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedappointment',
+            index=models.Index(fields=['status', 'date_time'], name='appt_archive_status_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedprescription',
+            index=models.Index(fields=['date_issued'], name='presc_archive_date_issued_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:32
+
+from django.db import migrations, models
+from django.db.models import F, Min
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def backfill_first_ids(apps, schema_editor):
+    # The lowest appointment and prescription id of every existing rollup row,
+    # over the hot and archive tables like api/billing_rollup.py
+    BillingRollup = apps.get_model('api', 'BillingRollup')
+    if not BillingRollup.objects.exists():
+        return
+
+    first_ids = {}
+    for appointment_name, prescription_name in (('Appointment', 'Prescription'),
+                                                ('ArchivedAppointment', 'ArchivedPrescription')):
+        appointments = (
+            apps.get_model('api', appointment_name).objects
+            .filter(status='completed')
+            .values(year=ExtractYear('date_time'), month=ExtractMonth('date_time'), patient_pk=F('patient_id'))
+            .annotate(first_id=Min('id'))
+            .order_by()
+        )
+        prescriptions = (
+            apps.get_model('api', prescription_name).objects
+            .values(
+                year=ExtractYear('date_issued'), month=ExtractMonth('date_issued'),
+                patient_pk=F('appointment__patient_id'),
+            )
+            .annotate(first_id=Min('id'))
+            .order_by()
+        )
+        for field, rows in (('first_appointment_id', appointments), ('first_prescription_id', prescriptions)):
+            for row in rows:
+                ids = first_ids.setdefault((row['year'], row['month'], row['patient_pk']), {})
+                ids[field] = min(ids.get(field, row['first_id']), row['first_id'])
+
+    for rollup in BillingRollup.objects.all().iterator():
+        ids = first_ids.get((rollup.year, rollup.month, rollup.patient_id), {})
+        BillingRollup.objects.filter(pk=rollup.pk).update(
+            first_appointment_id=ids.get('first_appointment_id'),
+            first_prescription_id=ids.get('first_prescription_id'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingrollup',
+            name='first_appointment_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='billingrollup',
+            name='first_prescription_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_first_ids, migrations.RunPython.noop),
+    ]
@@ -3,13 +3,21 @@ from django.db import models
 # Create your models here.
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
+from django.utils import timezone
+
+from .scheduling import appointment_duration
 
 class User(AbstractUser):
     role = models.CharField(max_length=20, choices=[("doctor", "Doctor"), ("admin", "Admin")])
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'users'
+        indexes = [
+            # create_doctor / create_admin check for an existing email
+            models.Index(fields=["email"], name="users_email_idx"),
+        ]
 
 class Doctor(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -18,6 +26,7 @@ class Doctor(models.Model):
     specialty = models.CharField(max_length=100)
     phone = models.CharField(max_length=20)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'doctors'
@@ -41,6 +50,7 @@ class Patient(models.Model):
     address = models.TextField()
     insurance_id = models.CharField(max_length=50, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'patients'
@@ -58,13 +68,42 @@ class Appointment(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
     date_time = models.DateTimeField()
+    end_time = models.DateTimeField()
     reason = models.TextField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_SCHEDULED)
     appointment_cost = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'appointments'
+        indexes = [
+            # Double-booking check and doctor-scoped listing
+            models.Index(fields=["doctor", "date_time", "status"], name="appt_doctor_dt_status_idx"),
+            # Patient history listing
+            models.Index(fields=["patient", "date_time"], name="appt_patient_dt_idx"),
+            # Billing report and status/date listing
+            models.Index(fields=["status", "date_time"], name="appt_status_dt_idx"),
+            models.Index(fields=["date_time"], name="appt_dt_idx"),
+        ]
+        constraints = [
+            # Overlapping scheduled appointments are rejected by triggers or an
+            # exclusion constraint, see api/appointment_overlap.py
+            models.UniqueConstraint(
+                fields=["doctor", "date_time"],
+                condition=models.Q(status="scheduled"),
+                name="appointment_doctor_slot_uniq",
+            ),
+            models.CheckConstraint(
+                condition=models.Q(end_time__gt=models.F("date_time")),
+                name="appointment_ends_after_start",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.end_time is None and self.date_time is not None:
+            self.end_time = self.date_time + appointment_duration()
+        super().save(*args, **kwargs)
 
 class Prescription(models.Model):
     appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE)
@@ -74,6 +113,130 @@ class Prescription(models.Model):
     date_issued = models.DateField()
     prescription_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, validators=[MinValueValidator(0)])
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'prescriptions'
+        indexes = [
+            # Billing report and default listing order
+            models.Index(fields=["date_issued"], name="presc_date_issued_idx"),
+        ]
+
+class ArchivedAppointment(models.Model):
+    # Completed and canceled appointments moved out of `appointments` by
+    # api/archive.py, under their original ids
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="archived_appointments")
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="archived_appointments")
+    date_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    reason = models.TextField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=Appointment.STATUS_CHOICES)
+    appointment_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'appointments_archive'
+        indexes = [
+            # Patient history
+            models.Index(fields=["patient", "date_time"], name="appt_archive_patient_dt_idx"),
+            # Billing report
+            models.Index(fields=["status", "date_time"], name="appt_archive_status_dt_idx"),
+        ]
+
+class ArchivedPrescription(models.Model):
+    # Prescriptions of archived appointments, moved along with them
+    id = models.BigIntegerField(primary_key=True)
+    appointment = models.ForeignKey(ArchivedAppointment, on_delete=models.CASCADE, related_name="prescriptions")
+    medication = models.CharField(max_length=100)
+    dosage = models.CharField(max_length=100)
+    instructions = models.TextField()
+    date_issued = models.DateField()
+    prescription_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'prescriptions_archive'
+        indexes = [
+            # Billing report
+            models.Index(fields=["date_issued"], name="presc_archive_date_issued_idx"),
+        ]
+
+class BillingRollup(models.Model):
+    # Per (year, month, patient) billing totals, maintained by api/billing_rollup.py
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
+    appointment_count = models.PositiveIntegerField(default=0)
+    appointment_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    prescription_count = models.PositiveIntegerField(default=0)
+    prescription_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Lowest ids in the bucket, for the report's patient order
+    first_appointment_id = models.BigIntegerField(null=True, blank=True)
+    first_prescription_id = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'billing_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=["year", "month", "patient"], name="billing_rollup_period_patient_uniq"),
+        ]
+
+class DoctorWorkingHours(models.Model):
+    # One working window on a weekday; a doctor may have several per day
+    WEEKDAY_CHOICES = [
+        (0, "Monday"),
+        (1, "Tuesday"),
+        (2, "Wednesday"),
+        (3, "Thursday"),
+        (4, "Friday"),
+        (5, "Saturday"),
+        (6, "Sunday"),
+    ]
+
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="working_hours")
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    class Meta:
+        db_table = 'doctor_working_hours'
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(start_time__lt=models.F("end_time")),
+                name="working_hours_start_before_end",
+            ),
+        ]
+
+class OutboxEmail(models.Model):
+    # Email queued inside a write transaction and sent later by api/outbox.py
+    STATUS_PENDING = "pending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
-        db_table = 'prescriptions'
\ No newline at end of file
+        db_table = 'email_outbox'
+        indexes = [
+            # The sender's "due pending emails" scan
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_status_next_idx"),
+        ]
@@ -0,0 +1,204 @@
+"""
+Transactional email outbox.
+
+Endpoints call enqueue() inside their write transaction instead of sending
+mail, so the email is queued if and only if the transaction commits, and
+neither SMTP latency nor SMTP failures reach the request.
+
+`manage.py send_outbox_emails` drains the table: due emails are sent in
+batches over one reused connection from get_connection(), so any
+EMAIL_BACKEND works (locmem in tests, console in development). Failures are
+retried with exponential backoff, then marked failed. Bodies may carry
+credentials (e.g. a new doctor's initial password), so they are cleared once
+sent and when the sender gives up on an email; a failed email keeps its
+subject, recipients and last error for investigation.
+
+The sender is meant to run as a single worker per database.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .metrics import EMAIL_DELIVERY_DELAY_SECONDS, EMAIL_SEND_SECONDS
+from .models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+def batch_size():
+    return getattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", 50)
+
+
+def max_attempts():
+    return getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 5)
+
+
+def retry_delay(attempts):
+    # 30s, 60s, 120s, ... capped at one hour
+    base = getattr(settings, "EMAIL_OUTBOX_RETRY_DELAY", 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 3600))
+
+
+def enqueue(subject, message, from_email, recipient_list):
+    """Queue an email; call inside the transaction that makes it true."""
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email,
+        recipients=list(recipient_list),
+    )
+
+
+class SenderMetrics:
+    """Counters for this process's sender, safe to read from another thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.batches = 0
+            self.sent = 0
+            self.retried = 0
+            self.failed = 0
+            self.connection_errors = 0
+            self.send_seconds = 0.0
+            # Seconds from enqueue to delivery, for the last sent email
+            self.last_delivery_delay = None
+
+    def record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def observe_delivery(self, seconds):
+        with self._lock:
+            self.last_delivery_delay = seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "connection_errors": self.connection_errors,
+                "send_seconds": round(self.send_seconds, 3),
+                "last_delivery_delay": self.last_delivery_delay,
+            }
+
+
+metrics = SenderMetrics()
+
+
+def _message(email, connection):
+    return EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.recipients,
+        connection=connection,
+    )
+
+
+def _failed(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)[:1000]
+    if email.attempts >= max_attempts():
+        email.status = OutboxEmail.STATUS_FAILED
+        # Never sent, and never retried: the body isn't needed anymore
+        email.body = ""
+        logger.error("Giving up on outbox email %s after %s attempts: %s", email.id, email.attempts, error)
+        return "failed"
+    email.next_attempt_at = now + retry_delay(email.attempts)
+    logger.warning("Outbox email %s failed (attempt %s), retrying: %s", email.id, email.attempts, error)
+    return "retried"
+
+
+def send_due(limit=None):
+    """Send one batch of due emails; returns how many were sent."""
+    now = timezone.now()
+    emails = list(
+        OutboxEmail.objects
+        .filter(status=OutboxEmail.STATUS_PENDING, next_attempt_at__lte=now)
+        .order_by("next_attempt_at", "id")[:limit or batch_size()]
+    )
+    if not emails:
+        return 0
+
+    outcomes = {"sent": 0, "retried": 0, "failed": 0}
+    started = time.perf_counter()
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # Nothing can be sent this round; every email waits for its next attempt
+        metrics.record(connection_errors=1)
+        for email in emails:
+            outcomes[_failed(email, e, now)] += 1
+    else:
+        try:
+            # One message per call so a rejected recipient fails only its own email
+            for email in emails:
+                sending = time.perf_counter()
+                try:
+                    connection.send_messages([_message(email, connection)])
+                except Exception as e:
+                    outcomes[_failed(email, e, now)] += 1
+                else:
+                    EMAIL_SEND_SECONDS.observe(time.perf_counter() - sending)
+                    email.status = OutboxEmail.STATUS_SENT
+                    email.attempts += 1
+                    email.sent_at = timezone.now()
+                    EMAIL_DELIVERY_DELAY_SECONDS.observe((email.sent_at - email.created_at).total_seconds())
+                    email.body = ""
+                    email.last_error = ""
+                    outcomes["sent"] += 1
+        finally:
+            connection.close()
+
+    OutboxEmail.objects.bulk_update(
+        emails, ["status", "attempts", "next_attempt_at", "last_error", "sent_at", "body"]
+    )
+
+    delivered = [email for email in emails if email.status == OutboxEmail.STATUS_SENT]
+    metrics.record(batches=1, send_seconds=time.perf_counter() - started, **outcomes)
+    if delivered:
+        metrics.observe_delivery((delivered[-1].sent_at - delivered[-1].created_at).total_seconds())
+    return outcomes["sent"]
+
+
+def drain(limit=None):
+    """Send batches until no email is due; returns how many were sent."""
+    total = 0
+    while True:
+        sent = send_due(limit)
+        total += sent
+        if not sent:
+            return total
+
+
+def queue_stats():
+    # Outbox state from the table, so it is the same from every process
+    counts = dict(
+        OutboxEmail.objects.values_list("status").annotate(count=Count("id")).order_by()
+    )
+    oldest = (
+        OutboxEmail.objects
+        .filter(status=OutboxEmail.STATUS_PENDING)
+        .aggregate(oldest=Min("created_at"))["oldest"]
+    )
+    return {
+        "pending": counts.get(OutboxEmail.STATUS_PENDING, 0),
+        "sent": counts.get(OutboxEmail.STATUS_SENT, 0),
+        "failed": counts.get(OutboxEmail.STATUS_FAILED, 0),
+        "oldest_pending_seconds": (timezone.now() - oldest).total_seconds() if oldest else None,
+    }
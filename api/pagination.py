@@ -0,0 +1,289 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Endpoints opt in with `@paginate(CursorPagination, ordering=(...))`, where
+`ordering` is a unique ordering ending in the primary key, e.g.
+("date_time", "id"). A view may instead return a queryset that is already
+ordered that way (e.g. by an annotated search rank, then id). Clients that
+keep using `limit`/`offset` get the usual page plus `count`; passing
+`cursor` (an empty value starts at the first page) switches to keyset mode,
+which seeks directly to the page with a WHERE on the ordering columns and
+skips the COUNT(*), so every page costs the same regardless of depth.
+
+Passing `schema=` (the endpoint's item schema) projects the page with
+`.values()` on just the columns that schema reads, plus those the cursor and
+ETag need, so rows are validated as dicts without building model instances
+or joining tables the schema never touches. A view that took `?fields=` /
+`?include=` (see api/embeds.py) is projected and rendered by its Shape instead.
+"""
+import base64
+import datetime
+import json
+from decimal import Decimal
+from math import inf
+from typing import Any, List
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from ninja import Field, Schema
+from ninja.conf import settings as ninja_settings
+from ninja.errors import HttpError
+from ninja.pagination import AsyncPaginationBase
+
+from . import conditional, embeds
+
+
+def _max_limit():
+    return ninja_settings.PAGINATION_MAX_LIMIT if ninja_settings.PAGINATION_MAX_LIMIT != inf else None
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _to_python(model, name, value):
+    # Model fields parse their own values; annotations (e.g. a rank) are used as-is
+    try:
+        return model._meta.get_field(name).to_python(value)
+    except FieldDoesNotExist:
+        return value
+
+
+def schema_columns(schema, queryset):
+    """Columns (model fields or annotations) an output schema reads, or None.
+
+    None means some schema field is not a plain column, e.g. a nested schema
+    or a resolver, and rows have to stay model instances.
+    """
+    model = queryset.model
+    columns = {field.attname for field in model._meta.concrete_fields}
+    columns |= {field.name for field in model._meta.concrete_fields if not field.is_relation}
+    columns |= set(queryset.query.annotations)
+    names = list(schema.model_fields)
+    if getattr(schema, "_ninja_resolvers", None) or not set(names) <= columns:
+        return None
+    return names
+
+
+class CursorPagination(AsyncPaginationBase):
+    class Input(Schema):
+        limit: int = Field(ninja_settings.PAGINATION_PER_PAGE, ge=1, le=_max_limit())
+        offset: int = Field(0, ge=0)
+        cursor: str | None = None
+
+    class Output(Schema):
+        items: List[Any]
+        count: int | None = None
+        next: str | None = None
+        previous: str | None = None
+
+    def __init__(self, *, ordering=("id",), schema=None, **kwargs):
+        super().__init__(**kwargs)
+        self.ordering = tuple(ordering)
+        self.schema = schema
+
+    def project(self, queryset, ordering, shape=None):
+        # values() over the schema's columns; the queryset unchanged if it can't be
+        extra = [name.lstrip("-") for name in ordering] + ["id"]
+        if conditional.has_updated_at(queryset.model):
+            extra.append("updated_at")
+        if shape is not None:
+            return shape.values(queryset, *extra)
+        columns = schema_columns(self.schema, queryset) if self.schema is not None else None
+        if columns is None:
+            return queryset
+        return queryset.values(*dict.fromkeys(columns + extra))
+
+    # Cursor encoding
+
+    def encode_cursor(self, ordering, item, backwards=False):
+        fields = [name.lstrip("-") for name in ordering]
+        if isinstance(item, dict):
+            values = [item[name] for name in fields]
+        else:
+            values = [getattr(item, name) for name in fields]
+        payload = {"v": [_encode_value(value) for value in values], "b": backwards}
+        return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+    def decode_cursor(self, queryset, ordering, cursor):
+        fields = [name.lstrip("-") for name in ordering]
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = payload["v"]
+            backwards = bool(payload["b"])
+            if len(values) != len(fields):
+                raise ValueError
+            values = [_to_python(queryset.model, name, value) for name, value in zip(fields, values)]
+        except (ValueError, KeyError, TypeError, ValidationError) as exc:
+            raise HttpError(400, "Invalid cursor.") from exc
+        return values, backwards
+
+    # Keyset filtering
+
+    def seek(self, ordering, values, backwards):
+        # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), per column direction
+        fields = [name.lstrip("-") for name in ordering]
+        condition = Q()
+        for index, name in enumerate(fields):
+            after = ordering[index].startswith("-") == backwards
+            lookup = f"{name}__gt" if after else f"{name}__lt"
+            clause = Q(**{lookup: values[index]})
+            for previous in range(index):
+                clause &= Q(**{fields[previous]: values[previous]})
+            condition |= clause
+        return condition
+
+    def reversed_ordering(self, ordering):
+        return [name[1:] if name.startswith("-") else f"-{name}" for name in ordering]
+
+    def prepare(self, queryset, pagination, shape=None):
+        """Work out which rows to fetch; shared by the sync and async paths.
+
+        Returns a dict with the `rows` queryset to fetch, the `count`
+        queryset (offset mode only) and what build() needs afterwards.
+        """
+        limit = pagination.limit
+        if ninja_settings.PAGINATION_MAX_LIMIT != inf:
+            limit = min(limit, ninja_settings.PAGINATION_MAX_LIMIT)
+
+        # An ordering set by the view (e.g. search rank) takes precedence
+        ordering = tuple(queryset.query.order_by) or self.ordering
+        queryset = queryset.order_by(*ordering)
+        page = {"ordering": ordering, "limit": limit, "offset": pagination.offset, "count": None}
+        counted = queryset
+        queryset = self.project(queryset, ordering, shape)
+
+        # Limit/offset mode, kept compatible with the default paginator
+        if pagination.cursor is None:
+            offset = pagination.offset
+            return {**page, "mode": "offset", "rows": queryset[offset : offset + limit], "count": counted}
+
+        # Keyset mode: an empty cursor starts at the first page
+        if not pagination.cursor:
+            return {**page, "mode": "first", "rows": queryset[: limit + 1]}
+
+        values, backwards = self.decode_cursor(queryset, ordering, pagination.cursor)
+
+        if backwards:
+            rows = (
+                queryset
+                .filter(self.seek(ordering, values, True))
+                .order_by(*self.reversed_ordering(ordering))[: limit + 1]
+            )
+            return {**page, "mode": "backwards", "rows": rows}
+
+        rows = queryset.filter(self.seek(ordering, values, False))[: limit + 1]
+        return {**page, "mode": "forwards", "rows": rows}
+
+    def build(self, page, rows, count):
+        ordering, limit = page["ordering"], page["limit"]
+
+        if page["mode"] == "offset":
+            offset = page["offset"]
+            return {
+                "items": rows,
+                "count": count,
+                "next": self.encode_cursor(ordering, rows[-1]) if rows and offset + limit < count else None,
+                "previous": self.encode_cursor(ordering, rows[0], backwards=True) if rows and offset else None,
+            }
+
+        if page["mode"] == "first":
+            items = rows[:limit]
+            return {
+                "items": items,
+                "count": None,
+                "next": self.encode_cursor(ordering, items[-1]) if len(rows) > limit else None,
+                "previous": None,
+            }
+
+        if page["mode"] == "backwards":
+            items = rows[:limit][::-1]
+            return {
+                "items": items,
+                "count": None,
+                "next": self.encode_cursor(ordering, items[-1]) if items else None,
+                "previous": self.encode_cursor(ordering, items[0], backwards=True) if len(rows) > limit else None,
+            }
+
+        items = rows[:limit]
+        return {
+            "items": items,
+            "count": None,
+            "next": self.encode_cursor(ordering, items[-1]) if len(rows) > limit else None,
+            "previous": self.encode_cursor(ordering, items[0], backwards=True) if items else None,
+        }
+
+    # Conditional GET validators (see api/conditional.py)
+
+    def _conditional(self, queryset, request, shape):
+        # Embedded rows change independently of the page, see api/embeds.py
+        return (
+            request is not None
+            and request.method == "GET"
+            and conditional.has_updated_at(queryset.model)
+            and not (shape is not None and shape.include)
+        )
+
+    def _not_modified(self, page, request, state):
+        # Offset mode: validators from max(updated_at) + count; on a match the
+        # page itself is never fetched, since the response is a 304
+        validators = conditional.list_validators(request, page["count"].model, state)
+        conditional.remember(request, validators)
+        return conditional.conditional_response(request, validators) is not None
+
+    def _remember_rows(self, page, request, rows):
+        conditional.remember(request, conditional.rows_validators(request, page["rows"].model, rows))
+
+    def paginate_queryset(self, queryset, pagination: Input, **params):
+        request = params.get("request")
+        shape = embeds.current_shape(request)
+        page = self.prepare(queryset, pagination, shape)
+
+        if not self._conditional(queryset, request, shape):
+            count = self._items_count(page["count"]) if page["count"] is not None else None
+            return self._shaped(self.build(page, list(page["rows"]), count), shape)
+
+        if page["count"] is not None:
+            state = conditional.list_state_query(page["count"])
+            if self._not_modified(page, request, state):
+                return {"items": [], "count": state["count"]}
+            return self._shaped(self.build(page, list(page["rows"]), state["count"]), shape)
+
+        rows = list(page["rows"])
+        self._remember_rows(page, request, rows)
+        return self._shaped(self.build(page, rows, None), shape)
+
+    async def apaginate_queryset(self, queryset, pagination: Input, **params):
+        request = params.get("request")
+        shape = embeds.current_shape(request)
+        page = self.prepare(queryset, pagination, shape)
+
+        if not self._conditional(queryset, request, shape):
+            count = await self._aitems_count(page["count"]) if page["count"] is not None else None
+            return await self._ashaped(self.build(page, [row async for row in page["rows"]], count), shape)
+
+        if page["count"] is not None:
+            state = await conditional.alist_state_query(page["count"])
+            if self._not_modified(page, request, state):
+                return {"items": [], "count": state["count"]}
+            return await self._ashaped(self.build(page, [row async for row in page["rows"]], state["count"]), shape)
+
+        rows = [row async for row in page["rows"]]
+        self._remember_rows(page, request, rows)
+        return await self._ashaped(self.build(page, rows, None), shape)
+
+    # Sparse fieldsets and embeds (see api/embeds.py)
+
+    def _shaped(self, result, shape):
+        if shape is not None:
+            result["items"] = shape.rows(result["items"])
+        return result
+
+    async def _ashaped(self, result, shape):
+        if shape is not None:
+            result["items"] = await shape.arows(result["items"])
+        return result
@@ -0,0 +1,262 @@
+"""
+Indexed patient search.
+
+On SQLite the patients table is mirrored into two external-content FTS5
+tables kept in sync by triggers on insert, update and delete:
+
+- patients_search: word tokens with prefix indexes, for "starts with" matches
+- patients_search_trigram: trigram tokens, for infix matches
+
+A search matches in three ways, every word of the search text having to
+match in each:
+
+- prefix: every word starts a word of the patient, "jo sm" finds John Smith
+- infix: every word (of 3 characters or more) appears inside the patient's
+  text, "mith" finds Smith
+- typo: every word starts a word of the patient or is within a few edits of
+  one (1 for words of 4 to 6 characters, 2 from 7 on), "smth" and "jonh"
+  find John Smith. Candidate words come from the patients_search_vocab
+  table, the distinct words of the index sharing the search word's first
+  letter, compared with the edit_distance() SQL function registered on
+  every SQLite connection (see api/signals.py).
+
+Results are ranked by bm25, prefix matches first, then infix, then typo
+matches. Other database backends fall back to an unranked icontains search.
+
+Migrations that rebuild the patients table on SQLite (e.g. AddField with a
+default) drop its triggers and must create them again. Migrations carry a
+frozen copy of the statements below (see 0004_patient_search and
+0008_updated_at) rather than importing this module, which keeps changing.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+
+SEARCH_COLUMNS = ["first_name", "last_name", "phone", "email", "insurance_id"]
+
+SEARCH_TABLES = {
+    "patients_search": "tokenize='unicode61 remove_diacritics 2', prefix='2 3'",
+    "patients_search_trigram": "tokenize='trigram'",
+}
+
+VOCABULARY_TABLE = "patients_search_vocab"
+
+EDIT_DISTANCE_FUNCTION = "clinicflow_edit_distance"
+
+# Infix matches rank after every prefix match, typo matches after both
+FUZZY_RANK_OFFSET = 1000
+TYPO_RANK_OFFSET = 2000
+
+# Vocabulary words a misspelled search word is expanded to, closest first
+MAX_CORRECTIONS = 20
+
+
+def search_supported(using=None):
+    return (using or connection).vendor == "sqlite"
+
+
+def _columns(prefix=""):
+    return ", ".join(f"{prefix}{column}" for column in SEARCH_COLUMNS)
+
+
+def install_sql():
+    statements = []
+    for table, options in SEARCH_TABLES.items():
+        statements.append(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+            f"{_columns()}, content='patients', content_rowid='id', {options})"
+        )
+    statements.append(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {VOCABULARY_TABLE} USING fts5vocab(patients_search, 'row')"
+    )
+    statements.extend(trigger_sql())
+    return statements
+
+
+def trigger_sql():
+    inserts = "\n".join(
+        f"INSERT INTO {table}(rowid, {_columns()}) VALUES (new.id, {_columns('new.')});"
+        for table in SEARCH_TABLES
+    )
+    deletes = "\n".join(
+        f"INSERT INTO {table}({table}, rowid, {_columns()}) VALUES ('delete', old.id, {_columns('old.')});"
+        for table in SEARCH_TABLES
+    )
+    return [
+        "DROP TRIGGER IF EXISTS patients_search_ai",
+        "DROP TRIGGER IF EXISTS patients_search_ad",
+        "DROP TRIGGER IF EXISTS patients_search_au",
+        f"CREATE TRIGGER patients_search_ai AFTER INSERT ON patients BEGIN\n{inserts}\nEND",
+        f"CREATE TRIGGER patients_search_ad AFTER DELETE ON patients BEGIN\n{deletes}\nEND",
+        f"CREATE TRIGGER patients_search_au AFTER UPDATE ON patients BEGIN\n{deletes}\n{inserts}\nEND",
+    ]
+
+
+def uninstall_sql():
+    return [
+        "DROP TRIGGER IF EXISTS patients_search_ai",
+        "DROP TRIGGER IF EXISTS patients_search_ad",
+        "DROP TRIGGER IF EXISTS patients_search_au",
+    ] + [f"DROP TABLE IF EXISTS {table}" for table in [VOCABULARY_TABLE, *SEARCH_TABLES]]
+
+
+def install(schema_editor):
+    # Creates the search tables and triggers, then indexes existing rows
+    if not search_supported(schema_editor.connection):
+        return
+    for statement in install_sql():
+        schema_editor.execute(statement)
+    rebuild(schema_editor.connection)
+
+
+def install_triggers(schema_editor):
+    if not search_supported(schema_editor.connection):
+        return
+    for statement in trigger_sql():
+        schema_editor.execute(statement)
+
+
+def uninstall(schema_editor):
+    if not search_supported(schema_editor.connection):
+        return
+    for statement in uninstall_sql():
+        schema_editor.execute(statement)
+
+
+def rebuild(using=None):
+    # Re-reads every row of the patients table into the search tables
+    using = using or connection
+    with using.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+
+
+def _tokens(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def prefix_query(text):
+    # Every word must appear as a word prefix: "jo sm" -> "jo"* "sm"*
+    return " ".join(f'"{token}"*' for token in _tokens(text))
+
+
+def fuzzy_query(text):
+    # Every word must appear inside a column: "mith" -> "mith". The trigram
+    # tokenizer can't match fewer than 3 characters, so shorter words rule
+    # the infix match out rather than being dropped from it.
+    tokens = _tokens(text)
+    if any(len(token) < 3 for token in tokens):
+        return ""
+    return " ".join(f'"{token}"' for token in tokens)
+
+
+def max_typos(token):
+    """How many edits a search word may be away from the word it matches."""
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) < 7 else 2
+
+
+def edit_distance(a, b):
+    """Optimal string alignment distance: insertions, deletions, substitutions and adjacent swaps."""
+    if a is None or b is None:
+        return None
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[len(b)]
+
+
+def register_functions(connection):
+    # Called for every new connection, see api/signals.py
+    if not search_supported(connection):
+        return
+    connection.connection.create_function(EDIT_DISTANCE_FUNCTION, 2, edit_distance, deterministic=True)
+
+
+def _typo_group(token):
+    # SQL for one word of a typo query: ("jonh"* OR "john" OR ...), the
+    # alternatives read from the vocabulary when the query runs
+    typos = max_typos(token)
+    if not typos:
+        return "%s", [f'("{token}"*)']
+    corrections = (
+        "(SELECT group_concat('\"' || term || '\"', ' OR ') FROM ("
+        f"SELECT term FROM {VOCABULARY_TABLE}"
+        " WHERE term >= %s AND term < %s AND length(term) BETWEEN %s AND %s"
+        f" AND {EDIT_DISTANCE_FUNCTION}(term, %s) <= %s"
+        f" ORDER BY {EDIT_DISTANCE_FUNCTION}(term, %s), doc DESC LIMIT {MAX_CORRECTIONS}))"
+    )
+    params = [
+        f'("{token}"*', token[0], chr(ord(token[0]) + 1), len(token) - typos, len(token) + typos,
+        token, typos, token,
+    ]
+    return f"%s || COALESCE(' OR ' || {corrections}, '') || ')'", params
+
+
+def typo_query_sql(text):
+    """SQL computing the typo MATCH query for `text`, with its params; None if no word allows typos."""
+    tokens = _tokens(text)
+    if not any(max_typos(token) for token in tokens):
+        return None
+    groups = [_typo_group(token) for token in tokens]
+    return " || ' AND ' || ".join(sql for sql, _ in groups), [param for _, params in groups for param in params]
+
+
+def search_patients(queryset, text):
+    """Filter a Patient queryset by `text`, annotated with `search_rank` (lower is better)."""
+    unranked = Value(0.0, output_field=FloatField())
+
+    if not _tokens(text):
+        return queryset.none().annotate(search_rank=unranked)
+
+    if not search_supported():
+        condition = Q()
+        for column in SEARCH_COLUMNS:
+            condition |= Q(**{f"{column}__icontains": text})
+        return queryset.filter(condition).annotate(search_rank=unranked)
+
+    matches = [("SELECT rowid FROM patients_search WHERE patients_search MATCH %s", [prefix_query(text)])]
+    ranks = [(
+        "(SELECT rank FROM patients_search WHERE patients_search MATCH %s AND rowid = patients.id)",
+        [prefix_query(text)],
+    )]
+
+    fuzzy = fuzzy_query(text)
+    if fuzzy:
+        matches.append(("SELECT rowid FROM patients_search_trigram WHERE patients_search_trigram MATCH %s", [fuzzy]))
+        ranks.append((
+            f"(SELECT {FUZZY_RANK_OFFSET} + rank FROM patients_search_trigram"
+            " WHERE patients_search_trigram MATCH %s AND rowid = patients.id)",
+            [fuzzy],
+        ))
+
+    typo = typo_query_sql(text)
+    if typo is not None:
+        typo_sql, typo_params = typo
+        matches.append((f"SELECT rowid FROM patients_search WHERE patients_search MATCH ({typo_sql})", typo_params))
+        ranks.append((
+            f"(SELECT {TYPO_RANK_OFFSET} + rank FROM patients_search"
+            f" WHERE patients_search MATCH ({typo_sql}) AND rowid = patients.id)",
+            typo_params,
+        ))
+
+    match_sql = " UNION ".join(sql for sql, _ in matches)
+    # The hidden FTS5 "rank" column is the row's bm25 score
+    rank_sql = "COALESCE(" + ", ".join(sql for sql, _ in ranks) + ")" if len(ranks) > 1 else ranks[0][0]
+
+    return (
+        queryset
+        .filter(id__in=RawSQL(match_sql, [param for _, params in matches for param in params]))
+        .annotate(search_rank=RawSQL(
+            rank_sql, [param for _, params in ranks for param in params], output_field=FloatField()
+        ))
+    )
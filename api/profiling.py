@@ -0,0 +1,196 @@
+"""
+On-demand request profiling.
+
+ProfilingMiddleware runs a request under cProfile when
+
+- an admin asks for it, with an `X-Profile` header or a `profile` query
+  parameter on a request carrying their bearer token, or
+- the request is picked by PROFILING_SAMPLE_RATE (0.0 to 1.0, any user)
+
+and stores the stats in PROFILING_DIR: a pstats file (`<name>.prof`, open it
+with pstats, snakeviz or `python -m pstats`) and a JSON sidecar describing
+the request. Only the newest PROFILING_MAX_FILES profiles are kept. Profiled
+responses carry an X-Profile-Id header; admins list and download profiles
+at /api/management/profiles/.
+
+Requests that aren't profiled pay a header lookup and, when sampling is on,
+one random() call. One request is profiled at a time per process; others
+that ask meanwhile run unprofiled. cProfile only sees the thread it runs
+on: under ASGI that is the event loop, so async views are profiled along
+with whatever else the loop runs, and the ORM's worker thread is not.
+"""
+import cProfile
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .auth import abearer_principal, bearer_principal
+
+
+HEADER = "X-Profile"
+QUERY_FLAG = "profile"
+NAME_PATTERN = re.compile(r"^\d{8}T\d{12}-[0-9a-f]{8}$")
+
+# cProfile can't run two profilers at once on Python 3.12+
+_profiling = threading.Lock()
+
+
+def profiling_enabled():
+    return getattr(settings, "PROFILING_ENABLED", False)
+
+
+def profile_dir():
+    return Path(getattr(settings, "PROFILING_DIR", Path(settings.BASE_DIR) / "profiles"))
+
+
+def max_profiles():
+    return getattr(settings, "PROFILING_MAX_FILES", 50)
+
+
+def sample_rate():
+    return getattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+
+
+def requested(request):
+    return HEADER in request.headers or QUERY_FLAG in request.GET
+
+
+def _is_admin(principal):
+    return principal is not None and principal.role == "admin"
+
+
+def save(profiler, request, status, duration, trigger):
+    """Write one profile and its sidecar, then drop the oldest beyond the limit."""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    name = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+
+    # Written under temporary names so listings never see half a profile
+    stats = directory / f"{name}.prof"
+    profiler.dump_stats(f"{stats}.tmp")
+    os.replace(f"{stats}.tmp", stats)
+    meta = {
+        "name": name,
+        "created_at": now.isoformat(),
+        "method": request.method,
+        "path": request.path,
+        "query": request.META.get("QUERY_STRING", ""),
+        "status": status,
+        "duration_ms": round(duration * 1000, 2),
+        "trigger": trigger,
+    }
+    sidecar = directory / f"{name}.json"
+    sidecar.with_suffix(".json.tmp").write_text(json.dumps(meta))
+    os.replace(sidecar.with_suffix(".json.tmp"), sidecar)
+
+    prune(directory)
+    return name
+
+
+def prune(directory):
+    # Names sort by creation time
+    names = sorted(path.stem for path in directory.glob("*.json"))
+    for name in names[: max(len(names) - max_profiles(), 0)]:
+        for suffix in (".json", ".prof"):
+            (directory / f"{name}{suffix}").unlink(missing_ok=True)
+
+
+def stored_profiles():
+    """Sidecars of the stored profiles, newest first."""
+    directory = profile_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for sidecar in sorted(directory.glob("*.json"), reverse=True):
+        try:
+            meta = json.loads(sidecar.read_text())
+            meta["size"] = (directory / f"{sidecar.stem}.prof").stat().st_size
+        except (OSError, ValueError):
+            # Pruned by another process meanwhile
+            continue
+        profiles.append(meta)
+    return profiles
+
+
+def profile_path(name):
+    """Path of a stored profile's stats file, or None for unknown names."""
+    if not NAME_PATTERN.match(name):
+        return None
+    path = profile_dir() / f"{name}.prof"
+    return path if path.is_file() else None
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not profiling_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        rate = sample_rate()
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        trigger = None
+        if requested(request) and _is_admin(bearer_principal(request)):
+            trigger = "requested"
+        elif self.sampled():
+            trigger = "sampled"
+        if trigger is None or not _profiling.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - started
+        finally:
+            _profiling.release()
+        response.headers["X-Profile-Id"] = save(profiler, request, response.status_code, duration, trigger)
+        return response
+
+    async def __acall__(self, request):
+        trigger = None
+        if requested(request) and _is_admin(await abearer_principal(request)):
+            trigger = "requested"
+        elif self.sampled():
+            trigger = "sampled"
+        if trigger is None or not _profiling.acquire(blocking=False):
+            return await self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - started
+        finally:
+            _profiling.release()
+        response.headers["X-Profile-Id"] = save(profiler, request, response.status_code, duration, trigger)
+        return response
@@ -0,0 +1,110 @@
+"""
+Fast JSON renderer for the NinjaAPI.
+
+ninja's default JSONRenderer runs every datetime and Decimal through
+NinjaJSONEncoder.default(), a chain of isinstance checks. FastJSONRenderer
+formats them exactly the same way (datetimes to the millisecond with "Z" for
+UTC, Decimals as strings) with one dict lookup per value, on one of two
+backends picked by settings.API_JSON_BACKEND:
+
+- "stdlib" (the default): byte-for-byte identical to the default renderer.
+- "orjson", or "auto" when orjson is installed: values are identical to the
+  default renderer's, but orjson always writes compact separators and raw
+  UTF-8, so the bytes differ in whitespace and non-ASCII escaping. Opt in
+  only where clients don't depend on the exact bytes.
+
+`manage.py benchmark_renderer` compares them on representative payloads.
+"""
+import datetime
+import decimal
+import json
+import uuid
+
+from django.conf import settings
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+JSON_BACKENDS = ("auto", "orjson", "stdlib")
+
+
+def _datetime(value):
+    # Same format as DjangoJSONEncoder
+    text = value.isoformat()
+    if value.microsecond:
+        text = text[:23] + text[26:]
+    if text.endswith("+00:00"):
+        text = text[:-6] + "Z"
+    return text
+
+
+def _time(value):
+    if value.utcoffset() is not None:
+        raise ValueError("JSON can't represent timezone-aware times.")
+    text = value.isoformat()
+    return text[:12] if value.microsecond else text
+
+
+# Exact-type fast path; subclasses and other types go through NinjaJSONEncoder
+_FORMATTERS = {
+    datetime.datetime: _datetime,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: _time,
+    decimal.Decimal: str,
+    uuid.UUID: str,
+}
+
+_fallback = NinjaJSONEncoder()
+
+
+def encode_default(value):
+    formatter = _FORMATTERS.get(type(value))
+    if formatter is not None:
+        return formatter(value)
+    return _fallback.default(value)
+
+
+_stdlib_encoder = json.JSONEncoder(default=encode_default)
+
+
+def stdlib_dumps(data):
+    return _stdlib_encoder.encode(data)
+
+
+def orjson_dumps(data):
+    # Dates and times are passed through to encode_default for the Django format
+    return orjson.dumps(
+        data,
+        default=encode_default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+    )
+
+
+def json_backend(name=None):
+    name = name or getattr(settings, "API_JSON_BACKEND", "stdlib")
+    if name not in JSON_BACKENDS:
+        raise ValueError(f"API_JSON_BACKEND must be one of: {', '.join(JSON_BACKENDS)}")
+    if name == "auto":
+        return "orjson" if orjson is not None else "stdlib"
+    if name == "orjson" and orjson is None:
+        raise ValueError("API_JSON_BACKEND is 'orjson' but orjson is not installed.")
+    return name
+
+
+DUMPS = {"orjson": orjson_dumps, "stdlib": stdlib_dumps}
+
+
+class FastJSONRenderer(BaseRenderer):
+    media_type = "application/json"
+
+    def __init__(self, backend=None):
+        self.backend = json_backend(backend)
+        self.dumps = DUMPS[self.backend]
+
+    def render(self, request, data, *, response_status):
+        return self.dumps(data)
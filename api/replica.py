@@ -0,0 +1,172 @@
+"""
+Read replica routing.
+
+With a `replica` database configured (CLINICFLOW_REPLICA_DB, see
+clinicflow/settings.py), ReplicaRouter sends the reads of operations marked
+@replica_reads, the large lists, billing reports and exports, to it. All
+other reads and every write stay on `default`:
+
+    @appointment_router.get("/", response=...)
+    @replica_reads
+    @query_budget(6)
+    @paginate(CursorPagination, ...)
+    def list_appointments(request, ...):
+
+@replica_reads wraps the whole operation through ninja's decorate_view, so it
+covers serialization too, and the body of streaming exports.
+
+Read-after-write: ReplicaPinMiddleware pins the user of a successful POST,
+PUT, PATCH or DELETE to the primary for REPLICA_PIN_SECONDS, so a list fetched right
+after a booking shows it even while the replica lags. Pins live in the
+cache; with the default per-process cache a write pins the user only on
+the worker process that served it, so configure a shared cache backend in
+CACHES when running several. Reads inside an atomic() block always go to
+the primary.
+
+To try it locally, point CLINICFLOW_REPLICA_DB at either
+`file:db.sqlite3?mode=ro` (the primary's file, read-only, on a connection of
+its own) or a second SQLite file refreshed with `manage.py sync_replica`,
+which lags the primary like a real replica does.
+"""
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from ninja.decorators import decorate_view
+
+
+DECISION_ATTR = "_reads_from_replica"
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# The request of the replica-routed operation being run, if any
+_replica_request = ContextVar("replica_request", default=None)
+
+
+def replica_alias():
+    """The replica's database alias, or None when no replica is configured."""
+    alias = getattr(settings, "REPLICA_DATABASE_ALIAS", "replica")
+    return alias if alias in settings.DATABASES else None
+
+
+def pin_seconds():
+    return getattr(settings, "REPLICA_PIN_SECONDS", 5)
+
+
+def pin_cache_key(user_id):
+    return f"clinicflow:replica-pin:{user_id}"
+
+
+def _user_id(request):
+    return getattr(getattr(request, "auth", None), "pk", None)
+
+
+def pin_to_primary(request):
+    user_id = _user_id(request)
+    if user_id is not None and pin_seconds() > 0:
+        cache.set(pin_cache_key(user_id), True, pin_seconds())
+
+
+def _reads_from_replica(request):
+    # Decided once per request, after authentication has set request.auth;
+    # authentication's own queries run on the primary
+    decision = getattr(request, DECISION_ATTR, None)
+    if decision is None:
+        user_id = _user_id(request)
+        if user_id is None:
+            return False
+        decision = not cache.get(pin_cache_key(user_id), False)
+        setattr(request, DECISION_ATTR, decision)
+    return decision
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        request = _replica_request.get()
+        if request is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        alias = replica_alias()
+        if alias is None or not _reads_from_replica(request):
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary
+        return db != replica_alias()
+
+
+def _on_replica(request, chunks):
+    # Streaming bodies are read after the operation returns
+    chunks = iter(chunks)
+    while True:
+        token = _replica_request.set(request)
+        try:
+            chunk = next(chunks, None)
+        finally:
+            _replica_request.reset(token)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _replica_run(run):
+    if iscoroutinefunction(run):
+        @wraps(run)
+        async def arun(request, *args, **kwargs):
+            token = _replica_request.set(request)
+            try:
+                return await run(request, *args, **kwargs)
+            finally:
+                _replica_request.reset(token)
+        return arun
+
+    @wraps(run)
+    def replica_run(request, *args, **kwargs):
+        token = _replica_request.set(request)
+        try:
+            response = run(request, *args, **kwargs)
+        finally:
+            _replica_request.reset(token)
+        if getattr(response, "streaming", False):
+            response.streaming_content = _on_replica(request, response.streaming_content)
+        return response
+    return replica_run
+
+
+def replica_reads(view):
+    """Let the replica serve the reads of this operation."""
+    return decorate_view(_replica_run)(view)
+
+
+class ReplicaPinMiddleware:
+    """Pins the user of a successful write to the primary; see pin_to_primary()."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        # request.auth is set by the API's authentication
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            pin_to_primary(request)
+        return response
@@ -0,0 +1,146 @@
+"""
+Appointment scheduling helpers.
+
+Recurring series are expanded in the clinic's local time, so a weekly 9:00
+appointment stays at 9:00 across daylight saving changes.
+
+Availability is computed as a sweep over sorted intervals: each doctor's
+working windows for the requested days, minus their merged busy intervals,
+cut into fixed-length slots on a grid anchored at each window's start.
+"""
+import calendar
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+SERIES_FREQUENCIES = ("daily", "weekly", "monthly")
+
+# Upper bound on the occurrences a single series may expand to
+SERIES_MAX_OCCURRENCES = 366
+
+
+def _add_months(value, months):
+    # Clamps to the last day of shorter months: Jan 31 + 1 month -> Feb 28/29
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def expand_series(start, frequency, interval=1, count=None, until=None):
+    """Return the occurrences of a series starting at `start`, oldest first.
+
+    The series stops after `count` occurrences or on the `until` date
+    (inclusive), whichever comes first. Raises ValueError for invalid rules.
+    """
+    if frequency not in SERIES_FREQUENCIES:
+        raise ValueError(f"Invalid frequency. Valid options are: {', '.join(SERIES_FREQUENCIES)}")
+    if interval < 1:
+        raise ValueError("Interval must be at least 1.")
+    if count is None and until is None:
+        raise ValueError("Either count or until is required.")
+    if count is not None and not 1 <= count <= SERIES_MAX_OCCURRENCES:
+        raise ValueError(f"Count must be between 1 and {SERIES_MAX_OCCURRENCES}.")
+
+    tz = timezone.get_current_timezone()
+    local_start = timezone.localtime(start, tz).replace(tzinfo=None)
+    if until is not None and until < local_start.date():
+        raise ValueError("Until date must not be before the first occurrence.")
+
+    occurrences = []
+    index = 0
+    while count is None or index < count:
+        if frequency == "monthly":
+            local = _add_months(local_start, index * interval)
+        else:
+            days = 7 if frequency == "weekly" else 1
+            local = local_start + timedelta(days=index * interval * days)
+
+        if until is not None and local.date() > until:
+            break
+        if len(occurrences) == SERIES_MAX_OCCURRENCES:
+            raise ValueError(f"A series can have at most {SERIES_MAX_OCCURRENCES} occurrences.")
+
+        occurrences.append(timezone.make_aware(local, tz))
+        index += 1
+
+    return occurrences
+
+
+def appointment_duration():
+    return timedelta(minutes=getattr(settings, "APPOINTMENT_DURATION_MINUTES", 30))
+
+
+def default_working_hours():
+    # {weekday: [(start_time, end_time), ...]} from settings.DEFAULT_WORKING_HOURS
+    hours = {}
+    for weekday, start, end in getattr(settings, "DEFAULT_WORKING_HOURS", []):
+        hours.setdefault(weekday, []).append((time.fromisoformat(start), time.fromisoformat(end)))
+    return hours
+
+
+def working_windows(hours, start_date, end_date):
+    """Aware (start, end) working windows from `start_date` to `end_date` inclusive, in order."""
+    tz = timezone.get_current_timezone()
+    windows = []
+    day = start_date
+    while day <= end_date:
+        for start, end in sorted(hours.get(day.weekday(), [])):
+            windows.append((
+                timezone.make_aware(datetime.combine(day, start), tz),
+                timezone.make_aware(datetime.combine(day, end), tz),
+            ))
+        day += timedelta(days=1)
+    return windows
+
+
+def merge_intervals(intervals):
+    # Sorted, non-overlapping union of (start, end) intervals
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_slots(windows, busy, slot_length, not_before=None):
+    """Slots of `slot_length` inside `windows` that overlap no `busy` interval.
+
+    Both inputs must be sorted and non-overlapping (see merge_intervals), so a
+    single pass over each list suffices. Slots starting before `not_before`
+    are skipped.
+    """
+    slots = []
+    index = 0
+    for window_start, window_end in windows:
+        # Busy intervals ending before this window can't affect it or any later one
+        while index < len(busy) and busy[index][1] <= window_start:
+            index += 1
+
+        position = index
+        slot_start = window_start
+        if not_before is not None and slot_start < not_before:
+            slot_start = window_start + _steps(not_before - window_start, slot_length) * slot_length
+
+        while slot_start + slot_length <= window_end:
+            slot_end = slot_start + slot_length
+            while position < len(busy) and busy[position][1] <= slot_start:
+                position += 1
+            if position < len(busy) and busy[position][0] < slot_end:
+                # Jump to the first grid point at or after the busy interval's end
+                slot_start = window_start + _steps(busy[position][1] - window_start, slot_length) * slot_length
+                continue
+            slots.append((slot_start, slot_end))
+            slot_start = slot_end
+
+    return slots
+
+
+def _steps(offset, slot_length):
+    # Whole slots needed to cover `offset`, rounding up
+    return -(-offset // slot_length)
@@ -1,9 +1,31 @@
 from ninja import Schema
-from datetime import datetime, date
+from datetime import datetime, date, time
+from functools import lru_cache
 from typing import Optional, List, Annotated
 from pydantic import EmailStr
 from decimal import Decimal
-from pydantic import constr
+from pydantic import constr, create_model, model_validator
+
+
+@lru_cache(maxsize=None)
+def row_model(schema):
+    """A plain pydantic model with `schema`'s fields, validating dicts without ninja's DjangoGetter."""
+    fields = {name: (info.annotation, info) for name, info in schema.model_fields.items()}
+    return create_model(f"{schema.__name__}Row", **fields)
+
+
+class RowSchema(Schema):
+    # Output schema whose dict input (rows from .values(), see CursorPagination)
+    # is validated by pydantic directly instead of through ninja's DjangoGetter.
+    # Model instances still go through ninja.
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def validate_row_dict(cls, values, handler, info):
+        if not isinstance(values, dict):
+            return handler(values)
+        row = row_model(cls).model_validate(values, context=info.context)
+        return cls.model_construct(row.model_fields_set, **row.__dict__)
 
 
 # Admin Schema
@@ -29,7 +51,7 @@ class DoctorCreateResponseSchema(Schema):
     password: str
     
 
-class DoctorOutSchema(Schema):
+class DoctorOutSchema(RowSchema):
     id: int
     user_id: int  
     first_name: str
@@ -39,6 +61,46 @@ class DoctorOutSchema(Schema):
     phone: str
     created_at: datetime
 
+class WorkingHoursSchema(Schema):
+    weekday: int # 0 is Monday
+    start_time: time
+    end_time: time
+
+class DoctorAvailabilitySchema(Schema):
+    doctor_id: int
+    first_name: str
+    last_name: str
+    specialty: str
+    slot_minutes: int
+    slots: List[datetime] # free slot start times
+
+class OutboxSenderSchema(Schema):
+    batches: int
+    sent: int
+    retried: int
+    failed: int
+    connection_errors: int
+    send_seconds: float
+    last_delivery_delay: float | None
+
+class OutboxStatsSchema(Schema):
+    pending: int
+    sent: int
+    failed: int
+    oldest_pending_seconds: float | None
+    sender: OutboxSenderSchema # this process's sender only
+
+class ProfileSchema(Schema):
+    name: str
+    created_at: datetime
+    method: str
+    path: str
+    query: str
+    status: int
+    duration_ms: float
+    trigger: str # "requested" or "sampled"
+    size: int # bytes of the .prof file
+
 class MessageSchema(Schema):
     message: str
 
@@ -55,7 +117,7 @@ class PatientCreateSchema(Schema):
     address: str
     insurance_id: str | None = None
 
-class PatientOutSchema(Schema):
+class PatientOutSchema(RowSchema):
     id: int
     first_name: str
     last_name: str
@@ -67,6 +129,17 @@ class PatientOutSchema(Schema):
     insurance_id: str | None
     created_at: datetime
 
+class PatientBulkRowSchema(Schema):
+    index: int
+    id: int | None = None
+    errors: List[str] = []
+
+class PatientBulkResultSchema(Schema):
+    mode: str
+    created: int
+    failed: int
+    results: List[PatientBulkRowSchema]
+
 class PatientUpdateSchema(Schema):
     first_name: str | None = None
     last_name: str | None = None
@@ -85,6 +158,7 @@ class AppointmentCreateSchema(Schema):
     patient_id: int
     doctor_id: int
     date_time: datetime # will validate in endpoint
+    duration_minutes: int | None = None # defaults to settings.APPOINTMENT_DURATION_MINUTES
     reason: str | None = None
     appointment_cost: Decimal # will validate in endpoint
 
@@ -92,20 +166,38 @@ class AppointmentUpdateSchema(Schema):
     patient_id: int | None = None
     doctor_id: int | None = None
     date_time: datetime | None = None
+    duration_minutes: int | None = None # keeps the current duration if not given
     reason: str | None = None
     status: str | None = None  # will validate in endpoint
     appointment_cost: Decimal | None = None  # validate in endpoint
 
-class AppointmentOutSchema(Schema):
+class AppointmentOutSchema(RowSchema):
     id: int
     patient_id: int
     doctor_id: int
     date_time: datetime
+    end_time: datetime
     reason: str | None
     status: str
     appointment_cost: Decimal
     created_at: datetime
 
+class AppointmentSeriesCreateSchema(Schema):
+    patient_id: int
+    doctor_id: int
+    date_time: datetime # first occurrence
+    duration_minutes: int | None = None
+    reason: str | None = None
+    appointment_cost: Decimal # will validate in endpoint
+    frequency: str = "weekly" # daily, weekly or monthly
+    interval: int = 1
+    count: int | None = None
+    until: date | None = None # inclusive
+
+class AppointmentSeriesOutSchema(Schema):
+    created: List[AppointmentOutSchema]
+    conflicts: List[datetime]
+
 
 # Prescription Related Schemas
 
@@ -117,7 +209,7 @@ class PrescriptionCreateSchema(Schema):
     date_issued: date
     prescription_cost: Decimal | None = None
 
-class PrescriptionOutSchema(Schema):
+class PrescriptionOutSchema(RowSchema):
     id: int
     appointment_id: int
     medication: str
@@ -128,6 +220,31 @@ class PrescriptionOutSchema(Schema):
     created_at: datetime
 
 
+# Read Schemas (?fields= and ?include=, see api/embeds.py)
+
+def read_schema(name, schema, **embeds):
+    # Every column and embed optional, so a trimmed row validates; operations
+    # using these render with exclude_unset=True to leave out what wasn't asked for
+    fields = {field: (Optional[info.annotation], None) for field, info in schema.model_fields.items()}
+    fields.update({field: (Optional[annotation], None) for field, annotation in embeds.items()})
+    return create_model(name, __base__=RowSchema, **fields)
+
+AppointmentReadSchema = read_schema(
+    "AppointmentReadSchema", AppointmentOutSchema,
+    patient=PatientOutSchema, doctor=DoctorOutSchema, prescriptions=List[PrescriptionOutSchema],
+)
+
+PrescriptionReadSchema = read_schema(
+    "PrescriptionReadSchema", PrescriptionOutSchema,
+    appointment=AppointmentOutSchema, patient=PatientOutSchema, doctor=DoctorOutSchema,
+)
+
+PatientReadSchema = read_schema(
+    "PatientReadSchema", PatientOutSchema,
+    appointments=List[AppointmentOutSchema], prescriptions=List[PrescriptionOutSchema],
+)
+
+
 # Billing_Report Related Schemas
 
 class PatientBreakdownSchema(Schema):
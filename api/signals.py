@@ -0,0 +1,141 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import billing_rollup, patient_search, sqlite
+from .auth import invalidate_principal
+from .models import User, Doctor, Appointment, Prescription
+
+
+# Billing rollup maintenance
+#
+# pre_save records which rollup buckets a row belonged to before the change,
+# post_save/post_delete refresh those buckets plus the ones it belongs to now.
+
+def _appointment_keys(patient_id, date_time, status):
+    if status != Appointment.STATUS_COMPLETED:
+        return set()
+    return {(*billing_rollup.month_of(date_time), patient_id)}
+
+
+def _prescription_keys(patient_id, date_issued):
+    return {(*billing_rollup.month_of(date_issued), patient_id)}
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_buckets(sender, instance, raw=False, **kwargs):
+    instance._rollup_keys = set()
+    instance._rollup_old_patient_id = None
+    if raw or not billing_rollup.rollup_enabled() or instance.pk is None:
+        return
+
+    old = Appointment.objects.filter(pk=instance.pk).values("patient_id", "date_time", "status").first()
+    if old:
+        instance._rollup_keys = _appointment_keys(old["patient_id"], old["date_time"], old["status"])
+        instance._rollup_old_patient_id = old["patient_id"]
+
+
+@receiver(post_save, sender=Appointment)
+def refresh_appointment_buckets(sender, instance, raw=False, **kwargs):
+    if raw or not billing_rollup.rollup_enabled():
+        return
+
+    keys = getattr(instance, "_rollup_keys", set())
+    keys |= _appointment_keys(instance.patient_id, instance.date_time, instance.status)
+
+    # Reassigning the patient moves the appointment's prescriptions with it
+    old_patient_id = getattr(instance, "_rollup_old_patient_id", None)
+    if old_patient_id is not None and old_patient_id != instance.patient_id:
+        for issued in Prescription.objects.filter(appointment_id=instance.pk).dates("date_issued", "month"):
+            keys |= _prescription_keys(old_patient_id, issued)
+            keys |= _prescription_keys(instance.patient_id, issued)
+
+    if keys:
+        billing_rollup.refresh(keys)
+
+
+@receiver(post_delete, sender=Appointment)
+def refresh_deleted_appointment_buckets(sender, instance, **kwargs):
+    if not billing_rollup.rollup_enabled():
+        return
+    keys = _appointment_keys(instance.patient_id, instance.date_time, instance.status)
+    if keys:
+        billing_rollup.refresh(keys)
+
+
+@receiver(pre_save, sender=Prescription)
+def remember_prescription_buckets(sender, instance, raw=False, **kwargs):
+    instance._rollup_keys = set()
+    if raw or not billing_rollup.rollup_enabled() or instance.pk is None:
+        return
+
+    old = (
+        Prescription.objects
+        .filter(pk=instance.pk)
+        .values("date_issued", "appointment__patient_id")
+        .first()
+    )
+    if old:
+        instance._rollup_keys = _prescription_keys(old["appointment__patient_id"], old["date_issued"])
+
+
+@receiver(post_save, sender=Prescription)
+def refresh_prescription_buckets(sender, instance, raw=False, **kwargs):
+    if raw or not billing_rollup.rollup_enabled():
+        return
+
+    keys = getattr(instance, "_rollup_keys", set())
+    keys |= _prescription_keys(instance.appointment.patient_id, instance.date_issued)
+    billing_rollup.refresh(keys)
+
+
+@receiver(post_delete, sender=Prescription)
+def refresh_deleted_prescription_buckets(sender, instance, **kwargs):
+    if not billing_rollup.rollup_enabled():
+        return
+    patient_id = (
+        Appointment.objects.filter(pk=instance.appointment_id).values_list("patient_id", flat=True).first()
+    )
+    if patient_id is not None:
+        billing_rollup.refresh(_prescription_keys(patient_id, instance.date_issued))
+
+
+# Cached auth principal invalidation
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_principal(sender, instance, **kwargs):
+    invalidate_principal(instance.pk)
+
+
+# Doctor rows render their user's email, so a user change is a doctor change
+# for ETags (see api/conditional.py)
+
+@receiver(post_save, sender=User)
+def touch_user_doctor(sender, instance, raw=False, created=False, update_fields=None, **kwargs):
+    if raw or created or instance.role != "doctor":
+        return
+    if update_fields is not None and "email" not in update_fields:
+        return
+    Doctor.objects.filter(user_id=instance.pk).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def invalidate_doctor_principal(sender, instance, **kwargs):
+    invalidate_principal(instance.user_id)
+
+
+# SQLite pragmas on every new connection (see api/sqlite.py)
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    sqlite.apply_pragmas(connection)
+
+
+# SQL functions of the patient search (see api/patient_search.py)
+
+@receiver(connection_created)
+def register_search_functions(sender, connection, **kwargs):
+    patient_search.register_functions(connection)
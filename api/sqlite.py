@@ -0,0 +1,51 @@
+"""
+Production SQLite tuning.
+
+Every new SQLite connection runs the pragmas in settings.SQLITE_PRAGMAS
+(see the connection_created receiver in api/signals.py). The production
+database profile in clinicflow/settings.py sets:
+
+- journal_mode=WAL: readers no longer block the writer, nor it them
+- synchronous=NORMAL: safe with WAL, fsyncs at checkpoints instead of
+  every commit
+- mmap_size / cache_size: reads served from memory-mapped pages and a
+  larger page cache
+- busy_timeout: a connection waits for a lock instead of failing at once
+
+and reuses connections across requests (CONN_MAX_AGE), so pragmas and page
+caches survive between requests. Its transaction_mode=IMMEDIATE makes every
+atomic() block, all of which are writes here (bookings, prescriptions,
+accounts), take the write lock when it begins. A transaction that reads
+first and writes later would otherwise hold a read lock that SQLite can't
+upgrade while another writer waits, and fail with "database is locked"
+without honouring busy_timeout.
+
+journal_mode belongs to the database file rather than the connection, so
+only the primary (`default`) sets it; replicas (see api/replica.py) may be
+read-only and inherit it from the primary's file.
+
+`manage.py benchmark_sqlite` compares the default and production profiles.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+# Persistent in the database file, set by the primary only
+PRIMARY_ONLY_PRAGMAS = {"journal_mode"}
+
+
+def pragmas():
+    return getattr(settings, "SQLITE_PRAGMAS", {})
+
+
+def apply_pragmas(connection, values=None):
+    if connection.vendor != "sqlite":
+        return
+    values = pragmas() if values is None else values
+    if not values:
+        return
+    with connection.cursor() as cursor:
+        for name, value in values.items():
+            if name in PRIMARY_ONLY_PRAGMAS and connection.alias != DEFAULT_DB_ALIAS:
+                continue
+            cursor.execute(f"PRAGMA {name} = {value}")
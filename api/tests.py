@@ -1,3 +1,1651 @@
-from django.test import TestCase
+import base64
+import csv
+import json
+import os
+import smtplib
+import tempfile
+from unittest import mock, skipUnless
+from importlib import import_module
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections
+from django.db.models import Max, QuerySet
+from django.db.models.signals import post_delete
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from ninja.renderers import JSONRenderer
+from ninja_jwt.tokens import AccessToken
+from pydantic import ValidationError
+
+from . import billing_rollup, outbox
+from .auth import load_principal, principal_cache_key
+from .instrumentation import QueryBudgetExceeded, SQLInstrumentationMiddleware, query_budget
+from .management.commands.benchmark_api import SCENARIOS
+from .models import (
+    User, Doctor, Patient, Appointment, Prescription, ArchivedAppointment, ArchivedPrescription, BillingRollup,
+    DoctorWorkingHours, OutboxEmail,
+)
+from .patient_search import edit_distance, search_patients
+from .renderers import FastJSONRenderer, orjson
+from .replica import pin_cache_key
+from .scheduling import free_slots, merge_intervals
+from .schema import (
+    AppointmentOutSchema, AppointmentReadSchema, DoctorOutSchema, PatientReadSchema, PrescriptionOutSchema, row_model,
+)
+from .sqlite import apply_pragmas
+from .views import api
+
+
+def make_doctor(username, **fields):
+    user = User.objects.create_user(username=username, password="secret", role="doctor")
+    return Doctor.objects.create(
+        user=user, first_name=fields.pop("first_name", "Gregory"), last_name=fields.pop("last_name", username),
+        specialty=fields.pop("specialty", "General"), phone="555-0100", **fields,
+    )
+
+
+def make_patient(first_name="John", last_name="Smith", **fields):
+    fields.setdefault("dob", date(1980, 1, 1))
+    fields.setdefault("gender", Patient.GENDER_MALE)
+    fields.setdefault("phone", "555-0199")
+    fields.setdefault("address", "1 Main Street")
+    return Patient.objects.create(first_name=first_name, last_name=last_name, **fields)
+
+
+def make_appointment(patient, doctor, date_time, minutes=30, **fields):
+    fields.setdefault("appointment_cost", Decimal("100.00"))
+    return Appointment.objects.create(
+        patient=patient, doctor=doctor, date_time=date_time, end_time=date_time + timedelta(minutes=minutes),
+        **fields,
+    )
+
+
+def at(day, hour, minute=0):
+    return datetime.combine(day, datetime.min.time(), tzinfo=timezone.get_current_timezone()).replace(
+        hour=hour, minute=minute
+    )
+
+
+# Endpoints over their @query_budget fail the test
+@override_settings(QUERY_BUDGET_RAISE=True)
+class APITestCase(TestCase):
+    """Authenticated requests against the API as an admin or a doctor."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username="admin", password="secret", role="admin")
+        cls.doctor = make_doctor("house")
+        cls.patient = make_patient()
+
+    def auth(self, user):
+        return {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user)}"}
+
+    def get(self, path, user=None, **params):
+        return self.client.get(path, params, **self.auth(user or self.admin))
+
+    def post(self, path, payload, user=None):
+        return self.client.post(path, payload, content_type="application/json", **self.auth(user or self.admin))
+
+    def put(self, path, payload, user=None):
+        return self.client.put(path, payload, content_type="application/json", **self.auth(user or self.admin))
+
+
+class CursorPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.doctors = [cls.doctor, make_doctor("wilson"), make_doctor("cuddy")]
+        day = timezone.localdate() + timedelta(days=7)
+        # Three appointments at every time, one per doctor
+        for hour in (9, 10, 11):
+            for doctor in cls.doctors:
+                make_appointment(cls.patient, doctor, at(day, hour))
+        cls.expected = list(Appointment.objects.order_by("date_time", "id").values_list("id", flat=True))
+
+    def page(self, cursor, limit=2):
+        response = self.get("/api/appointments/", cursor=cursor, limit=limit)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_pages_forward_and_back_across_equal_date_times(self):
+        pages, cursor = [], ""
+        while cursor is not None:
+            page = self.page(cursor)
+            pages.append(page)
+            cursor = page["next"]
+        self.assertEqual([item["id"] for page in pages for item in page["items"]], self.expected)
+        self.assertEqual([len(page["items"]) for page in pages], [2, 2, 2, 2, 1])
+
+        # And back again from the last page
+        backwards, cursor = [], pages[-1]["previous"]
+        while cursor is not None:
+            page = self.page(cursor)
+            backwards.append(page)
+            cursor = page["previous"]
+        self.assertEqual(
+            [[item["id"] for item in page["items"]] for page in backwards],
+            [[item["id"] for item in page["items"]] for page in pages[-2::-1]],
+        )
+
+    def test_count_is_null_in_keyset_mode(self):
+        first = self.page("")
+        self.assertIsNone(first["count"])
+        self.assertIsNone(self.page(first["next"])["count"])
+
+        response = self.get("/api/appointments/", limit=2)
+        self.assertEqual(response.json()["count"], len(self.expected))
+
+    def test_garbage_cursor_is_rejected(self):
+        for cursor in ("garbage", "!!!", base64.urlsafe_b64encode(b"[1, 2]").decode()):
+            with self.subTest(cursor=cursor):
+                response = self.get("/api/appointments/", cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+
+    def test_tampered_cursor_is_rejected(self):
+        cursor = self.page("")["next"]
+        payload = json.loads(base64.urlsafe_b64decode(cursor))
+        tampered = [
+            {**payload, "v": payload["v"][:1]},
+            {**payload, "v": ["not a date", payload["v"][1]]},
+            {"v": payload["v"]},
+        ]
+        for value in tampered:
+            with self.subTest(payload=value):
+                cursor = base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+                response = self.get("/api/appointments/", cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        day = timezone.localdate() + timedelta(days=7)
+        cls.appointments = [make_appointment(cls.patient, cls.doctor, at(day, hour)) for hour in (9, 10, 11, 12, 13)]
+        # Doctor details render the user's email
+        User.objects.filter(pk=cls.doctor.user_id).update(email="house@example.com")
+
+    def conditional_get(self, path, params=None, **headers):
+        return self.client.get(path, params or {}, **self.auth(self.admin), **headers)
+
+    def assertNotModified(self, path, params=None, **headers):
+        response = self.conditional_get(path, params, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        return response
+
+    def touch(self, appointment):
+        Appointment.objects.filter(pk=appointment.pk).update(updated_at=timezone.now() + timedelta(seconds=5))
+
+    def test_detail_answers_if_none_match_and_if_modified_since(self):
+        for path in (f"/api/patients/{self.patient.id}/", f"/api/doctors/{self.doctor.id}/"):
+            with self.subTest(path=path):
+                response = self.conditional_get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response["ETag"].startswith('W/"'))
+                self.assertNotModified(path, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertNotModified(path, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+                self.assertEqual(self.conditional_get(path, HTTP_IF_NONE_MATCH='W/"stale"').status_code, 200)
+
+    def test_changed_detail_gets_a_new_etag(self):
+        path = f"/api/appointments/{self.appointments[0].id}/"
+        etag = self.conditional_get(path)["ETag"]
+        self.touch(self.appointments[0])
+        response = self.conditional_get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_async_detail_answers_if_none_match(self):
+        path = f"/api/async/appointments/{self.appointments[0].id}/"
+        headers = {"Authorization": self.auth(self.admin)["HTTP_AUTHORIZATION"]}
+        response = async_to_sync(self.async_client.get)(path, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = async_to_sync(self.async_client.get)(path, headers={**headers, "If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_offset_list_etag_covers_every_filtered_row(self):
+        params = {"limit": 2}
+        response = self.conditional_get("/api/appointments/", params)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        last_modified = Appointment.objects.aggregate(Max("updated_at"))["updated_at__max"]
+        self.assertEqual(response["Last-Modified"], http_date(last_modified.timestamp()))
+        self.assertNotModified("/api/appointments/", params, HTTP_IF_NONE_MATCH=etag)
+        self.assertNotModified("/api/appointments/", params, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+
+        # max(updated_at) changes with a row off the page
+        self.touch(self.appointments[-1])
+        changed = self.conditional_get("/api/appointments/", params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+
+        # and the count with a row deleted off the page, even an older one
+        etag = changed["ETag"]
+        self.appointments[2].delete()
+        deleted = self.conditional_get("/api/appointments/", params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(deleted.status_code, 200)
+        self.assertEqual(deleted.json()["count"], 4)
+        self.assertNotEqual(deleted["ETag"], etag)
+
+    def test_keyset_list_etag_covers_the_fetched_rows(self):
+        params = {"cursor": "", "limit": 2}
+        response = self.conditional_get("/api/appointments/", params)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertNotModified("/api/appointments/", params, HTTP_IF_NONE_MATCH=etag)
+
+        self.touch(self.appointments[1])
+        changed = self.conditional_get("/api/appointments/", params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+
+        etag = changed["ETag"]
+        self.appointments[0].delete()
+        deleted = self.conditional_get("/api/appointments/", params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(deleted.status_code, 200)
+        self.assertEqual([item["id"] for item in deleted.json()["items"]], [a.id for a in self.appointments[1:3]])
+        self.assertNotEqual(deleted["ETag"], etag)
+
+    def test_etag_differs_per_query(self):
+        first = self.conditional_get("/api/appointments/", {"limit": 2})["ETag"]
+        self.assertNotEqual(self.conditional_get("/api/appointments/", {"limit": 3})["ETag"], first)
+
+
+class PatientSearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for first_name, last_name in [
+            ("Jane", "Smyth"), ("Mary", "Johnson"), ("Bob", "Wilson"), ("Ann", "Anderson"), ("Tom", "Jackson"),
+        ]:
+            make_patient(first_name, last_name)
+
+    def search(self, text):
+        return [
+            f"{patient.first_name} {patient.last_name}"
+            for patient in search_patients(Patient.objects.all(), text).order_by("search_rank", "id")
+        ]
+
+    def test_prefix(self):
+        self.assertEqual(self.search("jo sm"), ["John Smith"])
+
+    def test_infix(self):
+        self.assertEqual(self.search("mith"), ["John Smith"])
+
+    def test_typos(self):
+        self.assertEqual(self.search("Jonh"), ["John Smith"])
+        self.assertEqual(self.search("smth"), ["John Smith", "Jane Smyth"])
+        self.assertEqual(self.search("Jonh Smtih"), ["John Smith"])
+
+    def test_exact_matches_rank_before_typos(self):
+        self.assertEqual(self.search("smith"), ["John Smith", "Jane Smyth"])
+        self.assertEqual(self.search("smyth"), ["Jane Smyth", "John Smith"])
+
+    def test_shared_trigram_is_not_a_match(self):
+        self.assertEqual(self.search("jackson"), ["Tom Jackson"])
+        # Shares "son" and "ans" with Wilson, Johnson, Anderson and Jackson
+        self.assertEqual(self.search("hanson"), [])
+
+    def test_list_endpoint(self):
+        response = self.get("/api/patients/", search="Jonh")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([item["last_name"] for item in response.json()["items"]], ["Smith"])
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance("smth", "smith"), 1)
+        self.assertEqual(edit_distance("jonh", "john"), 1)
+        self.assertEqual(edit_distance("jackson", "johnson"), 3)
+
+
+class BulkPatientTests(APITestCase):
+    def row(self, **fields):
+        return {
+            "first_name": "Ann", "last_name": "Lee", "dob": "1990-04-01", "gender": Patient.GENDER_FEMALE,
+            "phone": "555-0101", "address": "2 High Street", **fields,
+        }
+
+    def mixed_batch(self):
+        return [
+            self.row(first_name="Valid"),
+            self.row(gender="X"),
+            {key: value for key, value in self.row().items() if key != "last_name"},
+            self.row(email="not-an-email"),
+            self.row(dob="1990-13-45"),
+            self.row(first_name="Also valid", email="ann@example.com"),
+        ]
+
+    def bulk(self, rows, mode):
+        return self.client.post(
+            f"/api/patients/bulk/?mode={mode}", rows, content_type="application/json", **self.auth(self.admin)
+        )
+
+    def assertRowErrors(self, results):
+        errors = {row["index"]: row["errors"] for row in results}
+        self.assertEqual(errors[0], [])
+        self.assertEqual(errors[1], ["Invalid gender choice"])
+        self.assertTrue(errors[2] and errors[2][0].startswith("last_name: "), errors[2])
+        self.assertTrue(errors[3] and errors[3][0].startswith("email: "), errors[3])
+        self.assertTrue(errors[4] and errors[4][0].startswith("dob: "), errors[4])
+        self.assertEqual(errors[5], [])
+
+    def test_all_or_nothing_reports_every_bad_row_and_creates_none(self):
+        before = Patient.objects.count()
+        response = self.bulk(self.mixed_batch(), "all_or_nothing")
+        self.assertEqual(response.status_code, 400, response.content)
+        body = response.json()
+        self.assertEqual((body["created"], body["failed"]), (0, 4))
+        self.assertRowErrors(body["results"])
+        self.assertEqual(Patient.objects.count(), before)
+
+    def test_all_or_nothing_creates_a_clean_batch(self):
+        rows = [self.row(first_name=f"Patient {n}") for n in range(3)]
+        response = self.bulk(rows, "all_or_nothing")
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()["results"]
+        names = Patient.objects.filter(id__in=[row["id"] for row in results]).values_list("first_name", flat=True)
+        self.assertEqual(sorted(names), ["Patient 0", "Patient 1", "Patient 2"])
+
+    def test_best_effort_creates_the_valid_rows_of_a_mixed_batch(self):
+        response = self.bulk(self.mixed_batch(), "best_effort")
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual((body["created"], body["failed"]), (2, 4))
+        self.assertRowErrors(body["results"])
+        ids = [row["id"] for row in body["results"]]
+        self.assertEqual(ids[1:5], [None] * 4)
+        self.assertEqual(Patient.objects.get(id=ids[0]).first_name, "Valid")
+        self.assertEqual(Patient.objects.get(id=ids[5]).email, "ann@example.com")
+
+    def test_unknown_mode_is_rejected(self):
+        self.assertEqual(self.bulk([self.row()], "sometimes").status_code, 400)
+
+
+class PrincipalCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def cached(self, user):
+        return cache.get(principal_cache_key(user.pk))
+
+    def test_cached_principal_is_reused(self):
+        with mock.patch("api.auth.load_principal", wraps=load_principal) as load:
+            for _ in range(3):
+                self.assertEqual(self.get("/api/patients/", user=self.doctor.user).status_code, 200)
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(self.cached(self.doctor.user).doctor_id, self.doctor.id)
+
+    def test_saving_a_user_or_doctor_drops_the_cached_principal(self):
+        for instance in (self.doctor.user, self.doctor):
+            with self.subTest(model=type(instance).__name__):
+                self.get("/api/patients/", user=self.doctor.user)
+                self.assertIsNotNone(self.cached(self.doctor.user))
+                instance.save()
+                self.assertIsNone(self.cached(self.doctor.user))
+
+    def test_deactivated_user_is_refused_on_the_next_request(self):
+        user = self.doctor.user
+        self.assertEqual(self.get("/api/patients/", user=user).status_code, 200)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.get("/api/patients/", user=user).status_code, 401)
+
+    def test_doctor_whose_role_changed_is_refused_on_the_next_request(self):
+        user = self.doctor.user
+        payload = {
+            "appointment_id": 0, "medication": "Ibuprofen", "dosage": "200mg", "instructions": "Twice daily",
+            "date_issued": "2030-01-01",
+        }
+        # Past the role check, no such appointment
+        self.assertEqual(self.post("/api/prescriptions/", payload, user=user).status_code, 404)
+        user.role = "admin"
+        user.save()
+        self.assertEqual(self.post("/api/prescriptions/", payload, user=user).status_code, 403)
+
+        user.role = ""
+        user.save()
+        self.assertEqual(self.get("/api/patients/", user=user).status_code, 403)
+
+
+class DoctorListTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        User.objects.filter(pk=cls.doctor.user_id).update(email="house@example.com")
+        for number in range(40):
+            doctor = make_doctor(f"doctor{number}", specialty="Cardiology" if number % 2 else "General")
+            User.objects.filter(pk=doctor.user_id).update(email=f"doctor{number}@example.com")
+
+    def setUp(self):
+        # Warm the cached principal, so only the endpoint's own queries count
+        self.get("/api/doctors/", limit=1)
+
+    def test_page_is_sliced_in_sql(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get("/api/doctors/", limit=5, offset=10)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["items"]), 5)
+        self.assertEqual(response.json()["count"], 41)
+        selects = [query["sql"] for query in queries if 'FROM "doctors"' in query["sql"]]
+        self.assertTrue(any("LIMIT 5 OFFSET 10" in sql for sql in selects), selects)
+
+    def test_query_count_does_not_grow_with_the_doctors(self):
+        # COUNT(*) with the list validators, then the page; cursor pages skip the count
+        with self.assertNumQueries(2):
+            self.get("/api/doctors/", limit=50)
+        with self.assertNumQueries(1):
+            self.get("/api/doctors/", cursor="", limit=50)
+
+    def test_rows_match_the_schema_built_from_the_user(self):
+        response = self.get("/api/doctors/", limit=100, specialty="cardio")
+        # What list_doctors built per doctor before it returned a queryset
+        expected = [
+            DoctorOutSchema.model_validate({
+                "id": doctor.id, "user_id": doctor.user.id, "first_name": doctor.first_name,
+                "last_name": doctor.last_name, "specialty": doctor.specialty, "email": doctor.user.email,
+                "phone": doctor.phone, "created_at": doctor.created_at,
+            }).model_dump()
+            for doctor in Doctor.objects.select_related("user").filter(specialty="Cardiology").order_by("id")
+        ]
+        self.assertEqual(len(expected), 20)
+        self.assertEqual(response.json()["items"], json.loads(DjangoJSONEncoder().encode(expected)))
+        self.assertEqual(self.get(f"/api/doctors/{self.doctor.id}/").json()["email"], "house@example.com")
+
+
+class EmbedTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.wilson = make_doctor("wilson")
+        day = timezone.localdate() + timedelta(days=7)
+        cls.visits = {}
+        for hour, doctor in ((9, cls.doctor), (10, cls.wilson), (11, cls.doctor)):
+            appointment = make_appointment(cls.patient, doctor, at(day, hour), status=Appointment.STATUS_COMPLETED)
+            Prescription.objects.create(
+                appointment=appointment, medication="Ibuprofen", dosage="200mg", instructions="Twice daily",
+                date_issued=day, prescription_cost=Decimal("5.00"),
+            )
+            cls.visits.setdefault(doctor.id, []).append(appointment.id)
+
+    def embedded(self, user, path="/api/patients/"):
+        params = {"include": "appointments,prescriptions"}
+        if path.startswith("/api/async/"):
+            headers = {"Authorization": self.auth(user)["HTTP_AUTHORIZATION"]}
+            response = async_to_sync(self.async_client.get)(path, params, headers=headers)
+        else:
+            response = self.client.get(path, params, **self.auth(user))
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        patient = body if "id" in body else next(item for item in body["items"] if item["id"] == self.patient.id)
+        return (
+            [appointment["id"] for appointment in patient["appointments"]],
+            [prescription["appointment_id"] for prescription in patient["prescriptions"]],
+        )
+
+    def test_doctor_gets_only_their_own_related_rows(self):
+        own = self.visits[self.doctor.id]
+        for path in ("/api/patients/", f"/api/patients/{self.patient.id}/", "/api/async/patients/"):
+            with self.subTest(path=path):
+                self.assertEqual(self.embedded(self.doctor.user, path), (own, own))
+
+    def test_admin_gets_every_related_row(self):
+        every = sorted(self.visits[self.doctor.id] + self.visits[self.wilson.id])
+        self.assertEqual(self.embedded(self.admin), (every, every))
+
+    def test_fields_trim_items_and_keep_the_id(self):
+        response = self.get("/api/patients/", fields="first_name")
+        self.assertEqual(response.json()["items"][0], {"id": self.patient.id, "first_name": "John"})
+
+    def test_unknown_fields_or_includes_are_rejected(self):
+        for path in ("/api/patients/", "/api/appointments/", "/api/prescriptions/", f"/api/patients/{self.patient.id}/"):
+            for params in ({"fields": "first_name,password"}, {"include": "invoices"}):
+                with self.subTest(path=path, **params):
+                    response = self.get(path, **params)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn("Valid options are", response.json()["detail"])
+
+
+class AppointmentOverlapTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.day = timezone.localdate() + timedelta(days=7)
+
+    def book(self, date_time, minutes=30, doctor=None):
+        return self.post("/api/appointments/", {
+            "patient_id": self.patient.id,
+            "doctor_id": (doctor or self.doctor).id,
+            "date_time": date_time.isoformat(),
+            "duration_minutes": minutes,
+            "appointment_cost": "100.00",
+        })
+
+    def test_overlapping_booking_is_rejected(self):
+        self.assertEqual(self.book(at(self.day, 10)).status_code, 200)
+        self.assertEqual(self.book(at(self.day, 10, 15)).status_code, 400)
+        self.assertEqual(self.book(at(self.day, 9, 45)).status_code, 400)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_back_to_back_bookings_are_accepted(self):
+        self.assertEqual(self.book(at(self.day, 10)).status_code, 200)
+        self.assertEqual(self.book(at(self.day, 10, 30)).status_code, 200)
+        self.assertEqual(self.book(at(self.day, 9, 30)).status_code, 200)
+
+    def test_other_doctors_are_not_blocked(self):
+        self.assertEqual(self.book(at(self.day, 10)).status_code, 200)
+        self.assertEqual(self.book(at(self.day, 10, 15), doctor=make_doctor("wilson")).status_code, 200)
+
+    def test_update_into_an_occupied_slot_is_rejected(self):
+        self.book(at(self.day, 10))
+        later = self.book(at(self.day, 11)).json()
+
+        response = self.put(f"/api/appointments/{later['id']}/", {"date_time": at(self.day, 10, 15).isoformat()})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Appointment.objects.get(id=later["id"]).date_time, at(self.day, 11))
+
+        # Lengthening into the next booking is an overlap too
+        first = Appointment.objects.get(date_time=at(self.day, 10))
+        response = self.put(f"/api/appointments/{first.id}/", {"duration_minutes": 90})
+        self.assertEqual(response.status_code, 400)
+
+    def test_canceled_and_completed_appointments_do_not_block(self):
+        make_appointment(self.patient, self.doctor, at(self.day, 10), status=Appointment.STATUS_CANCELED)
+        make_appointment(self.patient, self.doctor, at(self.day, 10), status=Appointment.STATUS_COMPLETED)
+        self.assertEqual(self.book(at(self.day, 10)).status_code, 200)
+
+        # Nor does an appointment once it is canceled
+        booked = Appointment.objects.get(status=Appointment.STATUS_SCHEDULED)
+        booked.status = Appointment.STATUS_CANCELED
+        booked.save()
+        self.assertEqual(self.book(at(self.day, 10, 15)).status_code, 200)
+
+    def test_database_rejects_overlaps(self):
+        make_appointment(self.patient, self.doctor, at(self.day, 10))
+        with self.assertRaises(IntegrityError):
+            make_appointment(self.patient, self.doctor, at(self.day, 10, 15))
+
+    def test_series_skips_conflicting_occurrences(self):
+        week = timedelta(days=7)
+        make_appointment(self.patient, self.doctor, at(self.day + week, 10, 15))
+        make_appointment(self.patient, self.doctor, at(self.day + 3 * week, 9, 45))
+
+        response = self.post("/api/appointments/series/", {
+            "patient_id": self.patient.id,
+            "doctor_id": self.doctor.id,
+            "date_time": at(self.day, 10).isoformat(),
+            "appointment_cost": "100.00",
+            "frequency": "weekly",
+            "count": 4,
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual(
+            [datetime.fromisoformat(item["date_time"]) for item in body["created"]],
+            [at(self.day, 10), at(self.day + 2 * week, 10)],
+        )
+        self.assertEqual(
+            [datetime.fromisoformat(value) for value in body["conflicts"]],
+            [at(self.day + week, 10), at(self.day + 3 * week, 10)],
+        )
+
+
+class AvailabilityTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        today = timezone.localdate()
+        cls.monday = today + timedelta(days=7 - today.weekday() + 7)
+        cls.configured = make_doctor("cuddy", specialty="Endocrinology")
+        DoctorWorkingHours.objects.bulk_create([
+            DoctorWorkingHours(doctor=cls.configured, weekday=0, start_time=time(9), end_time=time(10)),
+            DoctorWorkingHours(doctor=cls.configured, weekday=0, start_time=time(14), end_time=time(15)),
+        ])
+
+    def slots(self, doctor, day=None, **params):
+        day = day or self.monday
+        params.setdefault("end_date", day)
+        response = self.get("/api/availability/", start_date=day, doctor_id=doctor.id, **params)
+        self.assertEqual(response.status_code, 200, response.content)
+        [row] = response.json()
+        return [datetime.fromisoformat(slot) for slot in row["slots"]]
+
+    def times(self, *hours_and_minutes, day=None):
+        return [at(day or self.monday, hour, minute) for hour, minute in hours_and_minutes]
+
+    def test_default_hours_apply_without_configured_ones(self):
+        slots = self.slots(self.doctor)
+        self.assertEqual(len(slots), 16)
+        self.assertEqual((slots[0], slots[-1]), (at(self.monday, 9), at(self.monday, 16, 30)))
+        self.assertEqual(self.slots(self.doctor, self.monday + timedelta(days=5)), [])
+
+    @override_settings(DEFAULT_WORKING_HOURS=[(0, "08:00", "09:00")])
+    def test_default_hours_come_from_settings(self):
+        self.assertEqual(self.slots(self.doctor), self.times((8, 0), (8, 30)))
+
+    def test_slots_fill_working_windows_up_to_their_end(self):
+        self.assertEqual(self.slots(self.configured), self.times((9, 0), (9, 30), (14, 0), (14, 30)))
+        # A 45 minute slot fits once per hour-long window
+        self.assertEqual(self.slots(self.configured, slot_minutes=45), self.times((9, 0), (14, 0)))
+        self.assertEqual(self.slots(self.configured, slot_minutes=90), [])
+
+    def test_bookings_take_out_the_slots_they_overlap(self):
+        make_appointment(self.patient, self.configured, at(self.monday, 9, 30))
+        # Ends exactly when the window opens, so it blocks nothing
+        make_appointment(self.patient, self.configured, at(self.monday, 13, 30))
+        self.assertEqual(self.slots(self.configured), self.times((9, 0), (14, 0), (14, 30)))
+
+    def test_slots_resume_on_the_grid_after_an_off_grid_booking(self):
+        make_appointment(self.patient, self.doctor, at(self.monday, 9, 10), minutes=20)
+        self.assertEqual(self.slots(self.doctor)[:2], self.times((9, 30), (10, 0)))
+
+    def test_longer_and_back_to_back_bookings(self):
+        make_appointment(self.patient, self.doctor, at(self.monday, 9), minutes=90)
+        make_appointment(self.patient, self.doctor, at(self.monday, 10, 30), minutes=30)
+        self.assertEqual(self.slots(self.doctor)[0], at(self.monday, 11))
+        self.assertEqual(len(self.slots(self.doctor)), 12)
+
+    def test_only_scheduled_appointments_are_busy(self):
+        make_appointment(self.patient, self.configured, at(self.monday, 9), status=Appointment.STATUS_CANCELED)
+        self.assertEqual(self.slots(self.configured)[0], at(self.monday, 9))
+
+    def test_ranges_cover_every_day_and_specialty_filters_doctors(self):
+        friday = self.monday + timedelta(days=4)
+        self.assertEqual(len(self.slots(self.doctor, end_date=friday)), 5 * 16)
+        response = self.get("/api/availability/", start_date=self.monday, end_date=self.monday, specialty="endo")
+        self.assertEqual([row["doctor_id"] for row in response.json()], [self.configured.id])
+
+    def test_invalid_ranges_are_rejected(self):
+        cases = [
+            {"end_date": self.monday - timedelta(days=1)},
+            {"end_date": self.monday + timedelta(days=31)},
+            {"end_date": self.monday, "slot_minutes": 4},
+            {"end_date": self.monday, "slot_minutes": 481},
+        ]
+        for params in cases:
+            with self.subTest(**params):
+                self.assertEqual(self.get("/api/availability/", start_date=self.monday, **params).status_code, 400)
+
+    def test_past_slots_are_skipped(self):
+        start = at(self.monday, 9)
+        windows = [(start, at(self.monday, 11))]
+        slots = free_slots(windows, [], timedelta(minutes=30), not_before=at(self.monday, 9, 40))
+        self.assertEqual([slot for slot, _ in slots], self.times((10, 0), (10, 30)))
+
+    def test_overlapping_and_touching_bookings_merge(self):
+        busy = [
+            (at(self.monday, 10), at(self.monday, 10, 30)),
+            (at(self.monday, 9), at(self.monday, 10)),
+            (at(self.monday, 9, 30), at(self.monday, 9, 45)),
+            (at(self.monday, 11), at(self.monday, 11, 30)),
+        ]
+        self.assertEqual(merge_intervals(busy), [
+            (at(self.monday, 9), at(self.monday, 10, 30)), (at(self.monday, 11), at(self.monday, 11, 30)),
+        ])
+
+
+class AppointmentEndTimeMigrationTests(TestCase):
+    """0006_appointment_end_time refuses to install the overlap checks over conflicting rows."""
+
+    migration = import_module("api.migrations.0006_appointment_end_time")
+
+    def setUp(self):
+        self.doctor = make_doctor("house")
+        self.patient = make_patient()
+        # Legacy rows predate the checks; rolled back with the test
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER appointments_no_overlap_ai")
+            cursor.execute("DROP TRIGGER appointments_no_overlap_au")
+            cursor.execute("DROP INDEX appointment_doctor_slot_uniq")
+
+    def test_lists_overlapping_and_duplicate_appointments(self):
+        day = timezone.localdate() + timedelta(days=7)
+        first = make_appointment(self.patient, self.doctor, at(day, 10))
+        duplicate = make_appointment(self.patient, self.doctor, at(day, 10))
+        overlapping = make_appointment(self.patient, self.doctor, at(day, 10, 20))
+        make_appointment(self.patient, self.doctor, at(day, 11))
+        make_appointment(self.patient, self.doctor, at(day, 10, 5), status=Appointment.STATUS_CANCELED)
+        make_appointment(self.patient, make_doctor("wilson"), at(day, 10))
+
+        with self.assertRaisesMessage(
+            IntegrityError,
+            f"3 pair(s) of scheduled appointments overlap for the same doctor: appointments "
+            f"{first.id} and {duplicate.id}, {first.id} and {overlapping.id}, {duplicate.id} and {overlapping.id}."
+        ):
+            self.migration.check_conflicts(apps, None)
+
+    def test_passes_without_conflicts(self):
+        day = timezone.localdate() + timedelta(days=7)
+        make_appointment(self.patient, self.doctor, at(day, 10))
+        make_appointment(self.patient, self.doctor, at(day, 10, 30))
+        self.migration.check_conflicts(apps, None)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPRecipientsRefused({"jane@example.com": (550, b"No such user")})
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.email = outbox.enqueue(
+            "Your ClinicFlow account", "Username: jane\nPassword: s3cret", "noreply@example.com", ["jane@example.com"],
+        )
+
+    def test_sent_email_body_is_cleared(self):
+        self.assertEqual(outbox.send_due(), 1)
+        self.assertEqual(mail.outbox[0].body, "Username: jane\nPassword: s3cret")
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.body), (OutboxEmail.STATUS_SENT, ""))
+
+    @override_settings(EMAIL_BACKEND="api.tests.FailingEmailBackend", EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_email_body_is_cleared(self):
+        outbox.send_due()
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutboxEmail.STATUS_PENDING)
+        self.assertIn("s3cret", self.email.body)
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        outbox.send_due()
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), (OutboxEmail.STATUS_FAILED, 2))
+        self.assertEqual(self.email.body, "")
+        self.assertIn("No such user", self.email.last_error)
+
+
+class RowSchemaTests(APITestCase):
+    def row(self, **values):
+        now = timezone.now()
+        return {
+            "id": 1, "patient_id": 2, "doctor_id": 3, "date_time": now.isoformat(), "end_time": now,
+            "reason": None, "status": "scheduled", "appointment_cost": "100.50", "created_at": now, **values,
+        }
+
+    def test_dict_rows_are_validated(self):
+        appointment = AppointmentOutSchema.model_validate(self.row())
+        self.assertIsInstance(appointment, AppointmentOutSchema)
+        self.assertEqual(appointment.appointment_cost, Decimal("100.50"))
+        self.assertIsInstance(appointment.date_time, datetime)
+
+        with self.assertRaises(ValidationError):
+            AppointmentOutSchema.model_validate(self.row(appointment_cost="free"))
+        with self.assertRaises(ValidationError):
+            AppointmentOutSchema.model_validate({"id": 1})
+
+    def test_unset_fields_stay_unset(self):
+        patient = PatientReadSchema.model_validate({"id": 1, "appointments": [self.row()]})
+        self.assertEqual(patient.model_fields_set, {"id", "appointments"})
+        self.assertIsInstance(patient.appointments[0], AppointmentOutSchema)
+        self.assertEqual(patient.model_dump(exclude_unset=True)["appointments"][0]["appointment_cost"], Decimal("100.50"))
+
+    def test_model_instances_go_through_ninja(self):
+        appointment = make_appointment(self.patient, self.doctor, timezone.now() + timedelta(days=1))
+        self.assertEqual(AppointmentOutSchema.model_validate(appointment).id, appointment.id)
+
+    def test_list_pages_validate_dict_rows(self):
+        make_appointment(self.patient, self.doctor, timezone.now() + timedelta(days=1))
+        with mock.patch("api.schema.row_model", wraps=row_model) as validated:
+            response = self.get("/api/appointments/", cursor="")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(response.json()["items"]), 1)
+        validated.assert_any_call(AppointmentReadSchema)
+
+
+class StreamingInstrumentationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        day = timezone.localdate() + timedelta(days=7)
+        for hour in (9, 10, 11):
+            make_appointment(cls.patient, cls.doctor, at(day, hour))
+
+    def logged(self, logs):
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_export_queries_are_recorded_until_the_body_is_sent(self):
+        with self.assertLogs("api.instrumentation", "INFO") as logs:
+            response = self.get("/api/appointments/export/", format="csv")
+            self.assertEqual(logs.records, [])
+            body = b"".join(response.streaming_content)
+        self.assertEqual(body.count(b"\n"), 4)
+
+        [line] = self.logged(logs)
+        self.assertTrue(line["streamed"])
+        self.assertGreaterEqual(line["queries"], 1)
+        self.assertTrue(any("FROM \"appointments\"" in statement["sql"] for statement in line["slowest"]))
+
+    async def test_async_view_queries_are_recorded(self):
+        with self.assertLogs("api.instrumentation", "INFO") as logs:
+            response = await self.async_client.get(
+                "/api/async/appointments/", {"cursor": ""}, headers={"Authorization": self.auth(self.admin)["HTTP_AUTHORIZATION"]},
+            )
+        self.assertEqual(response.status_code, 200)
+        [line] = self.logged(logs)
+        self.assertEqual(line["view"], "alist_appointments")
+        self.assertGreaterEqual(line["queries"], 1)
+
+    async def test_async_streaming_body_is_recorded(self):
+        async def rows():
+            yield b"%d\n" % await Patient.objects.acount()
+            yield b"%d\n" % await Appointment.objects.acount()
+
+        async def get_response(request):
+            return StreamingHttpResponse(rows())
+
+        middleware = SQLInstrumentationMiddleware(get_response)
+        with self.assertLogs("api.instrumentation", "INFO") as logs:
+            response = await middleware(RequestFactory().get("/stream"))
+            body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(body, b"1\n3\n")
+        [line] = self.logged(logs)
+        self.assertEqual((line["queries"], line["streamed"]), (2, True))
+
+
+class AsyncParityTests(APITestCase):
+    """The /api/async/ read endpoints answer exactly like their sync twins."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_doctor = make_doctor("wilson")
+        for doctor in (cls.doctor, cls.other_doctor):
+            User.objects.filter(pk=doctor.user_id).update(email=f"{doctor.last_name}@example.com")
+        cls.other_patient = make_patient("Jane", "Doe")
+        day = timezone.localdate() - timedelta(days=10)
+        cls.own = make_appointment(cls.patient, cls.doctor, at(day, 9), status=Appointment.STATUS_COMPLETED)
+        cls.others = make_appointment(
+            cls.other_patient, cls.other_doctor, at(day, 10), status=Appointment.STATUS_COMPLETED,
+        )
+        cls.upcoming = make_appointment(cls.patient, cls.doctor, at(day + timedelta(days=20), 9))
+        cls.prescriptions = [
+            Prescription.objects.create(
+                appointment=appointment, medication="Ibuprofen", dosage="200mg", instructions="Twice daily",
+                date_issued=day, prescription_cost=Decimal("7.25"),
+            )
+            for appointment in (cls.own, cls.others)
+        ]
+        cls.year = day.year
+
+    def both(self, path, user=None, **params):
+        user = user or self.admin
+        sync = self.get(f"/api/{path}", user, **params)
+        headers = {"Authorization": self.auth(user)["HTTP_AUTHORIZATION"]}
+        asynchronous = async_to_sync(self.async_client.get)(f"/api/async/{path}", params, headers=headers)
+        self.assertEqual(asynchronous.status_code, sync.status_code, path)
+        self.assertEqual(asynchronous.json(), sync.json(), path)
+        return sync
+
+    def test_lists_and_details_match(self):
+        reads = [
+            ("doctors/", {}), ("doctors/", {"cursor": ""}), (f"doctors/{self.doctor.id}/", {}),
+            ("patients/", {}), ("patients/", {"search": "smith"}),
+            (f"patients/{self.patient.id}/", {"include": "appointments,prescriptions"}),
+            ("appointments/", {}), ("appointments/", {"cursor": "", "status": "completed", "include": "patient"}),
+            (f"appointments/{self.own.id}/", {"fields": "id,status", "include": "doctor"}),
+            ("prescriptions/", {"cursor": ""}), (f"prescriptions/{self.prescriptions[0].id}/", {}),
+            ("billing/", {"year": self.year}),
+        ]
+        for path, params in reads:
+            with self.subTest(path=path, **params):
+                self.assertEqual(self.both(path, **params).status_code, 200)
+
+    def test_doctors_get_the_same_scoping(self):
+        user = self.doctor.user
+        appointments = self.both("appointments/", user, cursor="").json()["items"]
+        self.assertEqual([row["id"] for row in appointments], [self.own.id, self.upcoming.id])
+        prescriptions = self.both("prescriptions/", user).json()["items"]
+        self.assertEqual([row["id"] for row in prescriptions], [self.prescriptions[0].id])
+
+        refused = [
+            f"appointments/{self.others.id}/", f"prescriptions/{self.prescriptions[1].id}/",
+            "doctors/", f"doctors/{self.doctor.id}/",
+        ]
+        for path in refused:
+            with self.subTest(path=path):
+                self.assertEqual(self.both(path, user).status_code, 403)
+        self.assertEqual(self.both("appointments/", user, doctor_id=self.other_doctor.id).status_code, 403)
+        self.assertEqual(self.both("billing/", user, year=self.year).status_code, 403)
+
+    def test_errors_match(self):
+        self.assertEqual(self.both("appointments/0/").status_code, 404)
+        self.assertEqual(self.both("appointments/", date="yesterday").status_code, 400)
+        self.assertEqual(self.both("patients/", include="nothing").status_code, 400)
+        self.assertEqual(self.both("billing/").status_code, 400)
+
+
+class ExportTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_doctor = make_doctor("wilson")
+        cls.day = timezone.localdate() - timedelta(days=3)
+        cls.own = [
+            make_appointment(cls.patient, cls.doctor, at(cls.day, hour), status=Appointment.STATUS_COMPLETED)
+            for hour in (9, 10)
+        ]
+        cls.others = make_appointment(cls.patient, cls.other_doctor, at(cls.day, 11), status=Appointment.STATUS_COMPLETED)
+        for appointment in (*cls.own, cls.others):
+            Prescription.objects.create(
+                appointment=appointment, medication="Ibuprofen", dosage="200mg", instructions="Twice daily",
+                date_issued=cls.day, prescription_cost=Decimal("7.25"),
+            )
+
+    def export(self, path, user=None, **params):
+        response = self.get(path, user, **params)
+        self.assertEqual(response.status_code, 200)
+        return response, list(response.streaming_content)
+
+    def csv_rows(self, chunks):
+        return list(csv.reader(b"".join(chunks).decode().splitlines()))
+
+    def test_csv_has_a_header_row_and_download_headers(self):
+        response, chunks = self.export("/api/appointments/export/", format="csv")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="appointments.csv"')
+
+        header, *rows = self.csv_rows(chunks)
+        self.assertEqual(header, list(AppointmentOutSchema.model_fields))
+        self.assertEqual([int(row[0]) for row in rows], [a.id for a in (*self.own, self.others)])
+        self.assertEqual(rows[0][header.index("date_time")], self.own[0].date_time.isoformat())
+
+    def test_ndjson_has_one_object_per_line(self):
+        response, chunks = self.export("/api/prescriptions/export/", format="ndjson")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="prescriptions.ndjson"')
+
+        rows = [json.loads(chunk) for chunk in chunks]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(list(rows[0]), list(PrescriptionOutSchema.model_fields))
+        self.assertEqual(rows[0]["prescription_cost"], "7.25")
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_rows_stream_one_line_per_chunk(self):
+        with mock.patch.object(QuerySet, "iterator", autospec=True, side_effect=QuerySet.iterator) as iterator:
+            _, chunks = self.export("/api/appointments/export/", format="csv")
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(iterator.call_args.kwargs, {"chunk_size": 2})
+
+    def test_doctors_export_only_their_own_rows(self):
+        user = self.doctor.user
+        _, chunks = self.export("/api/appointments/export/", user, format="csv")
+        self.assertEqual([int(row[0]) for row in self.csv_rows(chunks)[1:]], [a.id for a in self.own])
+
+        _, chunks = self.export("/api/prescriptions/export/", user, format="ndjson")
+        self.assertEqual(
+            [json.loads(chunk)["appointment_id"] for chunk in chunks], [a.id for a in self.own],
+        )
+
+        self.assertEqual(
+            self.get("/api/appointments/export/", user, format="csv", doctor_id=self.other_doctor.id).status_code, 403,
+        )
+        self.assertEqual(self.get("/api/billing/export/", user, year=self.day.year).status_code, 403)
+
+    def test_billing_export_lists_appointment_then_prescription_lines(self):
+        _, chunks = self.export("/api/billing/export/", year=self.day.year, month=self.day.month, format="csv")
+        header, *rows = self.csv_rows(chunks)
+        self.assertEqual(header, ["line_type", "line_id", "appointment_id", "patient_id", "full_name", "date", "amount"])
+        self.assertEqual([row[0] for row in rows], ["appointment"] * 3 + ["prescription"] * 3)
+        self.assertEqual(rows[0][4], "John Smith")
+
+    def test_unknown_format_is_rejected(self):
+        self.assertEqual(self.get("/api/appointments/export/", format="xml").status_code, 400)
+
+
+class QueryBudgetTests(TestCase):
+    def middleware(self):
+        @query_budget(1)
+        def view(request):
+            Patient.objects.count()
+            Appointment.objects.count()
+            return HttpResponse()
+
+        return SQLInstrumentationMiddleware(view)
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_overrun_is_logged_as_a_warning(self):
+        with self.assertLogs("api.instrumentation", "INFO") as logs:
+            response = self.middleware()(RequestFactory().get("/"))
+        self.assertEqual(response.status_code, 200)
+        [record] = logs.records
+        self.assertEqual(record.levelname, "WARNING")
+        self.assertEqual(json.loads(record.getMessage())["query_budget"], 1)
+
+    @override_settings(QUERY_BUDGET_RAISE=True)
+    def test_overrun_raises_when_enabled(self):
+        with self.assertLogs("api.instrumentation", "INFO"), self.assertRaises(QueryBudgetExceeded):
+            self.middleware()(RequestFactory().get("/"))
+
+
+# Bookings can only be moved into the future
+ROLLUP_YEAR = timezone.localdate().year + 1
+
+
+def baseline_breakdown(year, month=None):
+    # billing_report's per-patient loop before the report was grouped in SQL:
+    # tables scanned in id order, patients listed as first seen
+    appointments = Appointment.objects.filter(status="completed", date_time__year=year).order_by("id")
+    prescriptions = Prescription.objects.filter(date_issued__year=year).order_by("id")
+    if month:
+        appointments = appointments.filter(date_time__month=month)
+        prescriptions = prescriptions.filter(date_issued__month=month)
+
+    patients = {}
+    costs = [(a.patient, "appointment_total", a.appointment_cost) for a in appointments.select_related("patient")]
+    costs += [
+        (p.appointment.patient, "prescription_total", p.prescription_cost)
+        for p in prescriptions.select_related("appointment__patient")
+    ]
+    for patient, total, cost in costs:
+        data = patients.setdefault(patient.id, {
+            "patient_id": patient.id,
+            "full_name": f"{patient.first_name} {patient.last_name}",
+            "appointment_total": Decimal("0.00"),
+            "prescription_total": Decimal("0.00"),
+        })
+        data[total] += cost or Decimal("0.00")
+    return [
+        {**data, "total_amount": str(data["appointment_total"] + data["prescription_total"]),
+         "appointment_total": str(data["appointment_total"]), "prescription_total": str(data["prescription_total"])}
+        for data in patients.values()
+    ]
+
+
+class BillingReportOrderTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        completed = Appointment.STATUS_COMPLETED
+
+        def visit(patient, month, day, cost, **fields):
+            return make_appointment(
+                patient, cls.doctor, at(date(ROLLUP_YEAR, month, day), 9),
+                appointment_cost=Decimal(cost), **fields,
+            )
+
+        def prescribe(appointment, month, day, cost):
+            return Prescription.objects.create(
+                appointment=appointment, medication="Ibuprofen", dosage="200mg", instructions="Twice daily",
+                date_issued=date(ROLLUP_YEAR, month, day), prescription_cost=Decimal(cost),
+            )
+
+        # Appointment and prescription ids out of patient id order
+        zoe, adam = make_patient("Zoe", "Young"), make_patient("Adam", "Ant")
+        olga, paula = make_patient("Olga", "Only"), make_patient("Paula", "Price")
+        march = visit(zoe, 3, 2, "110.25", status=completed)
+        visit(cls.patient, 1, 5, "99.99", status=completed)
+        visit(adam, 2, 1, "10.10", status=completed)
+        visit(zoe, 4, 1, "110.24", status=completed)
+        visit(adam, 5, 1, "75.00")
+        prescribe(march, 3, 2, "3.33")
+        # Prescriptions only, from completed visits of the year before
+        december = make_appointment(paula, cls.doctor, at(date(ROLLUP_YEAR - 1, 12, 30), 9), status=completed)
+        november = make_appointment(olga, cls.doctor, at(date(ROLLUP_YEAR - 1, 11, 30), 9), status=completed)
+        prescribe(december, 1, 2, "5.55")
+        prescribe(november, 3, 9, "0.10")
+        prescribe(december, 3, 1, "1.01")
+        billing_rollup.rebuild()
+
+    def breakdowns(self, **params):
+        headers = {"Authorization": self.auth(self.admin)["HTTP_AUTHORIZATION"]}
+        raw = self.get("/api/billing/", year=ROLLUP_YEAR, **params)
+        araw = async_to_sync(self.async_client.get)(
+            "/api/async/billing/", {"year": ROLLUP_YEAR, **params}, headers=headers,
+        )
+        with self.settings(BILLING_ROLLUP_ENABLED=True):
+            rollup = self.get("/api/billing/", year=ROLLUP_YEAR, **params)
+        return {"raw": raw.json(), "async": araw.json(), "rollup": rollup.json()}
+
+    def test_breakdown_matches_the_baseline_order_and_totals(self):
+        for month in (None, 3):
+            expected = baseline_breakdown(ROLLUP_YEAR, month)
+            params = {"month": month} if month else {}
+            for source, report in self.breakdowns(**params).items():
+                with self.subTest(month=month, source=source):
+                    self.assertEqual(report["breakdown_by_patient"], expected)
+
+        names = [row["full_name"] for row in baseline_breakdown(ROLLUP_YEAR)]
+        self.assertEqual(names, ["Zoe Young", "John Smith", "Adam Ant", "Paula Price", "Olga Only"])
+
+    def test_totals_have_two_decimal_places(self):
+        for source, report in self.breakdowns().items():
+            with self.subTest(source=source):
+                self.assertEqual(report["total_income"], "340.57")
+                self.assertEqual(report["breakdown_by_patient"][0]["appointment_total"], "220.49")
+
+
+@override_settings(BILLING_ROLLUP_ENABLED=True)
+class BillingRollupTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = make_patient("Jane", "Doe")
+        completed = Appointment.STATUS_COMPLETED
+        cls.january = make_appointment(cls.patient, cls.doctor, at(date(ROLLUP_YEAR, 1, 10), 9), status=completed)
+        cls.february = make_appointment(cls.patient, cls.doctor, at(date(ROLLUP_YEAR, 2, 3), 9))
+        make_appointment(cls.other, cls.doctor, at(date(ROLLUP_YEAR, 3, 1), 9), status=completed)
+        cls.prescription = Prescription.objects.create(
+            appointment=cls.january, medication="Ibuprofen", dosage="200mg", instructions="Twice daily",
+            date_issued=date(ROLLUP_YEAR, 1, 10), prescription_cost=Decimal("12.50"),
+        )
+
+    def assertConsistent(self):
+        self.assertEqual(billing_rollup.differences(), {})
+        rollup = self.get("/api/billing/", year=ROLLUP_YEAR)
+        with self.settings(BILLING_ROLLUP_ENABLED=False):
+            raw = self.get("/api/billing/", year=ROLLUP_YEAR)
+        self.assertEqual(rollup.status_code, 200, rollup.content)
+        self.assertEqual(rollup.json(), raw.json())
+
+    def rollup(self, month, patient):
+        return BillingRollup.objects.filter(year=ROLLUP_YEAR, month=month, patient=patient).first()
+
+    def test_signals_keep_the_rollup_current_from_the_start(self):
+        self.assertConsistent()
+        self.assertEqual(BillingRollup.objects.count(), 2)
+
+    def test_complete_and_revert(self):
+        self.put(f"/api/appointments/{self.february.id}/", {"status": Appointment.STATUS_COMPLETED})
+        self.assertEqual(self.rollup(2, self.patient).appointment_count, 1)
+        self.assertConsistent()
+
+        self.put(f"/api/appointments/{self.january.id}/", {"status": Appointment.STATUS_SCHEDULED})
+        self.assertEqual(self.rollup(1, self.patient).appointment_count, 0)
+        self.assertConsistent()
+
+    def test_cost_change(self):
+        response = self.put(f"/api/appointments/{self.january.id}/", {"appointment_cost": "80.25"})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.rollup(1, self.patient).appointment_total, Decimal("80.25"))
+        self.assertConsistent()
+
+    def test_prescription_create_edit_and_delete(self):
+        response = self.post("/api/prescriptions/", {
+            "appointment_id": self.january.id, "medication": "Amoxicillin", "dosage": "500mg",
+            "instructions": "Three times daily", "date_issued": f"{ROLLUP_YEAR}-04-02", "prescription_cost": "9.99",
+        }, user=self.doctor.user)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.rollup(4, self.patient).prescription_total, Decimal("9.99"))
+        self.assertConsistent()
+
+        self.prescription.prescription_cost = Decimal("20.00")
+        self.prescription.date_issued = date(ROLLUP_YEAR, 5, 1)
+        self.prescription.save()
+        self.assertEqual(self.rollup(5, self.patient).prescription_total, Decimal("20.00"))
+        self.assertConsistent()
+
+        self.prescription.delete()
+        self.assertIsNone(self.rollup(5, self.patient))
+        self.assertConsistent()
+
+    def test_moving_an_appointment_to_another_patient_or_month(self):
+        response = self.put(f"/api/appointments/{self.january.id}/", {"patient_id": self.other.id})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIsNone(self.rollup(1, self.patient))
+        self.assertEqual(self.rollup(1, self.other).prescription_count, 1)
+        self.assertConsistent()
+
+        june = at(date(ROLLUP_YEAR, 6, 7), 9)
+        response = self.put(f"/api/appointments/{self.january.id}/", {"date_time": june.isoformat()})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.rollup(6, self.other).appointment_count, 1)
+        # Its prescription stays in the month it was issued
+        self.assertEqual(self.rollup(1, self.other).appointment_count, 0)
+        self.assertConsistent()
+
+    def test_check_and_rebuild_commands(self):
+        out = StringIO()
+        call_command("check_billing_rollup", stdout=out)
+        self.assertIn("consistent", out.getvalue())
+
+        BillingRollup.objects.update(appointment_total=Decimal("0.00"))
+        with self.assertRaises(CommandError):
+            call_command("check_billing_rollup", stdout=StringIO())
+        call_command("check_billing_rollup", "--fix", stdout=StringIO())
+        self.assertConsistent()
+
+        BillingRollup.objects.all().delete()
+        call_command("rebuild_billing_rollup", "--year", str(ROLLUP_YEAR), stdout=StringIO())
+        self.assertConsistent()
+
+
+class SQLitePragmaTests(TestCase):
+    """New connections run settings.SQLITE_PRAGMAS, journal_mode on the primary only."""
+
+    def connect(self, alias):
+        handle, name = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+        self.addCleanup(os.remove, name)
+        database = {**connections.settings[DEFAULT_DB_ALIAS], "NAME": name}
+        wrapper = connections[DEFAULT_DB_ALIAS].__class__(database, alias=alias)
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    @override_settings(SQLITE_PRAGMAS=settings.SQLITE_PRODUCTION_PROFILE["PRAGMAS"])
+    def test_production_pragmas_are_applied_on_connect(self):
+        primary = self.connect(DEFAULT_DB_ALIAS)
+        self.assertEqual(self.pragma(primary, "journal_mode"), "wal")
+        self.assertEqual(self.pragma(primary, "synchronous"), 1)  # NORMAL
+        self.assertEqual(self.pragma(primary, "cache_size"), -64 * 1024)
+        self.assertEqual(self.pragma(primary, "busy_timeout"), 20000)
+        self.assertEqual(self.pragma(primary, "temp_store"), 2)  # MEMORY
+
+    @override_settings(SQLITE_PRAGMAS=settings.SQLITE_PRODUCTION_PROFILE["PRAGMAS"])
+    def test_other_aliases_skip_journal_mode(self):
+        replica = self.connect("replica")
+        self.assertEqual(self.pragma(replica, "journal_mode"), "delete")
+        self.assertEqual(self.pragma(replica, "synchronous"), 1)
+        self.assertEqual(self.pragma(replica, "busy_timeout"), 20000)
+
+    @override_settings(SQLITE_PRAGMAS={})
+    def test_no_pragmas_by_default(self):
+        primary = self.connect(DEFAULT_DB_ALIAS)
+        self.assertEqual(self.pragma(primary, "journal_mode"), "delete")
+        self.assertEqual(self.pragma(primary, "synchronous"), 2)  # FULL
+
+    def test_other_vendors_are_left_alone(self):
+        other = mock.Mock(vendor="postgresql", alias=DEFAULT_DB_ALIAS)
+        apply_pragmas(other, {"journal_mode": "WAL"})
+        other.cursor.assert_not_called()
+
+
+class ReplicaTests(TransactionTestCase):
+    """Reads of the marked operations against a second SQLite file, a snapshot of the primary."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The replica alias exists for this class only, so the test runner never
+        # sets it up; sync_replica gives it its tables
+        handle, cls.replica_file = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+        database = {**connections.settings[DEFAULT_DB_ALIAS], "NAME": cls.replica_file}
+        connections.settings["replica"] = database  # settings.DATABASES itself
+        cls.databases = cls.databases | {"replica"}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        os.remove(cls.replica_file)
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username="admin", password="secret", role="admin")
+        self.doctor = make_doctor("house")
+        self.patient = make_patient()
+        self.completed = make_appointment(
+            self.patient, self.doctor, at(date(ROLLUP_YEAR, 1, 5), 9), status=Appointment.STATUS_COMPLETED,
+        )
+        call_command("sync_replica", stdout=StringIO())
+        # Only on the primary until the next sync
+        self.lagging = make_patient("Late", "Comer")
+        make_appointment(self.lagging, self.doctor, at(date(ROLLUP_YEAR, 1, 6), 9), status=Appointment.STATUS_COMPLETED)
+
+    def auth(self, user=None):
+        return {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user or self.admin)}"}
+
+    def create_patient(self, **fields):
+        return self.client.post("/api/patients/", fields, content_type="application/json", **self.auth())
+
+    def patient_ids(self, path="/api/patients/", user=None):
+        if path.startswith("/api/async/"):
+            headers = {"Authorization": self.auth(user)["HTTP_AUTHORIZATION"]}
+            response = async_to_sync(self.async_client.get)(path, headers=headers)
+        else:
+            response = self.client.get(path, **self.auth(user))
+        self.assertEqual(response.status_code, 200, response.content)
+        return [item["id"] for item in response.json()["items"]]
+
+    def test_lists_billing_and_exports_read_from_the_replica(self):
+        self.assertEqual(self.patient_ids(), [self.patient.id])
+        self.assertEqual(self.patient_ids("/api/async/patients/"), [self.patient.id])
+
+        billing = self.client.get("/api/billing/", {"year": ROLLUP_YEAR}, **self.auth()).json()
+        self.assertEqual(billing["total_appointments"], 1)
+
+        export = self.client.get("/api/appointments/export/", {"format": "ndjson"}, **self.auth())
+        rows = [json.loads(line) for line in b"".join(export.streaming_content).splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.completed.id])
+
+    def test_unmarked_reads_stay_on_the_primary(self):
+        response = self.client.get(f"/api/patients/{self.lagging.id}/", **self.auth())
+        self.assertEqual(response.status_code, 200)
+
+    def test_writes_go_to_the_primary_and_pin_the_writer(self):
+        response = self.create_patient(
+            first_name="New", last_name="Patient", dob="1990-01-01", gender=Patient.GENDER_FEMALE,
+            phone="555-0102", address="3 Low Road",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        created = response.json()["id"]
+        self.assertTrue(Patient.objects.using(DEFAULT_DB_ALIAS).filter(id=created).exists())
+        self.assertFalse(Patient.objects.using("replica").filter(id=created).exists())
+
+        # The writer reads its own write, from the primary; other users don't
+        self.assertTrue(cache.get(pin_cache_key(self.admin.pk)))
+        self.assertIn(created, self.patient_ids())
+        self.assertNotIn(created, self.patient_ids(user=self.doctor.user))
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_no_pin_without_pin_seconds(self):
+        response = self.create_patient(
+            first_name="New", last_name="Patient", dob="1990-01-01", gender=Patient.GENDER_FEMALE,
+            phone="555-0102", address="3 Low Road",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.patient_ids(), [self.patient.id])
+
+    def test_failed_writes_do_not_pin(self):
+        response = self.create_patient(first_name="Incomplete")
+        self.assertEqual(response.status_code, 422)
+        self.assertIsNone(cache.get(pin_cache_key(self.admin.pk)))
+
+
+class MetricsTests(APITestCase):
+    @override_settings(METRICS_TOKEN=None)
+    def test_denied_without_a_token_outside_debug(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=True)
+    def test_served_without_a_token_in_debug(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    @override_settings(METRICS_TOKEN="scrape")
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"clinicflow_http_requests_total", response.content)
+
+    @override_settings(METRICS_TOKEN="scrape")
+    def test_requests_are_labelled_by_route(self):
+        self.get("/api/appointments/")
+        metrics = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape").content.decode()
+        self.assertIn('method="GET",operation="list_appointments",router="appointment_router",status="200"', metrics)
+
+
+# Archival cutoff on 1 July two years back, so that year spans it
+SPANNED_YEAR = timezone.localdate().year - 2
+ARCHIVE_DAYS = (timezone.localdate() - date(SPANNED_YEAR, 7, 1)).days
+
+
+@override_settings(ARCHIVE_AFTER_DAYS=ARCHIVE_DAYS)
+class ArchiveHistoryTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = make_patient("Jane", "Doe")
+        completed = Appointment.STATUS_COMPLETED
+
+        def day(month, day_of_month):
+            return date(SPANNED_YEAR, month, day_of_month)
+
+        make_appointment(cls.other, cls.doctor, at(day(1, 15), 9), status=completed)
+        march = make_appointment(cls.patient, cls.doctor, at(day(3, 10), 9), status=completed)
+        make_appointment(cls.patient, cls.doctor, at(day(4, 1), 9), status=Appointment.STATUS_CANCELED)
+        # Before the cutoff, but its prescription isn't, so both stay
+        may = make_appointment(cls.patient, cls.doctor, at(day(5, 5), 9), status=completed)
+        september = make_appointment(cls.patient, cls.doctor, at(day(9, 1), 9), status=completed)
+        # Never archived while scheduled
+        make_appointment(cls.patient, cls.doctor, at(day(2, 1), 9))
+        for appointment, issued, cost in ((march, day(3, 10), "12.50"), (may, day(8, 1), "30.00"), (september, day(9, 1), "7.25")):
+            Prescription.objects.create(
+                appointment=appointment, medication="Ibuprofen", dosage="200mg", instructions="Twice daily",
+                date_issued=issued, prescription_cost=Decimal(cost),
+            )
+        billing_rollup.rebuild()
+
+    def archive(self):
+        out = StringIO()
+        call_command("archive_history", stdout=out)
+        return out.getvalue()
+
+    def reads(self):
+        headers = {"Authorization": self.auth(self.admin)["HTTP_AUTHORIZATION"]}
+        billing = self.get("/api/billing/", year=SPANNED_YEAR)
+        abilling = async_to_sync(self.async_client.get)("/api/async/billing/", {"year": SPANNED_YEAR}, headers=headers)
+        with self.settings(BILLING_ROLLUP_ENABLED=True):
+            rollup = self.get("/api/billing/", year=SPANNED_YEAR)
+        export = self.get("/api/billing/export/", year=SPANNED_YEAR, format="csv")
+        for response in (billing, abilling, rollup, export):
+            self.assertEqual(response.status_code, 200)
+        return {
+            "billing": billing.json(), "abilling": abilling.json(), "rollup": rollup.json(),
+            "export": b"".join(export.streaming_content),
+        }
+
+    def test_billing_is_unchanged_by_archiving(self):
+        before = self.reads()
+        self.archive()
+        self.assertEqual(
+            (ArchivedAppointment.objects.count(), ArchivedPrescription.objects.count()), (3, 1),
+        )
+        after = self.reads()
+
+        self.assertEqual(after, before)
+        self.assertEqual(before["billing"]["total_appointments"], 4)
+        self.assertEqual(before["billing"]["total_income"], "449.75")
+        self.assertEqual(before["rollup"], before["billing"])
+        self.assertEqual(before["abilling"], before["billing"])
+        self.assertEqual(billing_rollup.differences(SPANNED_YEAR), {})
+
+    def test_patient_history_includes_archived_rows_in_order(self):
+        path = f"/api/patients/{self.patient.id}/"
+        before = self.get(path, include="appointments,prescriptions").json()
+        self.archive()
+        after = self.get(path, include="appointments,prescriptions").json()
+
+        self.assertEqual(after, before)
+        self.assertEqual(
+            [row["date_time"][:10] for row in after["appointments"]],
+            [f"{SPANNED_YEAR}-{month}" for month in ("02-01", "03-10", "04-01", "05-05", "09-01")],
+        )
+        self.assertEqual(
+            [row["date_issued"] for row in after["prescriptions"]],
+            [f"{SPANNED_YEAR}-{month}" for month in ("03-10", "08-01", "09-01")],
+        )
+
+    @override_settings(BILLING_ROLLUP_ENABLED=True)
+    def test_archiving_sends_delete_signals_and_refreshes_the_rollup_once(self):
+        deleted = []
+
+        def record(sender, instance, **kwargs):
+            deleted.append((sender, instance.pk))
+
+        post_delete.connect(record)
+        self.addCleanup(post_delete.disconnect, record)
+        with mock.patch("api.billing_rollup.compute_buckets", wraps=billing_rollup.compute_buckets) as computed:
+            self.archive()
+
+        self.assertEqual(
+            sorted(sender.__name__ for sender, pk in deleted),
+            ["Appointment", "Appointment", "Appointment", "Prescription"],
+        )
+        # One batch, one month per refreshed bucket: January and March
+        self.assertEqual(computed.call_count, 2)
+        self.assertEqual(billing_rollup.differences(SPANNED_YEAR), {})
+
+    def test_second_run_moves_nothing(self):
+        self.assertIn("Archived 3 appointment(s) and 1 prescription(s)", self.archive())
+        hot = list(Appointment.objects.order_by("id").values_list("id", flat=True))
+        self.assertIn("Archived 0 appointment(s) and 0 prescription(s)", self.archive())
+        self.assertEqual(list(Appointment.objects.order_by("id").values_list("id", flat=True)), hot)
+        self.assertEqual((ArchivedAppointment.objects.count(), ArchivedPrescription.objects.count()), (3, 1))
+
+
+class RendererTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.patient = make_patient("Zoë", "Müller-Ørsted")
+        cls.year = timezone.localdate().year - 1
+        for month, cost in ((3, "120.50"), (4, "99.99")):
+            appointment = make_appointment(
+                cls.patient, cls.doctor, at(date(cls.year, month, 10), 9, 15).replace(second=12, microsecond=345678),
+                reason="Contrôle — suivi ☂", status=Appointment.STATUS_COMPLETED, appointment_cost=Decimal(cost),
+            )
+            Prescription.objects.create(
+                appointment=appointment, medication="Ibuprofène", dosage="200mg", instructions="Après le repas",
+                date_issued=appointment.date_time.date(), prescription_cost=Decimal("12.05"),
+            )
+
+    def rendered(self, path, **params):
+        fast = self.get(path, **params)
+        with mock.patch.object(api, "renderer", JSONRenderer()):
+            default = self.get(path, **params)
+        self.assertEqual(fast.status_code, 200, fast.content)
+        self.assertEqual(default.status_code, 200, default.content)
+        return fast.content, default.content
+
+    def test_appointment_list_matches_the_default_renderer(self):
+        fast, default = self.rendered("/api/appointments/", patient_id=self.patient.id)
+        self.assertEqual(fast, default)
+        self.assertIn(b'"appointment_cost": "120.50"', fast)
+        self.assertIn(b"\\u00f4le \\u2014 suivi \\u2602", fast)
+        self.assertIn(b".345Z", fast)
+
+    def test_billing_report_matches_the_default_renderer(self):
+        fast, default = self.rendered("/api/billing/", year=self.year)
+        self.assertEqual(fast, default)
+        self.assertIn(b"Zo\\u00eb M\\u00fcller-\\u00d8rsted", fast)
+        self.assertIn(b'"total_income": "244.59"', fast)
+
+    @skipUnless(orjson, "orjson is not installed")
+    def test_orjson_backend_renders_the_same_values(self):
+        data = {"items": [AppointmentOutSchema.model_validate(
+            Appointment.objects.filter(patient=self.patient).first()
+        ).model_dump()], "note": "Zoë", "total": Decimal("1.10")}
+        default = JSONRenderer().render(None, data, response_status=200)
+        self.assertEqual(json.loads(FastJSONRenderer("orjson").render(None, data, response_status=200)), json.loads(default))
+        self.assertEqual(FastJSONRenderer().render(None, data, response_status=200), default)
+
+
+# A clinic small enough to seed and benchmark in a test
+TINY_CLINIC = ["--doctors", "2", "--patients", "5", "--years", "1", "--future-days", "7", "--appointments-per-day", "1"]
+
+
+def seed_clinic(*args):
+    out = StringIO()
+    call_command("seed_clinic", *TINY_CLINIC, *args, stdout=out)
+    return out.getvalue()
+
+
+def seeded_clinic():
+    # Everything seed_clinic writes, without the database ids
+    return {
+        "doctors": list(Doctor.objects.order_by("id").values_list(
+            "user__username", "user__email", "first_name", "last_name", "specialty", "phone",
+        )),
+        "patients": list(Patient.objects.order_by("id").values_list(
+            "first_name", "last_name", "dob", "gender", "phone", "email", "address", "insurance_id",
+        )),
+        "appointments": list(Appointment.objects.order_by("id").values_list(
+            "patient__email", "doctor__user__email", "date_time", "end_time", "reason", "status", "appointment_cost",
+        )),
+        "prescriptions": list(Prescription.objects.order_by("id").values_list(
+            "appointment__patient__email", "appointment__date_time", "medication", "dosage", "date_issued",
+            "prescription_cost",
+        )),
+    }
+
+
+class SeedClinicTests(TestCase):
+    def test_same_seed_same_clinic(self):
+        self.assertIn("Seeded 2 doctor(s), 5 patient(s)", seed_clinic("--seed", "7"))
+        first = seeded_clinic()
+        seed_clinic("--seed", "7", "--flush")
+
+        self.assertEqual(seeded_clinic(), first)
+        self.assertTrue(first["prescriptions"])
+        self.assertEqual({row[5] for row in first["appointments"]}, {
+            Appointment.STATUS_COMPLETED, Appointment.STATUS_CANCELED, Appointment.STATUS_SCHEDULED,
+        })
+
+    def test_other_seed_other_clinic(self):
+        seed_clinic("--seed", "7")
+        first = seeded_clinic()
+        seed_clinic("--seed", "8", "--flush")
+        self.assertNotEqual(seeded_clinic()["appointments"], first["appointments"])
+
+    def test_reseeding_needs_flush(self):
+        seed_clinic()
+        with self.assertRaises(CommandError):
+            seed_clinic()
+        with self.assertRaises(CommandError):
+            call_command("seed_clinic", "--appointments-per-day", "17", stdout=StringIO())
+
+    @override_settings(BILLING_ROLLUP_ENABLED=True)
+    def test_rollup_is_rebuilt_after_the_bulk_inserts(self):
+        seed_clinic()
+        self.assertTrue(BillingRollup.objects.exists())
+        self.assertEqual(billing_rollup.differences(), {})
+
+
+class BenchmarkApiTests(TransactionTestCase):
+    """benchmark_api requests from worker threads, which only see committed rows."""
+
+    def setUp(self):
+        seed_clinic()
+        handle, self.output = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+        self.addCleanup(os.remove, self.output)
+
+    def benchmark(self, *args):
+        out = StringIO()
+        call_command("benchmark_api", "--requests", "2", "--warmup", "0", *args, stdout=out)
+        return out.getvalue()
+
+    def test_every_endpoint_runs_without_errors(self):
+        out = self.benchmark("--concurrency", "2", "--output", self.output)
+        self.assertIn(f"Results written to {self.output}", out)
+        with open(self.output) as f:
+            run = json.load(f)
+
+        self.assertEqual(list(run["results"]), [label for label, _, _ in SCENARIOS])
+        for label, result in run["results"].items():
+            with self.subTest(label=label):
+                self.assertEqual(result["errors"], 0)
+                self.assertEqual(result["requests"], 2)
+                self.assertGreaterEqual(result["queries"], 1)
+        self.assertEqual(run["rows"]["doctors"], 2)
+
+    def test_baseline_comparison(self):
+        self.benchmark("--only", "get_patient,list_doctors", "--output", self.output)
+        out = self.benchmark("--only", "get_patient,list_doctors", "--baseline", self.output, "--threshold", "1000")
+        self.assertIn(f"No regressions against {self.output}", out)
+
+        with open(self.output) as f:
+            run = json.load(f)
+        run["results"]["get_patient"]["queries"] = 0
+        with open(self.output, "w") as f:
+            json.dump(run, f)
+        with self.assertRaisesMessage(CommandError, "1 regression(s)"):
+            self.benchmark("--only", "get_patient", "--baseline", self.output, "--threshold", "1000")
+
+    def test_unknown_endpoints_and_missing_users_are_refused(self):
+        with self.assertRaisesMessage(CommandError, "Unknown endpoint(s): nope"):
+            self.benchmark("--only", "nope")
+        with self.assertRaisesMessage(CommandError, "does not exist"):
+            self.benchmark("--username", "nobody")
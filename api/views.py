@@ -1,19 +1,22 @@
 from django.shortcuts import render
 
 # Create your views here.
-from ninja import NinjaAPI
 from ninja_extra import exceptions
 from ninja_jwt.routers.obtain import obtain_pair_router
 from ninja_jwt.routers.verify import verify_router
 from ninja_jwt.routers.blacklist import blacklist_router
 from .endpoints.management import management_router
-from .endpoints.doctors import doctor_router
-from .endpoints.patients import patient_router
-from .endpoints.appointments import appointment_router
-from .endpoints.prescriptions import prescription_router
-from .endpoints.billing import billing_router
-
-api = NinjaAPI()
+from .endpoints.doctors import doctor_router, doctor_async_router
+from .endpoints.patients import patient_router, patient_async_router
+from .endpoints.appointments import appointment_router, appointment_async_router
+from .endpoints.prescriptions import prescription_router, prescription_async_router
+from .endpoints.billing import billing_router, billing_async_router
+from .endpoints.availability import availability_router
+from .renderers import FastJSONRenderer
+from .metrics import InstrumentedNinjaAPI
+
+# Route labels for the Prometheus metrics at /metrics, fast JSON rendering
+api = InstrumentedNinjaAPI(renderer=FastJSONRenderer())
 
 api.add_router('/token', obtain_pair_router, tags=["Auth"])
 api.add_router('/token/verify', verify_router, tags=["Auth"])
@@ -25,8 +28,16 @@ api.add_router('/patients', patient_router)
 api.add_router('/appointments', appointment_router)
 api.add_router('/prescriptions', prescription_router)
 api.add_router('/billing', billing_router)
+api.add_router('/availability', availability_router)
 api.add_router('/management', management_router)
 
+# Async (ASGI-native) versions of the read endpoints
+api.add_router('/async/doctors', doctor_async_router)
+api.add_router('/async/patients', patient_async_router)
+api.add_router('/async/appointments', appointment_async_router)
+api.add_router('/async/prescriptions', prescription_async_router)
+api.add_router('/async/billing', billing_async_router)
+
 # APIException Handler
 def api_exception_handler(request, exc):
     headers = {}
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.instrumentation.SQLInstrumentationMiddleware',
+    'api.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.replica.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'clinicflow.urls'
@@ -83,6 +88,51 @@ DATABASES = {
     }
 }
 
+# Pragmas run on every new SQLite connection, see api/sqlite.py
+SQLITE_PRAGMAS = {}
+
+# Production SQLite profile, enabled with CLINICFLOW_DB_PROFILE=production:
+# WAL with tuned pragmas, connections reused across requests, and write
+# transactions that take the write lock up front. `manage.py benchmark_sqlite`
+# measures it against the default configuration.
+SQLITE_PRODUCTION_PROFILE = {
+    'DATABASE': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    },
+    'PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024, # in KiB
+        'busy_timeout': 20000,
+        'temp_store': 'MEMORY',
+    },
+}
+if os.environ.get("CLINICFLOW_DB_PROFILE") == "production":
+    DATABASES['default'].update(SQLITE_PRODUCTION_PROFILE['DATABASE'])
+    SQLITE_PRAGMAS = SQLITE_PRODUCTION_PROFILE['PRAGMAS']
+
+# Read replica, enabled with CLINICFLOW_REPLICA_DB naming its SQLite database.
+# List, billing and export endpoints read from it (see api/replica.py); users
+# who just wrote are pinned to the primary for REPLICA_PIN_SECONDS. Locally,
+# use `file:db.sqlite3?mode=ro` or a second file kept current with
+# `manage.py sync_replica`. A Postgres replica takes the same alias.
+REPLICA_DATABASE_ALIAS = 'replica'
+REPLICA_PIN_SECONDS = 5
+if os.environ.get("CLINICFLOW_REPLICA_DB"):
+    DATABASES[REPLICA_DATABASE_ALIAS] = {
+        **DATABASES['default'],
+        'NAME': os.environ["CLINICFLOW_REPLICA_DB"],
+        'OPTIONS': dict(DATABASES['default'].get('OPTIONS', {})),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['api.replica.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -144,4 +194,114 @@ NINJA_JWT = {
 
 # Email settings for development
 # Use console backend to print emails to console instead of sending them
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Billing rollup
+# When enabled, billing_report reads from the BillingRollup table, which is kept
+# up to date on appointment/prescription saves. Run `manage.py rebuild_billing_rollup`
+# before turning it on.
+
+BILLING_ROLLUP_ENABLED = False
+
+
+# Streaming exports
+# Rows fetched per database round trip by the /export/ endpoints.
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+# Authentication
+# Seconds an authenticated user's role and doctor id are cached by ClinicFlowAuth.
+# Saving the User or Doctor invalidates the entry in this process's cache; use a
+# shared CACHES backend so every worker sees the invalidation.
+
+AUTH_PRINCIPAL_CACHE_TIMEOUT = 60
+
+
+# Archive
+# Completed and canceled appointments older than ARCHIVE_AFTER_DAYS, with their
+# prescriptions, are moved to the archive tables by `manage.py archive_history`
+# (see api/archive.py). Billing and patient history reads include the archive
+# where the period needs it. None, the default, turns archival off; e.g. 730
+# keeps two years in the hot tables.
+
+ARCHIVE_AFTER_DAYS = None
+ARCHIVE_BATCH_SIZE = 1000
+
+# Doctor availability
+# Working hours for doctors who have none configured, as (weekday, start, end)
+# with Monday as 0, and the duration of appointments booked without one.
+
+DEFAULT_WORKING_HOURS = [(weekday, "09:00", "17:00") for weekday in range(5)]
+
+APPOINTMENT_DURATION_MINUTES = 30
+
+
+# Email outbox
+# Emails are queued in the email_outbox table inside the request's transaction
+# and sent by `manage.py send_outbox_emails`. Failed sends are retried with
+# exponential backoff starting at EMAIL_OUTBOX_RETRY_DELAY seconds, at most
+# EMAIL_OUTBOX_MAX_ATTEMPTS times.
+
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_DELAY = 30
+
+
+# API rendering
+# JSON backend of the API renderer: "stdlib" renders byte-for-byte like
+# django-ninja's default renderer. "orjson" ("auto": when it is installed) is
+# faster but writes compact, unescaped UTF-8, so the response bytes change.
+
+API_JSON_BACKEND = "stdlib"
+
+
+# SQL instrumentation
+# Every response carries a Server-Timing header with its query time, and a
+# JSON line with query counts and the SQL_SLOW_STATEMENTS slowest statements
+# is logged to api.instrumentation at INFO. The console only shows warnings
+# unless CLINICFLOW_SQL_LOG_LEVEL=INFO is set. Endpoints over their
+# @query_budget are logged as warnings, or fail with QueryBudgetExceeded when
+# QUERY_BUDGET_RAISE is on: set CLINICFLOW_QUERY_BUDGET_RAISE=1 to enable it
+# (the test suite turns it on for its API tests).
+
+SQL_SLOW_STATEMENTS = 3
+QUERY_BUDGET_RAISE = os.environ.get("CLINICFLOW_QUERY_BUDGET_RAISE") == "1"
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api.instrumentation": {
+            "handlers": ["console"],
+            "level": os.environ.get("CLINICFLOW_SQL_LOG_LEVEL", "WARNING"),
+            "propagate": False,
+        },
+    },
+}
+
+
+# Request profiling
+# Admins profile a request by sending it with an X-Profile header or a
+# `profile` query parameter; PROFILING_SAMPLE_RATE also profiles that share of
+# all requests. The newest PROFILING_MAX_FILES profiles are kept in
+# PROFILING_DIR and served at /api/management/profiles/.
+
+PROFILING_ENABLED = True
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_DIR = BASE_DIR / "profiles"
+PROFILING_MAX_FILES = 50
+
+
+# Metrics
+# Prometheus metrics are served at /metrics to scrapers that send
+# `Authorization: Bearer <METRICS_TOKEN>`; set the token through the
+# CLINICFLOW_METRICS_TOKEN environment variable. Without a token, /metrics
+# is only served while DEBUG is on and answers 403 otherwise. With several
+# worker processes, set the PROMETHEUS_MULTIPROC_DIR environment variable,
+# see api/metrics.py.
+
+METRICS_TOKEN = os.environ.get("CLINICFLOW_METRICS_TOKEN")